@@ -0,0 +1,234 @@
+"""Approximate-nearest-neighbour index types and memory-mapped loading for the FAISS stores.
+
+    python ann_index.py convert faiss_legal_db --type ivf_pq
+    python ann_index.py bench faiss_legal_db --types ivf_flat ivf_pq hnsw
+
+The builders write an exact flat index. `convert` rebuilds it as IVF-Flat,
+IVF-PQ or HNSW, training on a sample of the vectors. Vectors keep their
+positions, so the docstore mapping stays valid, and the result is saved with
+save_atomic(). Services open indexes with open_vector_store(), which
+memory-maps them (FAISS_MMAP=1): worker processes then share one copy of the
+index in the page cache instead of each reading it into RAM. It also applies
+FAISS_NPROBE / FAISS_EF_SEARCH. `bench` measures recall@k and per-query latency
+of each type against the flat baseline.
+
+HNSW indexes cannot delete vectors: when fir_ingest.py updates or deletes FIRs
+in an HNSW faiss_fir_db, it edits a flat copy and rebuilds the graph.
+"""
+import argparse
+import json
+import math
+import os
+import time
+
+import numpy as np
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+# Inverted lists visited per IVF query: higher is slower and closer to exact
+FAISS_NPROBE = int(os.environ.get("FAISS_NPROBE", "16"))
+# Candidate list size of an HNSW query: higher is slower and closer to exact
+FAISS_EF_SEARCH = int(os.environ.get("FAISS_EF_SEARCH", "64"))
+FAISS_MMAP = os.environ.get("FAISS_MMAP", "1") == "1"
+# Dimensions per PQ code byte: 384-d BGE vectors -> 48 sub-quantizers of 8 dims
+PQ_DIMS_PER_CODE = 8
+HNSW_M = 32
+
+def default_nlist(n):
+    # ~4 sqrt(n) lists, with at least 39 training points per list
+    return max(1, min(int(4 * math.sqrt(n)), n // 39))
+
+def factory_string(kind, dim, nlist, pq_m=None, hnsw_m=HNSW_M):
+    if kind == "flat":
+        return "Flat"
+    if kind == "ivf_flat":
+        return f"IVF{nlist},Flat"
+    if kind == "ivf_pq":
+        pq_m = pq_m or dim // PQ_DIMS_PER_CODE
+        if dim % pq_m:
+            raise ValueError(f"PQ sub-quantizers ({pq_m}) must divide the dimension ({dim})")
+        return f"IVF{nlist},PQ{pq_m}x8"
+    if kind == "hnsw":
+        return f"HNSW{hnsw_m},Flat"
+    raise ValueError(f"Unknown index type {kind!r}; expected one of {INDEX_TYPES}")
+
+def build_index(vectors, kind, metric=None, nlist=None, pq_m=None, hnsw_m=HNSW_M, train_size=None, seed=0):
+    """Builds a `kind` index over `vectors` (n x d float32), training it on a random sample."""
+    import faiss
+
+    n, dim = vectors.shape
+    nlist = nlist or default_nlist(n)
+    metric = faiss.METRIC_L2 if metric is None else metric
+    index = faiss.index_factory(dim, factory_string(kind, dim, nlist, pq_m, hnsw_m), metric)
+    if not index.is_trained:
+        train_size = min(n, train_size or max(64 * nlist, 10000))
+        sample = vectors[np.random.default_rng(seed).choice(n, train_size, replace=False)]
+        index.train(sample)
+    index.add(vectors)
+    return index
+
+def stored_vectors(index):
+    """All vectors of `index` in id order (approximations for IVF-PQ)."""
+    import faiss
+
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        # IVF indexes only reconstruct by id once they map ids to lists
+        ivf.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+def convert(vector_store, kind, **params):
+    """Replaces `vector_store`'s index with a `kind` index over the same vectors, in the same order."""
+    old = vector_store.index
+    vector_store.index = build_index(stored_vectors(old), kind, metric=old.metric_type, **params)
+    return vector_store
+
+def set_search_params(index, nprobe=FAISS_NPROBE, ef_search=FAISS_EF_SEARCH):
+    import faiss
+
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = nprobe
+    if hasattr(index, "hnsw"):
+        index.hnsw.efSearch = ef_search
+    return index
+
+def read_index(path, mmap=FAISS_MMAP):
+    """faiss.read_index, memory-mapping the vectors when `mmap` is set."""
+    import faiss
+
+    if not mmap:
+        return faiss.read_index(path)
+    with open(path, "rb") as f:
+        fourcc = f.read(4)
+    if fourcc.startswith(b"Iw"):
+        # IVF indexes: the inverted lists are served straight from the file
+        return faiss.read_index(path, faiss.IO_FLAG_MMAP)
+    # Flat and HNSW indexes: the stored vectors are mapped (faiss >= 1.10)
+    return faiss.read_index(path, getattr(faiss, "IO_FLAG_MMAP_IFC", 0))
+
+def open_vector_store(path, embeddings, mmap=FAISS_MMAP, nprobe=FAISS_NPROBE, ef_search=FAISS_EF_SEARCH):
+    """Opens a store for serving, like FAISS.load_local but memory-mapped and tuned.
+
+    Documents are read from docs.sqlite per query (see docstore.py).
+    """
+    from langchain_community.vectorstores import FAISS
+    from docstore import open_docstore
+    from index_store import resolve_index
+
+    path = resolve_index(path)
+    index = set_search_params(read_index(os.path.join(path, "index.faiss"), mmap), nprobe, ef_search)
+    docstore, index_to_docstore_id = open_docstore(path)
+    return FAISS(embeddings, index, docstore, index_to_docstore_id)
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100.0 * (len(values) - 1))))]
+
+def bench(vectors, types, k=4, queries=500, nprobes=(1, 4, 16, 64), ef_searches=(16, 64, 256), seed=0, **params):
+    """recall@k and single-query latency of each index type against exact search.
+
+    `queries` vectors are held out of the index and used as queries, so no query
+    finds itself. Returns one row per (type, search parameter).
+    """
+    import faiss
+
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(len(vectors))
+    query_vectors, base = vectors[order[:queries]], vectors[order[queries:]]
+
+    rows = []
+    truth = None
+    for kind in ("flat",) + tuple(t for t in types if t != "flat"):
+        start = time.perf_counter()
+        index = build_index(base, kind, seed=seed, **params)
+        build_seconds = time.perf_counter() - start
+        size_mb = faiss.serialize_index(index).nbytes / 2 ** 20
+
+        if faiss.try_extract_index_ivf(index) is not None:
+            settings = [("nprobe", value) for value in nprobes]
+        elif hasattr(index, "hnsw"):
+            settings = [("efSearch", value) for value in ef_searches]
+        else:
+            settings = [(None, None)]
+
+        for name, value in settings:
+            if name is not None:
+                set_search_params(index, nprobe=value, ef_search=value)
+            latencies, found = [], []
+            for query in query_vectors:
+                start = time.perf_counter()
+                _, ids = index.search(query[None, :], k)
+                latencies.append(time.perf_counter() - start)
+                found.append(ids[0])
+            if truth is None:
+                truth = found
+            recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(found, truth)])
+            rows.append({
+                "type": kind,
+                "param": f"{name}={value}" if name else "",
+                f"recall@{k}": round(float(recall), 4),
+                "p50_ms": round(_percentile(latencies, 50) * 1000, 3),
+                "p99_ms": round(_percentile(latencies, 99) * 1000, 3),
+                "build_seconds": round(build_seconds, 2),
+                "size_mb": round(size_mb, 1),
+            })
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert FAISS stores to ANN indexes and benchmark them")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    convert_parser = sub.add_parser("convert", help="rebuild a store's index as another type")
+    convert_parser.add_argument("path")
+    convert_parser.add_argument("--type", choices=INDEX_TYPES, required=True)
+
+    bench_parser = sub.add_parser("bench", help="recall@k and latency against the flat baseline")
+    bench_parser.add_argument("path")
+    bench_parser.add_argument("--types", nargs="+", choices=INDEX_TYPES, default=["ivf_flat", "ivf_pq", "hnsw"])
+    bench_parser.add_argument("--k", type=int, default=4)
+    bench_parser.add_argument("--queries", type=int, default=500)
+    bench_parser.add_argument("--nprobe", nargs="+", type=int, default=[1, 4, 16, 64])
+    bench_parser.add_argument("--ef-search", nargs="+", type=int, default=[16, 64, 256])
+    bench_parser.add_argument("--threads", type=int, help="FAISS OpenMP threads (default: all cores)")
+    bench_parser.add_argument("--report", help="write the rows as JSON here")
+
+    for p in (convert_parser, bench_parser):
+        p.add_argument("--nlist", type=int, help="IVF lists (default ~4 sqrt(n))")
+        p.add_argument("--pq-m", type=int, help="PQ sub-quantizers (default dim / 8)")
+        p.add_argument("--hnsw-m", type=int, default=HNSW_M)
+        p.add_argument("--train-size", type=int)
+    args = parser.parse_args()
+    params = {"nlist": args.nlist, "pq_m": args.pq_m, "hnsw_m": args.hnsw_m, "train_size": args.train_size}
+
+    import faiss
+    from index_store import resolve_index
+
+    if args.command == "convert":
+        from docstore import load_store
+        from index_store import index_lock, save_atomic
+
+        with index_lock(args.path):
+            # No embedding model needed: the vectors are already in the index
+            vector_store = load_store(args.path, None)
+            start = time.perf_counter()
+            convert(vector_store, args.type, **params)
+            print(f"Built {args.type} index over {vector_store.index.ntotal} vectors in "
+                  f"{time.perf_counter() - start:.1f}s")
+            print(f"Saved to {save_atomic(vector_store, args.path)}")
+        return
+
+    if args.threads:
+        faiss.omp_set_num_threads(args.threads)
+    vectors = stored_vectors(read_index(os.path.join(resolve_index(args.path), "index.faiss"), mmap=False))
+    rows = bench(vectors, args.types, k=args.k, queries=args.queries, nprobes=args.nprobe,
+                 ef_searches=args.ef_search, **params)
+    columns = list(rows[0])
+    print("  ".join(f"{column:>14}" for column in columns))
+    for row in rows:
+        print("  ".join(f"{row[column]!s:>14}" for column in columns))
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+
+if __name__ == "__main__":
+    main()
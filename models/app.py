@@ -1,21 +1,14 @@
-from flask import Flask, request, jsonify
-import torch
-import cv2
-from PIL import Image
-from collections import Counter
-import torchvision.transforms as transforms
-import os
-import time
-from threading import Thread
+from flask import Flask, request, jsonify, Response, stream_with_context
+import json
 
-app = Flask(__name__)
+from upload_buffer import detach_upload, install_upload_handling, upload_digest, upload_path
+from result_cache import ResultCache
+from readiness import ServiceLoader, install_health_routes, WARMUP_ITERATIONS
+from metrics import install_metrics, observe_stage_times, timed, timed_stream
 
-RESOLUTION = 224 
-transformer = transforms.Compose([
-    transforms.ToTensor(),
-    transforms.Normalize(mean=[0.5], std=[0.5]),
-    transforms.Resize((RESOLUTION, RESOLUTION))
-])
+app = Flask(__name__)
+install_upload_handling(app)
+install_metrics(app, "app")
 
 num_classes = 8
 class_labels = {
@@ -29,101 +22,175 @@ class_labels = {
     7: "Normal"
 }
 
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 # repo_id = "namban4123/crimemodel"  
 # filename = "crime_tcn_jit.pt" 
 # scripted_model_path = hf_hub_download(repo_id=repo_id, filename=filename)
 
 scripted_model_path = "crime_tcn_jit.pt"  # Ensure this file is available
-model = torch.jit.load(scripted_model_path, map_location=device)
-model.to(device)
-model.eval()
-
-def preprocess_frame(frame):
-    frame_yuv = cv2.cvtColor(frame, cv2.COLOR_BGR2YUV)
-    Y_channel, _, _ = cv2.split(frame_yuv)
-    pil_frame = Image.fromarray(Y_channel)
-    input_tensor = transformer(pil_frame)
-    return input_tensor.unsqueeze(0)
-
-def infer_video(video_path):
-    cap = cv2.VideoCapture(video_path)
-    frame_predictions = []
-    start_time = time.time()
-    
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-        
-        input_tensor = preprocess_frame(frame)
-        with torch.no_grad():
-            output = model(input_tensor.to(device))
-            predicted = output.argmax(dim=1).item()
-            frame_predictions.append(predicted)
-    
-    cap.release()
+
+# Set by load_model_state() on the loader thread
+device = model = scheduler = stream_manager = MODEL_VERSION = None
+
+# Re-uploaded clips are answered from here instead of being classified again
+result_cache = ResultCache()
+
+def load_model_state():
+    # torch and the model are imported here so the port binds before they are loaded
+    global device, model, scheduler, stream_manager, MODEL_VERSION
+    import torch
+    from inference_backend import backend_version, load_backend
+    from inference_scheduler import InferenceScheduler, SCHEDULER_ENABLED
+    from live_streams import StreamManager
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    # TorchScript or ONNX Runtime, see INFERENCE_BACKEND
+    model = load_backend(scripted_model_path, device)
+    device = model.device
+
+    # Frames from concurrent /predict requests share forward passes through the scheduler
+    scheduler = InferenceScheduler(model, device).start() if SCHEDULER_ENABLED else None
+
+    MODEL_VERSION = backend_version(scripted_model_path)
+
+    # Headless live sources (webcams, files, RTSP) sharing the model in one batch per cycle
+    stream_manager = StreamManager(scheduler or model, device, class_labels)
+
+def warmup_model_state():
+    from video_inference import warmup_model
+    warmup_model(model, device, iterations=WARMUP_ITERATIONS)
+
+# /readyz turns 200 once the model is loaded and warm
+loader = ServiceLoader("app", load_model_state, warmup_model_state).start()
+install_health_routes(app, loader)
+
+def infer_video(video_path, **options):
+    from video_inference import infer_video as run_inference
+    return run_inference(scheduler or model, video_path, device, class_labels, **options)
+
+def stream_timeline(video_file, options):
+    """Streams per-window results as NDJSON while the video is still being classified."""
+    from video_inference import infer_timeline
     
-    if not frame_predictions:
-        return "Unknown", time.time() - start_time
+    upload = detach_upload(video_file)
     
-    final_prediction = Counter(frame_predictions).most_common(1)[0][0]
-    inference_time = time.time() - start_time
+    def generate():
+        try:
+            for entry in infer_timeline(scheduler or model, upload_path(upload), device, class_labels, **options):
+                yield json.dumps(entry) + "\n"
+        finally:
+            upload.close()
     
-    return class_labels.get(final_prediction, "Unknown"), inference_time
+    return Response(stream_with_context(timed_stream(generate())), mimetype="application/x-ndjson")
 
 @app.route('/predict', methods=['POST'])
 def predict():
-    if 'video' not in request.files:
+    from video_inference import inference_options, timeline_options, PREPROCESS_VERSION
+    
+    # The multipart body is parsed into the upload buffer on first access
+    with timed("upload_receive"):
+        files = request.files
+    if 'video' not in files:
         return jsonify({"error": "No video file provided"}), 400
     
-    video_file = request.files['video']
-    temp_video_path = "temp_video.mp4"
-    video_file.save(temp_video_path)
+    timeline = request.form.get("mode") == "timeline"
+    try:
+        if timeline:
+            options = timeline_options(request.form)
+        else:
+            options = inference_options(request.form)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    # The upload lives in a per-request in-memory file, closed (and freed) here
+    video_file = files['video']
+    if timeline:
+        return stream_timeline(video_file, options)
+    
+    try:
+        cache_key = result_cache.key(upload_digest(video_file), MODEL_VERSION, PREPROCESS_VERSION, options)
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            return jsonify({**cached, "cached": True})
+        
+        result = infer_video(upload_path(video_file), **options)
+    finally:
+        video_file.close()
     
-    prediction, inference_time = infer_video(temp_video_path)
-    os.remove(temp_video_path)
+    observe_stage_times(result["stage_times"])
+    result_cache.put(cache_key, result)
+    return jsonify({**result, "cached": False})
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    return jsonify(result_cache.stats())
+
+@app.route('/scheduler_stats', methods=['GET'])
+def scheduler_stats():
+    if scheduler is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **scheduler.stats()})
+
+@app.route('/start_live', methods=['GET'])
+def start_live():
+    from live_streams import StreamLimitReached
     
+    # Kept for the existing client: starts webcam 0 (or ?source=) as a managed stream
+    try:
+        stream_id = stream_manager.start_stream(request.args.get("source", 0))
+    except StreamLimitReached as e:
+        return jsonify({"error": str(e)}), 429
+    return jsonify({"message": "Live inference started.", "stream_id": stream_id})
+
+@app.route('/live_predict', methods=['GET'])
+def live_predict():
+    # Latest result of the most recently started stream, in the /predict response shape
+    streams = stream_manager.list()
+    if not streams:
+        return jsonify({"error": "No live stream running"}), 404
+    latest = streams[-1]
     return jsonify({
-        "predicted_class": prediction,
-        "inference_time": inference_time
+        "stream_id": latest["id"],
+        "predicted_class": latest["prediction"] or "Unknown",
+        "inference_time": latest["latency_ms"] / 1000.0,
+        "fps": latest["fps"],
     })
 
-def live_inference():
-    cap = cv2.VideoCapture(0)
-    if not cap.isOpened():
-        print("Error: Unable to access the webcam.")
-        return
+@app.route('/streams', methods=['POST'])
+def start_stream():
+    from live_streams import StreamLimitReached
     
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            print("Error: Unable to retrieve frame from webcam.")
-            break
-        
-        start_time = time.time()
-        input_tensor = preprocess_frame(frame)
-        with torch.no_grad():
-            outputs = model(input_tensor.to(device))
-            predicted = outputs.argmax(dim=1).item()
-        inference_time = time.time() - start_time
-        
-        overlay_text = f"Pred: {class_labels.get(predicted, 'Unknown')} | {inference_time:.2f}s"
-        cv2.putText(frame, overlay_text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX,
-                    1, (0, 255, 0), 2, cv2.LINE_AA)
+    data = request.get_json(silent=True) or {}
+    source = data.get("source")
+    if source is None or source == "":
+        return jsonify({"error": "'source' is required (device index, file path or RTSP URL)"}), 400
+    loop = data.get("loop", False)
+    if not isinstance(loop, bool):
+        return jsonify({"error": "'loop' must be true or false"}), 400
+    try:
+        stream_id = stream_manager.start_stream(source, loop=loop, motion_gate=data.get("motion_gate"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except StreamLimitReached as e:
+        return jsonify({"error": str(e)}), 429
+    return jsonify(stream_manager.get(stream_id)), 201
 
-        cv2.imshow("Live Inference - Press 'q' to exit", frame)
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
-    
-    cap.release()
-    cv2.destroyAllWindows()
+@app.route('/streams', methods=['GET'])
+def list_streams():
+    return jsonify({"streams": stream_manager.list(), "max_streams": stream_manager.max_streams})
 
-@app.route('/start_live', methods=['GET'])
-def start_live():
-    thread = Thread(target=live_inference)
-    thread.start()
-    return jsonify({"message": "Live inference started."})
+@app.route('/streams/<stream_id>', methods=['GET'])
+def get_stream(stream_id):
+    stats = stream_manager.get(stream_id)
+    if stats is None:
+        return jsonify({"error": "Unknown stream"}), 404
+    return jsonify(stats)
+
+@app.route('/streams/<stream_id>', methods=['DELETE'])
+def stop_stream(stream_id):
+    stats = stream_manager.stop_stream(stream_id)
+    if stats is None:
+        return jsonify({"error": "Unknown stream"}), 404
+    return jsonify(stats)
 
 if __name__ == '__main__':
     app.run(host="0.0.0.0", port=5000)
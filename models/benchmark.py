@@ -0,0 +1,356 @@
+"""Benchmarks the video classification pipeline on synthetic videos.
+
+    python benchmark.py --stub --concurrency 1 4 --output run.json
+    python benchmark.py --stub --output new.json --baseline run.json
+
+Generates clips locally with cv2.VideoWriter (WIDTHxHEIGHTxFRAMES[:FOURCC] specs),
+measures decode, preprocess and inference throughput per clip, then starts a
+service (or targets --url) and measures /predict latency percentiles under each
+client concurrency. Results are written as JSON; with --baseline every metric is
+compared against an earlier run and regressions beyond --tolerance fail the run.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import torch
+
+MODELS_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_VIDEOS = ["320x240x150:MJPG", "640x480x300:mp4v", "1280x720x300:mp4v", "1920x1080x120:XVID"]
+EXTENSIONS = {"MJPG": ".avi", "XVID": ".avi", "mp4v": ".mp4", "avc1": ".mp4"}
+# Environment knobs recorded with every run, so results can be told apart
+RECORDED_ENV = ("INFERENCE_BACKEND", "MODEL_VARIANT", "CHANNELS_LAST", "INFER_BATCH_SIZE", "SAMPLING_POLICY",
+                "INFER_PIPELINE", "PREPROCESS_WORKERS", "FAST_PREPROCESS", "INFER_SCHEDULER",
+                "VIDEO_WORKERS", "TORCH_INTRA_THREADS", "ORT_THREADS")
+# Metrics compared against a baseline, with whether bigger is better
+COMPARED = {"decode_fps": True, "preprocess_fps": True, "inference_fps": True, "end_to_end_fps": True,
+            "p50": False, "p90": False, "p99": False, "throughput_rps": True}
+
+def parse_video_spec(spec):
+    size, _, codec = spec.partition(":")
+    width, height, frames = (int(part) for part in size.lower().split("x"))
+    return width, height, frames, codec or "mp4v"
+
+def make_video(path, width, height, frames, codec="mp4v", fps=30.0):
+    """Writes a synthetic clip of drifting gradients and a moving disc."""
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*codec), fps, (width, height))
+    if not writer.isOpened():
+        raise RuntimeError(f"OpenCV cannot encode {codec} here")
+
+    xs = np.linspace(0, 255, width, dtype=np.float32)
+    ys = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    background = np.empty((height, width, 3), dtype=np.uint8)
+    background[..., 2] = (xs + ys) / 2
+    radius = max(4, height // 8)
+    try:
+        for i in range(frames):
+            frame = background.copy()
+            frame[..., 0] = (xs + i * 3) % 256
+            frame[..., 1] = (ys + i * 2) % 256
+            x = radius + (i * 7) % max(1, width - 2 * radius)
+            cv2.circle(frame, (x, height // 2), radius, (40, 220, 90), -1)
+            writer.write(frame)
+    finally:
+        writer.release()
+    return path
+
+def make_stub_model(path, num_classes=8):
+    """Saves a tiny TorchScript model with the crime TCN's input and output shapes."""
+    model = torch.nn.Sequential(
+        torch.nn.Conv2d(1, 16, kernel_size=5, stride=4),
+        torch.nn.ReLU(),
+        torch.nn.Conv2d(16, 32, kernel_size=3, stride=2),
+        torch.nn.ReLU(),
+        torch.nn.AdaptiveAvgPool2d(1),
+        torch.nn.Flatten(),
+        torch.nn.Linear(32, num_classes),
+    ).eval()
+    torch.jit.save(torch.jit.script(model), path)
+    return path
+
+def percentiles(values):
+    if not values:
+        return {}
+    values = np.asarray(values) * 1000.0
+    return {
+        "p50": float(np.percentile(values, 50)),
+        "p90": float(np.percentile(values, 90)),
+        "p99": float(np.percentile(values, 99)),
+        "mean": float(values.mean()),
+        "max": float(values.max()),
+    }
+
+def _rate(count, seconds):
+    return count / seconds if seconds > 0 else None
+
+def bench_stages(model, device, video_path, class_mapping, batch_size):
+    """Throughput of each pipeline stage on its own, then of infer_video end to end."""
+    from video_inference import _preprocessing, infer_video, iter_frames, predict_batch
+
+    preprocess, collate = _preprocessing(batch_size)
+    stats = {"frames_decoded": 0, "frames_planned": None}
+    decode_seconds = preprocess_seconds = 0.0
+    processed = []
+
+    frames = iter_frames(video_path, stats, sampling="all")
+    while True:
+        start = time.perf_counter()
+        frame = next(frames, None)
+        decoded = time.perf_counter()
+        decode_seconds += decoded - start
+        if frame is None:
+            break
+        processed.append(preprocess(frame))
+        preprocess_seconds += time.perf_counter() - decoded
+
+    # One warm-up batch so lazy initialisation is not billed to inference
+    predict_batch(model, collate(processed[:batch_size]), device)
+    inference_seconds = 0.0
+    for i in range(0, len(processed), batch_size):
+        start = time.perf_counter()
+        batch = collate(processed[i:i + batch_size])
+        collated = time.perf_counter()
+        predict_batch(model, batch, device).cpu()
+        preprocess_seconds += collated - start
+        inference_seconds += time.perf_counter() - collated
+
+    start = time.perf_counter()
+    result = infer_video(model, video_path, device, class_mapping, batch_size=batch_size)
+    end_to_end = time.perf_counter() - start
+
+    count = len(processed)
+    return {
+        "frames": count,
+        "decode_fps": _rate(count, decode_seconds),
+        "preprocess_fps": _rate(count, preprocess_seconds),
+        "inference_fps": _rate(count, inference_seconds),
+        "end_to_end_fps": _rate(result["frames_classified"], end_to_end),
+        "end_to_end_seconds": end_to_end,
+        "stage_times": result["stage_times"],
+    }
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_service(service, model_path, port, workdir, timeout=120):
+    """Runs `service`.app on a local port from `workdir`, where it links crime_tcn_jit.pt.
+
+    The result cache is disabled in the child, otherwise repeated uploads of the
+    same clip would be answered without running the pipeline. The caller removes
+    `workdir` once the process has stopped.
+    """
+    os.makedirs(workdir, exist_ok=True)
+    os.symlink(os.path.abspath(model_path), os.path.join(workdir, "crime_tcn_jit.pt"))
+    onnx_model = os.path.splitext(os.path.abspath(model_path))[0] + ".onnx"
+    if os.path.exists(onnx_model):
+        os.symlink(onnx_model, os.path.join(workdir, "crime_tcn_jit.onnx"))
+
+    env = dict(os.environ, RESULT_CACHE_SIZE="0", PYTHONPATH=MODELS_DIR)
+    env.pop("RESULT_CACHE_DIR", None)
+    code = f"import {service}; {service}.app.run(host='127.0.0.1', port={port}, threaded=True)"
+    process = subprocess.Popen([sys.executable, "-c", code], cwd=workdir, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    import requests
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{service} exited with code {process.returncode} during startup")
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/readyz", timeout=1).status_code == 200:
+                return process
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"{service} did not start within {timeout}s")
+
+def bench_http(url, video_path, concurrency, requests_per_client, form=None):
+    """Posts `video_path` to /predict from `concurrency` clients and times every request."""
+    import requests
+
+    with open(video_path, "rb") as f:
+        body = f.read()
+    name = os.path.basename(video_path)
+
+    def client(_):
+        latencies, errors = [], 0
+        with requests.Session() as session:
+            for _ in range(requests_per_client):
+                start = time.perf_counter()
+                try:
+                    response = session.post(url, files={"video": (name, body)}, data=form or {}, timeout=600)
+                    ok = response.status_code == 200
+                except requests.RequestException:
+                    ok = False
+                if ok:
+                    latencies.append(time.perf_counter() - start)
+                else:
+                    errors += 1
+        return latencies, errors
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(client, range(concurrency)))
+    wall = time.perf_counter() - start
+
+    latencies = [latency for client_latencies, _ in results for latency in client_latencies]
+    return {
+        "concurrency": concurrency,
+        "requests": concurrency * requests_per_client,
+        "errors": sum(errors for _, errors in results),
+        "throughput_rps": _rate(len(latencies), wall),
+        **percentiles(latencies),
+    }
+
+def compare(current, baseline, tolerance):
+    """Lists metrics that moved by more than `tolerance` (a fraction) against a baseline run."""
+    def flatten(run):
+        metrics = {}
+        for video in run.get("stages", []):
+            for name, value in video.items():
+                if name in COMPARED and value is not None:
+                    metrics[(f"stages/{video['video']}", name)] = value
+        for entry in run.get("http", []):
+            for name, value in entry.items():
+                if name in COMPARED and value is not None:
+                    metrics[(f"http/{entry['video']}/c{entry['concurrency']}", name)] = value
+        return metrics
+
+    before, after = flatten(baseline), flatten(current)
+    changes = []
+    for key in sorted(before.keys() & after.keys()):
+        old, new = before[key], after[key]
+        if not old:
+            continue
+        change = (new - old) / old
+        higher_is_better = COMPARED[key[1]]
+        regressed = change < -tolerance if higher_is_better else change > tolerance
+        improved = change > tolerance if higher_is_better else change < -tolerance
+        changes.append({
+            "scope": key[0], "metric": key[1], "baseline": old, "current": new,
+            "change": round(change, 4), "status": "regressed" if regressed else "improved" if improved else "same",
+        })
+    return changes
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the video classification pipeline")
+    parser.add_argument("--model", default="crime_tcn_jit.pt")
+    parser.add_argument("--stub", action="store_true", help="use a generated stub model instead of --model")
+    parser.add_argument("--videos", nargs="+", default=DEFAULT_VIDEOS, help="WIDTHxHEIGHTxFRAMES[:FOURCC]")
+    parser.add_argument("--batch-size", type=int)
+    parser.add_argument("--service", default="video_classify", choices=["video_classify", "app", "live"])
+    parser.add_argument("--url", help="benchmark a running /predict endpoint instead of starting --service")
+    parser.add_argument("--http-video", default=0, type=int, help="index into --videos posted to /predict")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4])
+    parser.add_argument("--requests", type=int, default=5, help="requests per client")
+    parser.add_argument("--skip-stages", action="store_true")
+    parser.add_argument("--skip-http", action="store_true")
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--baseline", help="earlier --output to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args()
+
+    sys.path.insert(0, MODELS_DIR)
+    from inference_backend import load_backend
+    from video_inference import BATCH_SIZE
+
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    try:
+        model_path = make_stub_model(os.path.join(workdir, "stub_tcn.pt")) if args.stub else args.model
+        if args.stub and os.environ.get("INFERENCE_BACKEND") == "onnx":
+            from inference_backend import export_onnx
+            export_onnx(model_path, os.path.splitext(model_path)[0] + ".onnx")
+        batch_size = args.batch_size or BATCH_SIZE
+        class_mapping = {i: str(i) for i in range(8)}
+
+        videos = []
+        for spec in args.videos:
+            width, height, frames, codec = parse_video_spec(spec)
+            path = os.path.join(workdir, f"{width}x{height}x{frames}_{codec}{EXTENSIONS.get(codec, '.avi')}")
+            try:
+                make_video(path, width, height, frames, codec)
+            except RuntimeError as e:
+                print(f"Skipping {spec}: {e}")
+                continue
+            videos.append((spec, path))
+        if not videos:
+            raise SystemExit("No benchmark video could be encoded")
+
+        report = {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "model": "stub" if args.stub else os.path.abspath(model_path),
+            "batch_size": batch_size,
+            "environment": {
+                "python": platform.python_version(),
+                "torch": torch.__version__,
+                "opencv": cv2.__version__,
+                "cpus": os.cpu_count(),
+                "machine": platform.machine(),
+                **{name: os.environ[name] for name in RECORDED_ENV if name in os.environ},
+            },
+            "stages": [],
+            "http": [],
+        }
+
+        if not args.skip_stages:
+            model = load_backend(model_path, torch.device("cuda" if torch.cuda.is_available() else "cpu"))
+            for spec, path in videos:
+                result = bench_stages(model, model.device, path, class_mapping, batch_size)
+                report["stages"].append({"video": spec, **result})
+                print(f"{spec}: decode {result['decode_fps']:.0f} fps, preprocess {result['preprocess_fps']:.0f} fps, "
+                      f"inference {result['inference_fps']:.0f} fps, end to end {result['end_to_end_fps']:.0f} fps")
+
+        if not args.skip_http:
+            spec, path = videos[min(args.http_video, len(videos) - 1)]
+            process = None
+            url = args.url
+            if url is None:
+                port = _free_port()
+                process = start_service(args.service, model_path, port, os.path.join(workdir, "service"))
+                url = f"http://127.0.0.1:{port}/predict"
+            try:
+                for concurrency in args.concurrency:
+                    result = bench_http(url, path, concurrency, args.requests)
+                    report["http"].append({"video": spec, **result})
+                    print(f"/predict {spec} x{concurrency}: p50 {result.get('p50', 0):.0f} ms, "
+                          f"p99 {result.get('p99', 0):.0f} ms, {result['throughput_rps'] or 0:.2f} req/s, "
+                          f"{result['errors']} errors")
+            finally:
+                if process is not None:
+                    process.terminate()
+                    process.wait(timeout=10)
+    finally:
+        # The generated videos, stub model and service work dir
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            changes = compare(report, json.load(f), args.tolerance)
+        report["comparison"] = {"baseline": args.baseline, "tolerance": args.tolerance, "changes": changes}
+        for change in changes:
+            if change["status"] != "same":
+                print(f"{change['status']}: {change['scope']} {change['metric']} "
+                      f"{change['baseline']:.2f} -> {change['current']:.2f} ({change['change']:+.1%})")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved {args.output}")
+
+    if any(change["status"] == "regressed" for change in report.get("comparison", {}).get("changes", [])):
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
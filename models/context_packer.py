@@ -0,0 +1,127 @@
+"""Packs retrieved chunks into a prompt context under a token budget.
+
+The chunks come from RecursiveCharacterTextSplitter(chunk_size=512,
+chunk_overlap=50), so neighbouring chunks of one record repeat up to 50
+characters, and QA records of the same case repeat its "Case: ... | Date: ..."
+header. pack_context() merges chunks of the same record back into one passage
+without the overlap, drops duplicate chunks, writes each case header once, and
+fills CONTEXT_TOKEN_BUDGET with passages in retrieval rank order. It also
+reports how many tokens that saved compared with the plain join of the top
+TOP_K chunks that the services sent before.
+"""
+import os
+import re
+from collections import OrderedDict
+
+from retrieval import TOP_K
+
+# Prompt tokens spent on retrieved context at most. Four ~128-token legal chunks join to
+# about 512, so the budget trims the longest contexts; FIR chunks are far shorter
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "480"))
+# Chunks retrieved for packing: the top-k the services sent unpacked, so prompts never grow
+CONTEXT_CANDIDATES = int(os.environ.get("CONTEXT_CANDIDATES", str(TOP_K)))
+# Shorter common text between neighbouring chunks is treated as coincidence, not splitter overlap
+MIN_OVERLAP_CHARS = 10
+MAX_OVERLAP_CHARS = 200
+
+_CASE_HEADER = re.compile(r"^(Case: [^\n]*)\n")
+_SPACE = re.compile(r"\s+")
+
+def estimate_tokens(text):
+    # Mistral's tokenizer averages about 4 characters per token on English text
+    return (len(text) + 3) // 4
+
+def _source(doc):
+    """The record a chunk came from: legal_db's record number or fir_ingest's fir_id."""
+    metadata = doc.metadata
+    if "record" in metadata:
+        return ("record", metadata["record"])
+    if "fir_id" in metadata:
+        return ("fir", metadata["fir_id"])
+    return None
+
+def _join(left, right, adjacent):
+    for size in range(min(len(left), len(right), MAX_OVERLAP_CHARS), MIN_OVERLAP_CHARS - 1, -1):
+        if left.endswith(right[:size]):
+            return left + right[size:]
+    # Neighbouring chunks the splitter cut at whitespace, or separate parts of one record
+    return f"{left} {right}" if adjacent else f"{left}\n...\n{right}"
+
+def _passages(documents):
+    """[rank, text] per source record, in rank order of each record's best chunk."""
+    seen = set()
+    groups = OrderedDict()
+    for rank, doc in enumerate(documents):
+        text = doc.page_content.strip()
+        fingerprint = _SPACE.sub(" ", text)
+        if not text or fingerprint in seen:
+            continue
+        seen.add(fingerprint)
+        source = _source(doc) or ("chunk", rank)
+        groups.setdefault(source, []).append((doc.metadata.get("chunk"), rank, text))
+
+    passages = []
+    for chunks in groups.values():
+        best_rank = min(rank for _, rank, _ in chunks)
+        # Back in reading order when chunk numbers are known, else in rank order
+        chunks.sort(key=lambda chunk: (chunk[0] is None, chunk[0] if chunk[0] is not None else chunk[1]))
+        text = chunks[0][2]
+        for (previous, _, _), (number, _, chunk_text) in zip(chunks, chunks[1:]):
+            adjacent = previous is not None and number == previous + 1
+            text = _join(text, chunk_text, adjacent)
+        passages.append([best_rank, text])
+    return passages
+
+def _merge_case_headers(passages):
+    """Passages of the same case share one header line."""
+    merged = OrderedDict()
+    for rank, text in sorted(passages):
+        match = _CASE_HEADER.match(text)
+        key = match.group(1) if match else ("passage", rank)
+        if key in merged and match:
+            merged[key][1] += "\n\n" + text[match.end():]
+        else:
+            merged[key] = [rank, text]
+    return list(merged.values())
+
+def _truncate(text, tokens):
+    limit = tokens * 4
+    if len(text) <= limit:
+        return text
+    # Room for the " ..." marker, so the result stays within `tokens`
+    limit -= 4
+    cut = text.rfind(" ", 0, limit)
+    return text[:cut if cut > 0 else limit].rstrip() + " ..."
+
+def pack_context(documents, budget=CONTEXT_TOKEN_BUDGET, separator="\n\n"):
+    """Packs `documents` (best match first) into a context string; returns (context, report)."""
+    documents = list(documents)
+    # What the services sent before packing: the top TOP_K chunks joined as they are
+    unpacked_tokens = estimate_tokens(separator.join(doc.page_content for doc in documents[:TOP_K]))
+    passages = _merge_case_headers(_passages(documents))
+
+    packed, used, dropped = [], 0, 0
+    for _, text in passages:
+        cost = estimate_tokens(text) + (estimate_tokens(separator) if packed else 0)
+        if used + cost <= budget:
+            packed.append(text)
+            used += cost
+        elif not packed:
+            # The best passage alone is over budget: keep as much of it as fits
+            packed.append(_truncate(text, budget))
+            used = estimate_tokens(packed[0])
+        else:
+            dropped += 1
+
+    context = separator.join(packed)
+    tokens = estimate_tokens(context)
+    report = {
+        "chunks": len(documents),
+        "passages": len(packed),
+        "dropped": dropped,
+        "tokens_unpacked": unpacked_tokens,
+        "tokens": tokens,
+        # Joining a record's separate parts or truncating can add a few tokens; that is not a saving
+        "tokens_saved": max(0, unpacked_tokens - tokens),
+    }
+    return context, report
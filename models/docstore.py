@@ -0,0 +1,199 @@
+"""SQLite docstore for the FAISS stores, replacing LangChain's pickled index.pkl.
+
+Each store directory holds index.faiss and docs.sqlite, with one row per
+vector: its FAISS position, docstore id, text and JSON metadata. Services open
+the table read-only and memory-mapped, and fetch only the rows of the
+top-k hits for each query. Startup does not unpickle the whole corpus, and
+worker processes share the file's pages instead of each holding a Python copy
+of every document. Writers (fir_ingest.py, legal_db.py, ann_index.py convert)
+load everything into an InMemoryDocstore with load_store() and write back with
+save_store().
+
+    python docstore.py convert faiss_fir_db faiss_legal_db
+
+converts stores saved with index.pkl; until then they are still loaded from the
+pickle.
+"""
+import argparse
+import json
+import os
+import pickle
+import queue
+import sqlite3
+import time
+from collections.abc import Mapping
+from contextlib import contextmanager
+
+DOCSTORE_FILE = "docs.sqlite"
+# Bytes of docs.sqlite SQLite may map instead of reading through its page cache
+DOCSTORE_MMAP_BYTES = int(os.environ.get("DOCSTORE_MMAP_BYTES", str(1 << 30)))
+# SQLite connections a store opens when it loads; concurrent queries past this wait for one
+DOCSTORE_CONNECTIONS = int(os.environ.get("DOCSTORE_CONNECTIONS", "8"))
+# Keeps IN (...) lists under SQLite's bound-parameter limit on old builds
+_MAX_PARAMS = 900
+
+def write_docstore(vector_store, path):
+    """Writes `vector_store`'s documents to <path>/docs.sqlite, keyed by FAISS position."""
+    db_path = os.path.join(path, DOCSTORE_FILE)
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    rows = []
+    for position, docstore_id in vector_store.index_to_docstore_id.items():
+        document = vector_store.docstore.search(docstore_id)
+        rows.append((int(position), docstore_id, document.page_content, json.dumps(document.metadata)))
+
+    connection = sqlite3.connect(db_path)
+    try:
+        connection.execute(
+            "CREATE TABLE docs (id INTEGER PRIMARY KEY, docstore_id TEXT NOT NULL UNIQUE, "
+            "page_content TEXT NOT NULL, metadata TEXT NOT NULL)"
+        )
+        with connection:
+            connection.executemany("INSERT INTO docs VALUES (?, ?, ?, ?)", rows)
+    finally:
+        connection.close()
+
+def save_store(vector_store, path):
+    """Like FAISS.save_local, but with docs.sqlite instead of index.pkl."""
+    import faiss
+
+    os.makedirs(path, exist_ok=True)
+    faiss.write_index(vector_store.index, os.path.join(path, "index.faiss"))
+    write_docstore(vector_store, path)
+
+class SqliteDocstore:
+    """Read-only docstore over docs.sqlite; rows are only read when asked for.
+
+    Has the `search(docstore_id)` method LangChain's FAISS calls, plus
+    fetch(positions), which retrieval.search_vectors uses to read every hit of a
+    query in one statement. Connections are pooled, since Flask serves each
+    request on a new thread. They are all opened when the store loads: a version
+    that save_atomic() prunes while a service still serves it stays readable
+    through the open files, where a connection opened later would fail.
+    """
+
+    def __init__(self, path, mmap_bytes=DOCSTORE_MMAP_BYTES, connections=DOCSTORE_CONNECTIONS):
+        self.db_path = os.path.join(path, DOCSTORE_FILE)
+        self.mmap_bytes = mmap_bytes
+        self._pool = queue.SimpleQueue()
+        # Opened now so a missing or unreadable file fails the load, not the first query
+        for _ in range(max(1, int(connections))):
+            self._pool.put(self._connect())
+
+    def _connect(self):
+        # Store versions are never modified once written (see index_store.py), hence immutable=1
+        uri = f"file:{os.path.abspath(self.db_path)}?mode=ro&immutable=1"
+        connection = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        connection.execute(f"PRAGMA mmap_size={int(self.mmap_bytes)}")
+        return connection
+
+    @contextmanager
+    def _connection(self):
+        connection = self._pool.get()
+        try:
+            yield connection
+        finally:
+            self._pool.put(connection)
+
+    def _query(self, sql, params=()):
+        with self._connection() as connection:
+            return connection.execute(sql, params).fetchall()
+
+    def _document(self, docstore_id, page_content, metadata):
+        from langchain_core.documents import Document
+        return Document(id=docstore_id, page_content=page_content, metadata=json.loads(metadata))
+
+    def search(self, docstore_id):
+        rows = self._query("SELECT docstore_id, page_content, metadata FROM docs WHERE docstore_id = ?", (docstore_id,))
+        # Same not-found convention as LangChain's InMemoryDocstore
+        return self._document(*rows[0]) if rows else f"ID {docstore_id} not found."
+
+    def fetch(self, positions):
+        """Documents at the given FAISS positions, as {position: Document}."""
+        positions = [int(position) for position in positions]
+        found = {}
+        for i in range(0, len(positions), _MAX_PARAMS):
+            batch = positions[i:i + _MAX_PARAMS]
+            rows = self._query(
+                f"SELECT id, docstore_id, page_content, metadata FROM docs WHERE id IN ({','.join('?' * len(batch))})",
+                batch,
+            )
+            for position, *document in rows:
+                found[position] = self._document(*document)
+        return found
+
+    def docstore_id(self, position):
+        rows = self._query("SELECT docstore_id FROM docs WHERE id = ?", (int(position),))
+        return rows[0][0] if rows else None
+
+    def __len__(self):
+        return self._query("SELECT count(*) FROM docs")[0][0]
+
+    def positions(self):
+        return [row[0] for row in self._query("SELECT id FROM docs ORDER BY id")]
+
+class SqliteIdMap(Mapping):
+    """FAISS position -> docstore id, looked up in docs.sqlite instead of held in a dict."""
+
+    def __init__(self, docstore):
+        self._docstore = docstore
+
+    def __getitem__(self, position):
+        docstore_id = self._docstore.docstore_id(position)
+        if docstore_id is None:
+            raise KeyError(position)
+        return docstore_id
+
+    def __len__(self):
+        return len(self._docstore)
+
+    def __iter__(self):
+        return iter(self._docstore.positions())
+
+def open_docstore(path):
+    """(docstore, index_to_docstore_id) for a store directory, lazily from docs.sqlite if it has one."""
+    if os.path.exists(os.path.join(path, DOCSTORE_FILE)):
+        docstore = SqliteDocstore(path)
+        return docstore, SqliteIdMap(docstore)
+
+    print(f"[{path}] has no {DOCSTORE_FILE}; loading index.pkl (run docstore.py convert {path})")
+    # Same trust as allow_dangerous_deserialization=True: these files are written by our own builders
+    with open(os.path.join(path, "index.pkl"), "rb") as f:
+        return pickle.load(f)
+
+def load_store(path, embeddings):
+    """The whole store in memory, for writers: an InMemoryDocstore and a plain id dict."""
+    import faiss
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_community.vectorstores import FAISS
+    from index_store import resolve_index
+
+    path = resolve_index(path)
+    index = faiss.read_index(os.path.join(path, "index.faiss"))
+    docstore, index_to_docstore_id = open_docstore(path)
+    if isinstance(docstore, SqliteDocstore):
+        documents = docstore.fetch(docstore.positions())
+        index_to_docstore_id = {position: documents[position].id for position in sorted(documents)}
+        docstore = InMemoryDocstore({document.id: document for document in documents.values()})
+    return FAISS(embeddings, index, docstore, index_to_docstore_id)
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert FAISS stores from index.pkl to docs.sqlite")
+    sub = parser.add_subparsers(dest="command", required=True)
+    convert_parser = sub.add_parser("convert")
+    convert_parser.add_argument("paths", nargs="+")
+    args = parser.parse_args()
+
+    from index_store import index_lock, save_atomic
+
+    for path in args.paths:
+        start = time.perf_counter()
+        with index_lock(path):
+            # No embedding model needed: nothing is embedded
+            vector_store = load_store(path, None)
+            version = save_atomic(vector_store, path)
+        print(f"{path}: {len(vector_store.index_to_docstore_id)} documents -> {version} "
+              f"in {time.perf_counter() - start:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,71 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 from flask import Flask, request, jsonify
-from langchain_community.vectorstores import FAISS
-from langchain_community.embeddings import HuggingFaceEmbeddings
 from mistralai import Mistral
 from mistralai.models import UserMessage
 
-# Load FAISS vector store
-vector_store = FAISS.load_local(
-    "faiss_fir_db",
-    HuggingFaceEmbeddings(model_name="BAAI/bge-small-en"),
-    allow_dangerous_deserialization=True
-)
-retriever = vector_store.as_retriever()
+from readiness import ServiceLoader, install_health_routes, WARMUP_ITERATIONS
+from metrics import count, install_metrics, timed
+from retrieval import retrieve_documents, retrieve_with_scores, retrieve_with_scores_batch
+from emergency_knn import KNN_K, fast_path
+from fir_ingest import FIR_INDEX_PATH
+from index_store import IndexReloader
+from ann_index import open_vector_store
+from stub_llm import StubMistral, LLM_STUB
+from context_packer import CONTEXT_CANDIDATES, pack_context
+
+# Largest number of reports accepted by /classify-fir/batch
+MAX_BATCH_ITEMS = int(os.environ.get("MAX_BATCH_ITEMS", "500"))
+# Mistral calls in flight at once for one batch
+LLM_CONCURRENCY = int(os.environ.get("LLM_CONCURRENCY", "8"))
+
+# Set by load_vector_store() on the loader thread
+vector_store = None
+
+def load_vector_store():
+    # langchain and the embedding model are imported here so the port binds before they are loaded
+    global vector_store
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+
+    # Load FAISS vector store (memory-mapped, see ann_index.py)
+    index_reloader.mark()
+    vector_store = open_vector_store(
+        FIR_INDEX_PATH,
+        HuggingFaceEmbeddings(model_name="BAAI/bge-small-en")
+    )
+    # From now on, indexes saved by fir_ingest.py are swapped in without a restart
+    index_reloader.start()
+
+def reload_vector_store():
+    """Loads the index fir_ingest.py just saved and swaps it in; requests in flight keep the old one."""
+    global vector_store
+
+    with timed("index_reload"):
+        # Reuses the embedding model already in memory
+        new_store = open_vector_store(FIR_INDEX_PATH, vector_store.embeddings)
+        retrieve_documents(new_store, "warmup query")
+    vector_store = new_store
+    count("index_reload")
+
+def warmup_vector_store():
+    # First queries pay for tokenizer and embedding model initialisation
+    for _ in range(WARMUP_ITERATIONS):
+        retrieve_documents(vector_store, "warmup query")
 
 # Initialize Mistral API client
 api_key = os.environ.get("MISTRAL_API_KEY","HtNsZNzpfzLQyzlGTvkCwccUbASZaZNt")
-client = Mistral(api_key=api_key)
+# LLM_STUB=1 swaps in a local stub (see stub_llm.py) for load tests and offline runs
+client = StubMistral() if LLM_STUB else Mistral(api_key=api_key)
 
 # Flask app
 app = Flask(__name__)
+install_metrics(app, "emergency_classify")
+
+index_reloader = IndexReloader(FIR_INDEX_PATH, reload_vector_store)
+
+# /readyz turns 200 once the vector store is loaded and warm
+loader = ServiceLoader("emergency_classify", load_vector_store, warmup_vector_store).start()
+install_health_routes(app, loader)
 
 def classify_emergency(subject, description, context):
     """Uses Mistral to classify the FIR emergency level (1-5)."""
@@ -34,9 +81,17 @@ def classify_emergency(subject, description, context):
         {"role": "user", "content": f"Context:\n{context}\n\nSubject: {subject}\nDescription: {description}\n\nEmergency level:"}
     ]
     
-    response = client.chat.complete(model="mistral-tiny", messages=messages)
+    with timed("llm_total"):
+        response = client.chat.complete(model="mistral-tiny", messages=messages)
     return response.choices[0].message.content
 
+def build_context(hits):
+    """Packs the closest past FIRs into the prompt context under CONTEXT_TOKEN_BUDGET."""
+    context, report = pack_context([doc for doc, _ in hits[:CONTEXT_CANDIDATES]])
+    count("context_tokens", report["tokens"])
+    count("context_tokens_saved", report["tokens_saved"])
+    return context
+
 @app.route("/classify-fir", methods=["POST"])
 def classify_fir():
     """Classifies the emergency level of an FIR report."""
@@ -50,13 +105,90 @@ def classify_fir():
 
     # Retrieve relevant past FIRs
     query = f"{subject} {description}"
-    docs = retriever.get_relevant_documents(query)
-    context = "\n\n".join([doc.page_content for doc in docs])
+    hits = retrieve_with_scores(vector_store, query, max(KNN_K, CONTEXT_CANDIDATES))
+
+    # Labelled neighbours that agree answer without the LLM
+    with timed("knn_vote"):
+        level, confidence = fast_path(hits[:KNN_K])
+    if level is not None:
+        count("fir_knn_answer")
+        return jsonify({"emergency_level": str(level), "path": "knn", "confidence": round(confidence, 4)})
+
+    context = build_context(hits)
 
     # Get emergency level
     emergency_level = classify_emergency(subject, description, context)
+    count("fir_llm_answer")
+    
+    return jsonify({"emergency_level": emergency_level, "path": "llm", "confidence": round(confidence, 4)})
+
+@app.route("/classify-fir/batch", methods=["POST"])
+def classify_fir_batch():
+    """Classifies many FIR reports at once.
+
+    Expects {"items": [{"subject": ..., "description": ..., "id": optional}, ...]}.
+    All queries are embedded in one encoder call and searched in one FAISS call.
+    Reports whose labelled neighbours agree are answered locally; the rest go to
+    Mistral, LLM_CONCURRENCY calls at a time. Every item gets its own result or
+    error, so one bad report does not fail the batch.
+    """
+    
+    data = request.get_json(silent=True) or {}
+    items = data.get("items")
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "'items' must be a non-empty list of {subject, description}"}), 400
+    if len(items) > MAX_BATCH_ITEMS:
+        return jsonify({"error": f"At most {MAX_BATCH_ITEMS} items per batch"}), 413
+    
+    results = [{"index": i} for i in range(len(items))]
+    queries, positions = [], []
+    for i, item in enumerate(items):
+        if isinstance(item, dict) and "id" in item:
+            results[i]["id"] = item["id"]
+        if not isinstance(item, dict) or not item.get("subject") or not item.get("description"):
+            results[i]["error"] = "Both 'subject' and 'description' are required"
+            continue
+        queries.append(f"{item['subject']} {item['description']}")
+        positions.append(i)
+    
+    # Retrieve relevant past FIRs for every valid report at once
+    all_hits = retrieve_with_scores_batch(vector_store, queries, max(KNN_K, CONTEXT_CANDIDATES)) if queries else []
+    
+    llm_positions, contexts = [], []
+    for position, hits in zip(positions, all_hits):
+        level, confidence = fast_path(hits[:KNN_K])
+        results[position]["confidence"] = round(confidence, 4)
+        if level is not None:
+            results[position].update({"emergency_level": str(level), "path": "knn"})
+            continue
+        llm_positions.append(position)
+        contexts.append(build_context(hits))
+    count("fir_knn_answer", len(positions) - len(llm_positions))
+    count("fir_llm_answer", len(llm_positions))
+    
+    def classify(position, context):
+        item = items[position]
+        try:
+            level = classify_emergency(item["subject"], item["description"], context)
+            return position, {"emergency_level": level, "path": "llm"}
+        except Exception as e:
+            return position, {"error": f"LLM call failed: {e}"}
+    
+    with ThreadPoolExecutor(max_workers=max(1, LLM_CONCURRENCY)) as pool:
+        for position, outcome in pool.map(classify, llm_positions, contexts):
+            results[position].update(outcome)
+    
+    failed = sum("error" in result for result in results)
+    return jsonify({"results": results, "succeeded": len(results) - failed, "failed": failed})
+
+@app.route("/reload-index", methods=["POST"])
+def reload_index():
+    """Swaps in the index on disk now instead of on the next poll (see fir_ingest.py --notify)."""
     
-    return jsonify({"emergency_level": emergency_level})
+    reloaded = index_reloader.check()
+    status = index_reloader.status()
+    status.update({"reloaded": reloaded, "vectors": vector_store.index.ntotal})
+    return jsonify(status), 500 if status["error"] and not reloaded else 200
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=True)
@@ -1,27 +1,42 @@
+import argparse
 import json
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_community.vectorstores import FAISS
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from ann_index import INDEX_TYPES, convert
+from fir_ingest import FIR_INDEX_PATH, FIR_INDEX_TYPE, fir_chunks, record_id
+from index_store import index_lock, save_atomic
+
+parser = argparse.ArgumentParser(description="Build the FIR FAISS index")
+parser.add_argument("--index-type", choices=INDEX_TYPES, default=FIR_INDEX_TYPE)
+args = parser.parse_args()
 
 # Load JSON dataset
 with open("models/fir_dataset_500.json", "r", encoding="utf-8") as file:
     data = json.load(file)
 
-# Extract relevant text (combine subject and description for context)
-documents = []
+# Split each FIR (subject and description) into chunks with stable ids and its label as metadata,
+# so fir_ingest.py can later add, edit and delete FIRs without a rebuild
+document_chunks = []
+ids = []
+seen = set()
 for entry in data:
-    fir_text = f"Subject: {entry['subject']}\nDescription: {entry['description']}"
-    documents.append(fir_text)
-
-# Split text into chunks for embedding
-text_splitter = RecursiveCharacterTextSplitter(chunk_size=512, chunk_overlap=50)
-document_chunks = text_splitter.create_documents(documents)
+    fir_id = record_id(entry)
+    if fir_id in seen:
+        continue
+    seen.add(fir_id)
+    chunks, chunk_ids = fir_chunks(entry, fir_id)
+    document_chunks.extend(chunks)
+    ids.extend(chunk_ids)
 
 # Use BGE embeddings from HuggingFace
 embeddings = HuggingFaceEmbeddings(model_name="BAAI/bge-small-en")
 
-# Store in FAISS for fast retrieval
-vector_store = FAISS.from_documents(document_chunks, embeddings)
-vector_store.save_local("faiss_fir_db")
+# Store in FAISS for fast retrieval; saved as a new version that a running emergency_classify.py swaps in
+vector_store = FAISS.from_documents(document_chunks, embeddings, ids=ids)
+if args.index_type != "flat":
+    convert(vector_store, args.index_type)
+with index_lock(FIR_INDEX_PATH):
+    save_atomic(vector_store, FIR_INDEX_PATH)
 
-print("FIR dataset successfully stored in FAISS!")
+print(f"FIR dataset successfully stored in FAISS ({args.index_type} index)!")
@@ -0,0 +1,144 @@
+"""Answers FIR emergency levels from labelled neighbours when they agree.
+
+Every chunk in faiss_fir_db carries the `emergency_class` and `fir_id` of the
+FIR it came from (see fir_ingest.py). A similarity-weighted vote over the nearest FIRs
+decides the level locally; only votes below KNN_CONFIDENCE go to the LLM.
+
+    python emergency_knn.py --index faiss_fir_db --dataset fir_dataset_500.json
+
+evaluates the vote leave-one-out on the labelled dataset and reports, for a
+range of thresholds, how many LLM calls the fast path avoids and how often its
+answers agree with the labels (and with the LLM, with --llm).
+"""
+import argparse
+import json
+import os
+from collections import defaultdict
+
+from fir_ingest import FIR_INDEX_PATH, record_id
+
+# Neighbours retrieved for the vote
+KNN_K = int(os.environ.get("KNN_K", "8"))
+# Share of the vote weight the winning level needs to be answered locally; above 1 disables the fast path
+KNN_CONFIDENCE = float(os.environ.get("KNN_CONFIDENCE", "0.8"))
+# Fewer distinct neighbouring FIRs than this always go to the LLM
+KNN_MIN_NEIGHBORS = int(os.environ.get("KNN_MIN_NEIGHBORS", "3"))
+
+LABEL_KEY = "emergency_class"
+
+def knn_vote(hits, exclude=None):
+    """Similarity-weighted vote over (document, distance) hits.
+
+    Chunks of the same FIR count once (its closest chunk). Each FIR's weight is
+    1 / (1 + distance). Returns (level, confidence, neighbours), where confidence
+    is the winner's share of the total weight; level is None when the hits carry
+    no labels, e.g. an index built before labels were kept.
+    """
+    best = {}
+    for doc, distance in hits:
+        label = doc.metadata.get(LABEL_KEY)
+        if label is None:
+            continue
+        fir = doc.metadata.get("fir_id", id(doc))
+        if exclude is not None and fir == exclude:
+            continue
+        if fir not in best or distance < best[fir][1]:
+            best[fir] = (label, distance)
+
+    weights = defaultdict(float)
+    for label, distance in best.values():
+        weights[label] += 1.0 / (1.0 + max(distance, 0.0))
+    if not weights:
+        return None, 0.0, 0
+
+    level, weight = max(weights.items(), key=lambda entry: entry[1])
+    return level, weight / sum(weights.values()), len(best)
+
+def fast_path(hits, threshold=KNN_CONFIDENCE, min_neighbors=KNN_MIN_NEIGHBORS, exclude=None):
+    """Returns (level, confidence) if the neighbours are confident enough, else (None, confidence)."""
+    level, confidence, neighbors = knn_vote(hits, exclude=exclude)
+    if level is None or neighbors < min_neighbors or confidence < threshold:
+        return None, confidence
+    return level, confidence
+
+def evaluate(vector_store, records, thresholds, k=KNN_K, min_neighbors=KNN_MIN_NEIGHBORS, llm=None):
+    """Leave-one-out evaluation of the fast path over labelled FIR records.
+
+    `llm`, if given, is called as llm(subject, description, context) for every
+    record so the fast path can also be compared with the LLM's answers.
+    """
+    from context_packer import CONTEXT_CANDIDATES, pack_context
+    from retrieval import retrieve_with_scores_batch
+
+    queries = [f"{record['subject']} {record['description']}" for record in records]
+    # One extra hit per query, since the record itself is excluded from its own vote
+    all_hits = retrieve_with_scores_batch(vector_store, queries, max(k, CONTEXT_CANDIDATES) + 1)
+
+    votes, llm_levels = [], []
+    for record, hits in zip(records, all_hits):
+        fir_id = record_id(record)
+        level, confidence, neighbors = knn_vote(hits[:k + 1], exclude=fir_id)
+        votes.append((level, confidence, neighbors))
+        if llm is not None:
+            neighbours = [doc for doc, _ in hits if doc.metadata.get("fir_id") != fir_id]
+            context, _ = pack_context(neighbours[:CONTEXT_CANDIDATES])
+            llm_levels.append(_parse_level(llm(record["subject"], record["description"], context)))
+
+    report = {"records": len(records), "k": k, "min_neighbors": min_neighbors, "thresholds": []}
+    for threshold in thresholds:
+        answered = [i for i, (level, confidence, neighbors) in enumerate(votes)
+                    if level is not None and neighbors >= min_neighbors and confidence >= threshold]
+        entry = {
+            "threshold": threshold,
+            "llm_calls_avoided": len(answered) / len(records) if records else 0.0,
+            "agreement_with_labels": _share(answered, lambda i: votes[i][0] == records[i][LABEL_KEY]),
+        }
+        if llm is not None:
+            entry["agreement_with_llm"] = _share(answered, lambda i: votes[i][0] == llm_levels[i])
+        report["thresholds"].append(entry)
+
+    if llm is not None:
+        report["llm_agreement_with_labels"] = _share(range(len(records)), lambda i: llm_levels[i] == records[i][LABEL_KEY])
+    return report
+
+def _share(indices, predicate):
+    indices = list(indices)
+    return sum(1 for i in indices if predicate(i)) / len(indices) if indices else None
+
+def _parse_level(text):
+    for char in str(text):
+        if char.isdigit():
+            return int(char)
+    return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate the kNN fast path for FIR emergency levels")
+    parser.add_argument("--index", default=FIR_INDEX_PATH)
+    parser.add_argument("--dataset", default="fir_dataset_500.json")
+    parser.add_argument("--k", type=int, default=KNN_K)
+    parser.add_argument("--min-neighbors", type=int, default=KNN_MIN_NEIGHBORS)
+    parser.add_argument("--thresholds", nargs="+", type=float, default=[0.5, 0.6, 0.7, 0.8, 0.9, 1.0])
+    parser.add_argument("--llm", action="store_true", help="also classify every record with the LLM (LLM_STUB=1 for the stub)")
+    parser.add_argument("--report", help="write the report as JSON here")
+    args = parser.parse_args()
+
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+    from ann_index import open_vector_store
+
+    vector_store = open_vector_store(args.index, HuggingFaceEmbeddings(model_name="BAAI/bge-small-en"))
+    with open(args.dataset, "r", encoding="utf-8") as f:
+        records = json.load(f)
+
+    llm = None
+    if args.llm:
+        # Importing the service starts its own index loader; only the LLM call is used
+        from emergency_classify import classify_emergency as llm
+
+    report = evaluate(vector_store, records, args.thresholds, k=args.k, min_neighbors=args.min_neighbors, llm=llm)
+    print(json.dumps(report, indent=2))
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
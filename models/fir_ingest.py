@@ -0,0 +1,191 @@
+"""Adds, updates and deletes FIRs in faiss_fir_db without rebuilding it.
+
+    python fir_ingest.py firs.jsonl [--delete ID ...] [--index faiss_fir_db]
+
+reads FIRs from a JSONL export of the FIR collection (or a JSON list such as
+fir_dataset_500.json) and embeds only the ones the index does not hold yet.
+Every FIR has a stable id: its Mongo `_id` when it has one, else a hash of its
+content. Its chunks are stored as "<id>#<n>", so an FIR whose text changed is
+replaced, and a line like {"_id": ..., "deleted": true} (or --delete) removes
+it. The result is saved with index_store.save_atomic(), and a running
+emergency_classify.py swaps it in on its next poll or on POST /reload-index.
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+import urllib.request
+
+from ann_index import convert
+from docstore import load_store
+from index_store import index_exists, index_lock, save_atomic
+
+FIR_INDEX_PATH = os.environ.get("FIR_INDEX_PATH", "faiss_fir_db")
+# Index type emergency_db.py builds (see ann_index.py)
+FIR_INDEX_TYPE = os.environ.get("FIR_INDEX_TYPE", "flat")
+# Chunks embedded per encoder call
+INGEST_BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", "256"))
+
+_text_splitter = None
+
+def record_id(entry):
+    """Stable id of an FIR: its Mongo `_id` if exported with one, else a hash of its content."""
+    oid = entry.get("_id", entry.get("id"))
+    if isinstance(oid, dict):
+        # mongoexport writes ObjectIds as {"$oid": "..."}
+        oid = oid.get("$oid")
+    if oid:
+        return str(oid)
+    key = "|".join(str(entry.get(field, "")) for field in ("datetime", "location", "subject", "description"))
+    return "sha1-" + hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+def fir_chunks(entry, fir_id=None):
+    """Splits an FIR into documents for the index; returns (documents, docstore ids)."""
+    global _text_splitter
+    if _text_splitter is None:
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        _text_splitter = RecursiveCharacterTextSplitter(chunk_size=512, chunk_overlap=50)
+
+    fir_id = fir_id or record_id(entry)
+    fir_text = f"Subject: {entry['subject']}\nDescription: {entry['description']}"
+    label = entry.get("emergency_class")
+    metadata = {
+        # The label drives the kNN fast path in emergency_knn.py; fir_id ties chunks back to their FIR
+        "emergency_class": label,
+        "fir_id": fir_id,
+        # Tells an edited FIR from one that is already indexed as is
+        "fir_hash": hashlib.sha1(f"{label}|{fir_text}".encode("utf-8")).hexdigest()[:16],
+    }
+    documents = _text_splitter.create_documents([fir_text], metadatas=[metadata])
+    for n, document in enumerate(documents):
+        # Lets context_packer.py put neighbouring chunks back together
+        document.metadata["chunk"] = n
+    return documents, [f"{fir_id}#{n}" for n in range(len(documents))]
+
+def is_delete(entry):
+    return bool(entry.get("deleted")) or entry.get("op") == "delete"
+
+def read_records(path):
+    """FIRs from a JSONL file (one per line) or a JSON list."""
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            return [json.loads(line) for line in f if line.strip()]
+        return json.load(f)
+
+def indexed_firs(vector_store):
+    """fir_id -> (fir_hash, [docstore ids]) for every FIR already in the index."""
+    firs = {}
+    for docstore_id in vector_store.index_to_docstore_id.values():
+        metadata = vector_store.docstore.search(docstore_id).metadata
+        fir_id = metadata.get("fir_id")
+        if fir_id is None:
+            # Built before FIRs had stable ids; rebuild with emergency_db.py to manage these
+            continue
+        firs.setdefault(fir_id, (metadata.get("fir_hash"), []))[1].append(docstore_id)
+    return firs
+
+def ingest(vector_store, records, embeddings, deletes=(), batch_size=INGEST_BATCH_SIZE):
+    """Applies `records` and `deletes` to `vector_store` (None for a new index).
+
+    Returns (vector_store, report). Only new and edited FIRs are embedded.
+    """
+    # Later lines win, so an export can add, edit and delete the same FIR
+    latest = {}
+    skipped = 0
+    for entry in records:
+        fir_id = record_id(entry)
+        if is_delete(entry):
+            latest[fir_id] = None
+        elif entry.get("subject") and entry.get("description"):
+            latest[fir_id] = entry
+        else:
+            skipped += 1
+    for fir_id in deletes:
+        latest[str(fir_id)] = None
+
+    existing = indexed_firs(vector_store) if vector_store is not None else {}
+    report = {"added": 0, "updated": 0, "deleted": 0, "unchanged": 0, "skipped": skipped, "chunks_embedded": 0}
+    stale_ids, documents, ids = [], [], []
+    for fir_id, entry in latest.items():
+        old = existing.get(fir_id)
+        if entry is None:
+            if old is not None:
+                stale_ids.extend(old[1])
+                report["deleted"] += 1
+            continue
+
+        chunks, chunk_ids = fir_chunks(entry, fir_id)
+        if old is not None and old[0] == chunks[0].metadata["fir_hash"]:
+            report["unchanged"] += 1
+            continue
+        if old is not None:
+            stale_ids.extend(old[1])
+            report["updated"] += 1
+        else:
+            report["added"] += 1
+        documents.extend(chunks)
+        ids.extend(chunk_ids)
+
+    hnsw_m = None
+    if stale_ids:
+        if hasattr(vector_store.index, "hnsw"):
+            # HNSW cannot remove vectors: edit an exact copy and rebuild the graph once the adds are in
+            hnsw_m = vector_store.index.hnsw.nb_neighbors(1)
+            convert(vector_store, "flat")
+        vector_store.delete(stale_ids)
+
+    start = time.perf_counter()
+    for i in range(0, len(documents), batch_size):
+        batch, batch_ids = documents[i:i + batch_size], ids[i:i + batch_size]
+        if vector_store is None:
+            from langchain_community.vectorstores import FAISS
+            vector_store = FAISS.from_documents(batch, embeddings, ids=batch_ids)
+        else:
+            vector_store.add_documents(batch, ids=batch_ids)
+    report["chunks_embedded"] = len(documents)
+    report["embed_seconds"] = round(time.perf_counter() - start, 3)
+    if hnsw_m is not None:
+        start = time.perf_counter()
+        convert(vector_store, "hnsw", hnsw_m=hnsw_m)
+        report["rebuild_seconds"] = round(time.perf_counter() - start, 3)
+    report["vectors"] = vector_store.index.ntotal if vector_store is not None else 0
+    return vector_store, report
+
+def main():
+    parser = argparse.ArgumentParser(description="Incrementally add, update and delete FIRs in the FIR index")
+    parser.add_argument("records", nargs="*", help="JSONL export of the FIR collection, or a JSON list")
+    parser.add_argument("--index", default=FIR_INDEX_PATH)
+    parser.add_argument("--delete", nargs="+", default=[], metavar="ID", help="FIR ids to remove")
+    parser.add_argument("--batch-size", type=int, default=INGEST_BATCH_SIZE)
+    parser.add_argument("--notify", metavar="URL",
+                        help="POST here after saving, e.g. http://localhost:5000/reload-index")
+    args = parser.parse_args()
+
+    records = [entry for path in args.records for entry in read_records(path)]
+
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+
+    embeddings = HuggingFaceEmbeddings(model_name="BAAI/bge-small-en")
+    # Two ingests at once would each save a version missing the other's FIRs
+    with index_lock(args.index):
+        vector_store = None
+        if index_exists(args.index):
+            vector_store = load_store(args.index, embeddings)
+        vector_store, report = ingest(vector_store, records, embeddings, deletes=args.delete,
+                                      batch_size=args.batch_size)
+        if vector_store is not None and (report["added"] or report["updated"] or report["deleted"]):
+            report["saved_to"] = save_atomic(vector_store, args.index)
+
+    print(json.dumps(report, indent=2))
+    if args.notify and "saved_to" in report:
+        request = urllib.request.Request(args.notify, data=b"", method="POST")
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                print(response.read().decode("utf-8"))
+        except OSError as e:
+            # The index is saved either way; the service picks it up on its next poll
+            print(f"Could not notify {args.notify}: {e}")
+
+if __name__ == "__main__":
+    main()
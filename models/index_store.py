@@ -0,0 +1,145 @@
+"""Versioned on-disk FAISS indexes that can be replaced under a running service.
+
+save_atomic() writes every save to its own directory next to `path` and then
+repoints the `path.current` symlink at it with one rename, so a reader sees
+either the old index or the new one, never a half-written pair of files.
+Readers open resolve_index(path), which follows that symlink once. `path`
+itself is never touched: an index built into it directly (such as the
+faiss_fir_db checked into the repository) stays in place as version 0 and is
+served until the first save. IndexReloader runs inside a service and reloads
+the index when the symlink moves.
+"""
+import fcntl
+import glob
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+from docstore import save_store
+
+# Versions kept on disk: the current one plus this many minus one to roll back to
+KEEP_INDEX_VERSIONS = int(os.environ.get("KEEP_INDEX_VERSIONS", "2"))
+# How often a service checks whether its index was replaced; 0 only reloads on request
+INDEX_RELOAD_SECONDS = float(os.environ.get("INDEX_RELOAD_SECONDS", "10"))
+
+def current_link(path):
+    return f"{path.rstrip(os.sep)}.current"
+
+def resolve_index(path):
+    """The version directory `path` currently stands for.
+
+    Open the files of one index through the returned directory, not `path`, so
+    a save in between cannot pair an old index with a new docstore.
+    """
+    link = current_link(path)
+    return os.path.realpath(link if os.path.lexists(link) else path)
+
+def index_exists(path):
+    return os.path.exists(os.path.join(resolve_index(path), "index.faiss"))
+
+def index_version(path):
+    """Identifies what `path` currently holds: the version directory and when it was written."""
+    directory = resolve_index(path)
+    try:
+        return directory, os.stat(os.path.join(directory, "index.faiss")).st_mtime_ns
+    except OSError:
+        return None
+
+def save_atomic(vector_store, path, keep=KEEP_INDEX_VERSIONS):
+    """Saves `vector_store` as a new version of `path` and switches readers to it.
+
+    Returns the version directory. The `keep` newest versions are kept, and so
+    is the version this save replaced, which services may not have reloaded
+    from yet; an index in `path` itself is never moved or deleted.
+    """
+    path = path.rstrip(os.sep)
+    version = f"{path}@{time.time_ns()}"
+    save_store(vector_store, version)
+
+    replaced = resolve_index(path)
+    link = f"{path}.link-{os.getpid()}"
+    os.symlink(os.path.basename(version), link)
+    os.replace(link, current_link(path))
+
+    # Oldest first; version names sort by the time they were written
+    versions = sorted(glob.glob(f"{glob.escape(path)}@*"))
+    for old in versions[:-max(keep, 1)]:
+        if os.path.realpath(old) != replaced:
+            shutil.rmtree(old, ignore_errors=True)
+    return version
+
+@contextmanager
+def index_lock(path):
+    """Serialises writers of `path` across processes; readers never take it."""
+    with open(f"{path.rstrip(os.sep)}.lock", "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+class IndexReloader:
+    """Reloads a service's index when save_atomic() swaps in a new version.
+
+    `reload` is a plain callable that loads `path` and replaces the service's
+    global, like ServiceLoader's `load`. It runs on a polling thread every
+    `interval` seconds, or right away through check(). Requests in flight keep
+    the index they started with.
+    """
+
+    def __init__(self, path, reload, interval=INDEX_RELOAD_SECONDS):
+        self.path = path
+        self.reload = reload
+        self.interval = interval
+        self.version = None
+        self.reloads = 0
+        self.error = None
+        self._lock = threading.Lock()
+        self._started = False
+
+    def mark(self):
+        """Records the version on disk; call it just before the initial load."""
+        self.version = index_version(self.path)
+
+    def start(self):
+        if self.interval > 0 and not self._started:
+            self._started = True
+            threading.Thread(target=self._poll, name=f"reload-{os.path.basename(self.path)}", daemon=True).start()
+        return self
+
+    def check(self):
+        """Reloads if the index on disk changed since the last load; returns True if it did."""
+        with self._lock:
+            version = index_version(self.path)
+            if version is None or version == self.version:
+                return False
+
+            start = time.perf_counter()
+            try:
+                self.reload()
+            except Exception as e:
+                # Keep serving the index already loaded
+                self.error = f"{type(e).__name__}: {e}"
+                print(f"[{self.path}] reload failed: {self.error}")
+                return False
+
+            self.version = version
+            self.reloads += 1
+            self.error = None
+            print(f"[{self.path}] reloaded {os.path.basename(version[0])} in {time.perf_counter() - start:.2f}s")
+            return True
+
+    def status(self):
+        return {
+            "path": self.path,
+            "version": os.path.basename(self.version[0]) if self.version else None,
+            "reloads": self.reloads,
+            "error": self.error,
+        }
+
+    def _poll(self):
+        while True:
+            time.sleep(self.interval)
+            self.check()
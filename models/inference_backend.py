@@ -0,0 +1,208 @@
+"""Inference backends for the crime TCN model.
+
+Every backend is called like the TorchScript model it replaces, `backend(batch)`
+with an (N, 1, 224, 224) float tensor returning (N, C) logits, so the scheduler,
+stream manager and video pipeline work with any of them unchanged.
+
+    python inference_backend.py export --model crime_tcn_jit.pt   # writes crime_tcn_jit.onnx
+    python inference_backend.py parity --model crime_tcn_jit.pt
+
+Services pick a backend with INFERENCE_BACKEND=torchscript|onnx.
+"""
+import argparse
+import json
+import os
+import threading
+
+import numpy as np
+import torch
+
+from model_prep import MODEL_VARIANT, configure_threads, load_model
+from result_cache import model_version
+
+BACKENDS = ("torchscript", "onnx")
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "torchscript")
+# Exported model used by the onnx backend; defaults to crime_tcn_jit.onnx next to the TorchScript file
+ONNX_MODEL_PATH = os.environ.get("ONNX_MODEL_PATH")
+# ONNX Runtime intra-op threads; 0 lets it pick one per physical core
+ORT_THREADS = int(os.environ.get("ORT_THREADS", "0"))
+ONNX_OPSET = 17
+
+RESOLUTION = 224
+
+def onnx_path(model_path):
+    return ONNX_MODEL_PATH or os.path.splitext(model_path)[0] + ".onnx"
+
+class TorchScriptBackend:
+    """The TorchScript model (in the MODEL_VARIANT flavour) behind the backend interface."""
+
+    name = "torchscript"
+
+    def __init__(self, model_path, device, variant=MODEL_VARIANT, threads=None):
+        # A caller that splits the cores between processes passes its share; the
+        # TORCH_*_THREADS defaults would otherwise give every worker the whole machine
+        if threads:
+            configure_threads(intra=threads, inter=1)
+        else:
+            configure_threads()
+        self.model = load_model(model_path, device, variant=variant)
+        # int8 variants only run on CPU
+        self.device = torch.device("cpu") if variant.startswith("int8") else device
+        self.version = f"{model_version(model_path)}-{variant}"
+
+    def __call__(self, batch):
+        return self.model(batch)
+
+class OnnxBackend:
+    """Runs an exported model with ONNX Runtime on CPU through IO binding.
+
+    Contiguous float32 CPU batches (what BatchBuffer hands out) are bound in place,
+    so the frames are never copied into ORT; anything else is first copied into a
+    preallocated per-thread input buffer. Logits are written into a preallocated
+    per-thread output buffer. Each thread has its own binding, so concurrent
+    callers share one session without locking.
+    """
+
+    name = "onnx"
+
+    def __init__(self, path, threads=ORT_THREADS, max_batch_size=64):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.output_name = self.session.get_outputs()[0].name
+
+        self.device = torch.device("cpu")
+        self.version = f"{model_version(path)}-onnx"
+        self.max_batch_size = max_batch_size
+        self.num_classes = self._probe_classes()
+        self._local = threading.local()
+
+    def _probe_classes(self):
+        dim = self.session.get_outputs()[0].shape[-1]
+        if isinstance(dim, int):
+            return dim
+        probe = np.zeros((1, 1, RESOLUTION, RESOLUTION), dtype=np.float32)
+        return self.session.run([self.output_name], {self.input_name: probe})[0].shape[-1]
+
+    def _buffers(self, count):
+        local = self._local
+        if getattr(local, "capacity", 0) < count:
+            capacity = max(count, self.max_batch_size)
+            local.binding = self.session.io_binding()
+            local.input = np.empty((capacity, 1, RESOLUTION, RESOLUTION), dtype=np.float32)
+            local.output = np.empty((capacity, self.num_classes), dtype=np.float32)
+            local.capacity = capacity
+        return local
+
+    def __call__(self, batch):
+        if isinstance(batch, torch.Tensor):
+            batch = batch.detach()
+            if batch.device.type != "cpu":
+                batch = batch.cpu()
+        count = batch.shape[0]
+        local = self._buffers(count)
+
+        if (isinstance(batch, torch.Tensor) and batch.dtype == torch.float32
+                and batch.is_contiguous() and tuple(batch.shape[1:]) == (1, RESOLUTION, RESOLUTION)):
+            frames, pointer = batch, batch.data_ptr()
+        else:
+            frames = local.input[:count]
+            frames[...] = batch.numpy() if isinstance(batch, torch.Tensor) else batch
+            pointer = frames.ctypes.data
+
+        output = local.output[:count]
+        binding = local.binding
+        binding.bind_input(self.input_name, "cpu", 0, np.float32, list(frames.shape), pointer)
+        binding.bind_output(self.output_name, "cpu", 0, np.float32, list(output.shape), output.ctypes.data)
+        self.session.run_with_iobinding(binding)
+        # The output buffer is reused by the next call on this thread
+        return torch.from_numpy(output.copy())
+
+def load_backend(model_path, device, backend=INFERENCE_BACKEND, threads=None):
+    """Loads the configured backend; `backend.device` is where batches should go.
+
+    `threads` overrides the intra-op thread count of either backend.
+    """
+    if backend == "torchscript":
+        return TorchScriptBackend(model_path, device, threads=threads)
+    if backend == "onnx":
+        path = onnx_path(model_path)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"{path} not found, export it with: python inference_backend.py export --model {model_path}")
+        return OnnxBackend(path, threads=ORT_THREADS if threads is None else threads)
+    raise ValueError(f"Unknown inference backend '{backend}', expected one of {BACKENDS}")
+
+def backend_version(model_path, backend=INFERENCE_BACKEND):
+    """Version string of the model a backend would load, without loading it."""
+    if backend == "onnx":
+        return f"{model_version(onnx_path(model_path))}-onnx"
+    return f"{model_version(model_path)}-{MODEL_VARIANT}"
+
+def export_onnx(model_path, path, opset=ONNX_OPSET):
+    """Exports the TorchScript model to ONNX with a dynamic batch dimension."""
+    model = torch.jit.load(model_path, map_location="cpu").eval()
+    example = torch.zeros(2, 1, RESOLUTION, RESOLUTION)
+    torch.onnx.export(
+        model, (example,), path,
+        input_names=["frames"], output_names=["logits"],
+        dynamic_axes={"frames": {0: "batch"}, "logits": {0: "batch"}},
+        opset_version=opset, dynamo=False,
+    )
+    return path
+
+def parity(model_path, path, batches=None, atol=1e-3):
+    """Compares TorchScript and ONNX Runtime logits on the same batches.
+
+    Defaults to seeded random inputs in the model's [-1, 1] range, in a few batch
+    sizes including 1, so the dynamic batch axis is exercised too.
+    """
+    if batches is None:
+        generator = torch.Generator().manual_seed(0)
+        batches = [torch.rand((size, 1, RESOLUTION, RESOLUTION), generator=generator) * 2 - 1 for size in (1, 7, 32)]
+
+    cpu = torch.device("cpu")
+    reference = load_model(model_path, cpu, variant="fp32", channels_last=False)
+    backend = OnnxBackend(path)
+
+    max_diff, agree, total = 0.0, 0, 0
+    for batch in batches:
+        with torch.no_grad():
+            expected = reference(batch).float()
+        actual = backend(batch)
+        max_diff = max(max_diff, (expected - actual).abs().max().item())
+        agree += (expected.argmax(dim=1) == actual.argmax(dim=1)).sum().item()
+        total += batch.shape[0]
+
+    return {
+        "frames": total,
+        "max_abs_diff": max_diff,
+        "argmax_agreement": agree / total,
+        "ok": max_diff <= atol and agree == total,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the crime TCN model to ONNX and check it")
+    parser.add_argument("command", choices=["export", "parity"])
+    parser.add_argument("--model", default="crime_tcn_jit.pt")
+    parser.add_argument("--onnx", help="defaults to the model path with a .onnx extension")
+    parser.add_argument("--opset", type=int, default=ONNX_OPSET)
+    parser.add_argument("--atol", type=float, default=1e-3)
+    args = parser.parse_args()
+    path = args.onnx or onnx_path(args.model)
+
+    if args.command == "export":
+        export_onnx(args.model, path, opset=args.opset)
+        print(f"Exported {args.model} to {path}")
+
+    report = parity(args.model, path, atol=args.atol)
+    print(json.dumps(report, indent=2))
+    if not report["ok"]:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
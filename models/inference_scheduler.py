@@ -0,0 +1,141 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import torch
+
+# Upper bound on frames per forward pass across all requests
+MAX_BATCH_SIZE = int(os.environ.get("SCHEDULER_MAX_BATCH", "64"))
+# How long the first queued chunk may wait for others to join its batch
+MAX_WAIT_MS = float(os.environ.get("SCHEDULER_MAX_WAIT_MS", "5"))
+SCHEDULER_ENABLED = os.environ.get("INFER_SCHEDULER", "1") == "1"
+
+# Powers of two used to bucket executed batch sizes in stats()
+_BATCH_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128, 256]
+
+class _Chunk:
+    __slots__ = ("batch", "future", "enqueued")
+
+    def __init__(self, batch):
+        self.batch = batch
+        self.future = Future()
+        self.enqueued = time.perf_counter()
+
+class InferenceScheduler:
+    """Owns the TorchScript model and runs frames from concurrent requests together.
+
+    Callers use the scheduler exactly like the model: `scheduler(batch)` blocks and
+    returns that batch's logits; a batch larger than `max_batch_size` is split into
+    chunks that fit. Behind the call, a single worker thread merges
+    the chunks of every in-flight request into batches of up to `max_batch_size`
+    frames, waiting at most `max_wait_ms` after the first chunk arrives, and
+    routes each slice of the output back to its caller.
+    """
+
+    def __init__(self, model, device, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS):
+        self.model = model
+        self.device = device
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue = queue.Queue()
+        self._carry = None
+        self._lock = threading.Lock()
+        self._pending_frames = 0
+        self._batches = 0
+        self._frames = 0
+        self._max_batch_seen = 0
+        self._queue_wait = 0.0
+        self._histogram = {f"<={bucket}": 0 for bucket in _BATCH_BUCKETS}
+        self._histogram[f">{_BATCH_BUCKETS[-1]}"] = 0
+        self._thread = threading.Thread(target=self._run, name="inference-scheduler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def __call__(self, batch):
+        # Batches over max_batch_size go in as several chunks, so no forward pass exceeds it
+        size = self.max_batch_size
+        chunks = [_Chunk(batch[start:start + size]) for start in range(0, max(len(batch), 1), size)]
+        with self._lock:
+            self._pending_frames += len(batch)
+        for chunk in chunks:
+            self._queue.put(chunk)
+        outputs = [chunk.future.result() for chunk in chunks]
+        return outputs[0] if len(outputs) == 1 else torch.cat(outputs)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize() + (1 if self._carry is not None else 0),
+                "pending_frames": self._pending_frames,
+                "batches": self._batches,
+                "frames": self._frames,
+                "mean_batch_size": self._frames / self._batches if self._batches else 0.0,
+                "max_batch_size_seen": self._max_batch_seen,
+                "mean_queue_wait_ms": 1000.0 * self._queue_wait / self._batches if self._batches else 0.0,
+                "batch_size_histogram": dict(self._histogram),
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+            }
+
+    def _next_chunk(self, timeout=None):
+        if self._carry is not None:
+            chunk, self._carry = self._carry, None
+            return chunk
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def _collect(self):
+        first = self._next_chunk()
+        chunks = [first]
+        frames = len(first.batch)
+        deadline = time.perf_counter() + self.max_wait
+
+        while frames < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            chunk = self._next_chunk(timeout=remaining)
+            if chunk is None:
+                break
+            if frames + len(chunk.batch) > self.max_batch_size:
+                # Doesn't fit: it opens the next batch instead
+                self._carry = chunk
+                break
+            chunks.append(chunk)
+            frames += len(chunk.batch)
+
+        return chunks, frames
+
+    def _run(self):
+        while True:
+            chunks, frames = self._collect()
+            started = time.perf_counter()
+            try:
+                batch = torch.cat([chunk.batch.to(self.device) for chunk in chunks])
+                # no_grad is thread-local, so the worker needs its own
+                with torch.no_grad():
+                    output = self.model(batch)
+            except Exception as e:
+                for chunk in chunks:
+                    chunk.future.set_exception(e)
+            else:
+                offset = 0
+                for chunk in chunks:
+                    size = len(chunk.batch)
+                    chunk.future.set_result(output[offset:offset + size])
+                    offset += size
+
+            with self._lock:
+                self._pending_frames -= frames
+                self._batches += 1
+                self._frames += frames
+                self._max_batch_seen = max(self._max_batch_seen, frames)
+                self._queue_wait += sum(started - chunk.enqueued for chunk in chunks) / len(chunks)
+                bucket = next((b for b in _BATCH_BUCKETS if frames <= b), None)
+                self._histogram[f"<={bucket}" if bucket else f">{_BATCH_BUCKETS[-1]}"] += 1
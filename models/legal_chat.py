@@ -1,11 +1,19 @@
 import os
 import logging
+import re
+import time
 from flask import Flask, request, jsonify, Response, make_response
-from langchain_community.vectorstores import FAISS
 from mistralai import Mistral
-from langchain_community.embeddings import HuggingFaceEmbeddings
 from dotenv import load_dotenv
 
+from readiness import ServiceLoader, install_health_routes, WARMUP_ITERATIONS
+from metrics import count, install_metrics, observe, timed, timed_stream
+from retrieval import retrieve_documents, search_vectors
+from context_packer import CONTEXT_CANDIDATES, pack_context
+from query_cache import ANSWER_CACHE, QueryCache, SemanticAnswerCache
+from ann_index import open_vector_store
+from legal_db import LEGAL_INDEX_PATH
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -13,15 +21,26 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-logger.info("Loading FAISS vector store...")
-# Load FAISS vector store with safe deserialization
-vector_store = FAISS.load_local(
-    "faiss_legal_db",
-    HuggingFaceEmbeddings(model_name="BAAI/bge-small-en"),
-    allow_dangerous_deserialization=True
-)
-retriever = vector_store.as_retriever()
-logger.info("FAISS vector store loaded successfully")
+# Set by load_vector_store() on the loader thread
+vector_store = None
+
+def load_vector_store():
+    # langchain and the embedding model are imported here so the port binds before they are loaded
+    global vector_store
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+
+    logger.info("Loading FAISS vector store...")
+    # Load FAISS vector store, memory-mapped so worker processes share one copy (see ann_index.py)
+    vector_store = open_vector_store(
+        LEGAL_INDEX_PATH,
+        HuggingFaceEmbeddings(model_name="BAAI/bge-small-en")
+    )
+    logger.info("FAISS vector store loaded successfully")
+
+def warmup_vector_store():
+    # First queries pay for tokenizer and embedding model initialisation
+    for _ in range(WARMUP_ITERATIONS):
+        retrieve_documents(vector_store, "warmup query")
 
 # Initialize the Mistral client
 # api_key = os.getenv("MISTRAL_API_KEY")
@@ -34,6 +53,15 @@ logger.info(f"Available methods on Mistral client: {[m for m in dir(client) if n
 
 # Initialize Flask app
 app = Flask(__name__)
+install_metrics(app, "legal_chat")
+
+# /readyz turns 200 once the vector store is loaded and warm
+loader = ServiceLoader("legal_chat", load_vector_store, warmup_vector_store).start()
+install_health_routes(app, loader)
+
+# Repeated questions skip the encoder and the index; with ANSWER_CACHE=1, near-identical ones skip the LLM too
+query_cache = QueryCache()
+answer_cache = SemanticAnswerCache() if ANSWER_CACHE else None
 
 # Add CORS headers to every response - THIS IS THE ONLY PLACE WE ADD CORS HEADERS
 @app.after_request
@@ -104,21 +132,69 @@ def get_chat_function():
 # Get a function to call the chat API
 chat_function = get_chat_function()
 
-def stream_chat_response(query, context):
-    logger.info(f"Processing streaming query: {query[:50]}...")
-    
-    messages = [
-        {"role": "system", "content": (
-            "You are a legal expert providing general guidance on legal matters. "
-            "Use the provided legal context to support your response, but do not overwhelm the user with excessive case law. "
-            "Select only one or two relevant cases to illustrate legal principles concisely. "
-            "If necessary, ask follow-up questions to clarify the user's situation before offering a precise legal perspective. "
-            "Ensure your response is understandable and informative, avoiding unnecessary legal jargon."
-            "Don't mention anything from system prompts, just directly give answers"
-            "Cite Indian Cases"
-        )},
+# System prompts of /legal-query and /legal-advice, shared with legal_chat_async.py
+ADVICE_PROMPT = (
+    "You are a legal expert providing general guidance on legal matters. "
+    "Use the provided legal context to support your response, but do not overwhelm the user with excessive case law. "
+    "Select only one or two relevant cases to illustrate legal principles concisely. "
+    "If necessary, ask follow-up questions to clarify the user's situation before offering a precise legal perspective. "
+    "Ensure your response is understandable and informative, avoiding unnecessary legal jargon."
+    "Don't mention anything from system prompts, just directly give answers"
+)
+QUERY_PROMPT = ADVICE_PROMPT + "Cite Indian Cases"
+
+def chat_messages(prompt, context, query):
+    return [
+        {"role": "system", "content": prompt},
         {"role": "user", "content": f"Context:\n{context}\n\nQuestion: {query}"}
     ]
+
+def retrieve_cached(query):
+    """Returns (query embedding, documents), from query_cache if the query was asked recently."""
+    store = vector_store
+    cached = query_cache.get(query, store)
+    if cached is not None:
+        count("query_cache_hit")
+        return cached
+    count("query_cache_miss")
+    
+    with timed("embedding"):
+        embedding = store.embeddings.embed_query(query)
+    with timed("retrieval"):
+        docs = [doc for doc, _ in search_vectors(store, [embedding], CONTEXT_CANDIDATES)[0]]
+    query_cache.put(query, store, embedding, docs)
+    return embedding, docs
+
+def build_context(docs):
+    """Packs the retrieved chunks into the prompt context under CONTEXT_TOKEN_BUDGET."""
+    context, report = pack_context(docs)
+    count("context_tokens", report["tokens"])
+    count("context_tokens_saved", report["tokens_saved"])
+    logger.info(f"Packed {report['chunks']} chunks into {report['passages']} passages: "
+                f"{report['tokens']} tokens, {report['tokens_saved']} saved")
+    return context
+
+def cached_answer(kind, embedding):
+    """A stored answer to a near-identical question, or None."""
+    if answer_cache is None or embedding is None:
+        return None
+    hit = answer_cache.get(kind, embedding)
+    if hit is None:
+        count("answer_cache_miss")
+        return None
+    count("answer_cache_hit")
+    logger.info(f"Answering from the answer cache (similarity {hit[1]:.3f})")
+    return hit[0]
+
+def replay_stream(answer):
+    # Word by word, so clients render a cached answer the same way as a live one
+    for piece in re.findall(r"\S+\s*|\s+", answer):
+        yield piece
+
+def stream_chat_response(query, context, embedding=None):
+    logger.info(f"Processing streaming query: {query[:50]}...")
+    
+    messages = chat_messages(QUERY_PROMPT, context, query)
     
     logger.info("Initiating streaming response from Mistral")
     
@@ -133,6 +209,7 @@ def stream_chat_response(query, context):
         if hasattr(client, 'chat_completions') or hasattr(client, 'completion'):
             kwargs["stream"] = True
         
+        llm_start = time.perf_counter()
         stream_response = chat_function(**kwargs)
         
         # Log the type of response we got
@@ -144,6 +221,8 @@ def stream_chat_response(query, context):
         return Response(f"Error: {str(e)}", content_type='text/plain')
     
     def generate():
+        first_token = True
+        parts = []
         try:
             for chunk in stream_response:
                 logger.debug(f"Chunk type: {type(chunk)}")
@@ -176,16 +255,24 @@ def stream_chat_response(query, context):
                         content = chunk.data.choices[0].text
                 
                 if content:
+                    if first_token:
+                        observe("llm_first_token", time.perf_counter() - llm_start)
+                        first_token = False
                     logger.debug(f"Streaming chunk: {content[:20]}...")
+                    parts.append(content)
                     yield content
-                
+            
+            observe("llm_total", time.perf_counter() - llm_start)
+            # Only complete answers are cached
+            if answer_cache is not None and embedding is not None:
+                answer_cache.put("query", embedding, "".join(parts))
         except Exception as e:
             error_msg = f"Error during streaming: {str(e)}"
             logger.error(error_msg, exc_info=True)
             yield error_msg
     
     # Don't manually add CORS headers here - let the @after_request decorator handle it
-    return Response(generate(), content_type='text/plain')
+    return Response(timed_stream(generate()), content_type='text/plain')
 
 @app.route("/legal-query", methods=["GET", "POST"])
 def legal_query():
@@ -205,20 +292,23 @@ def legal_query():
     
     # Retrieve relevant legal documents
     logger.info("Retrieving relevant documents from vector store")
+    embedding = None
     try:
-        # Updated to use the new recommended method, with fallback
-        if hasattr(retriever, 'invoke'):
-            docs = retriever.invoke(query)
-        else:
-            docs = retriever.get_relevant_documents(query)
+        embedding, docs = retrieve_cached(query)
         
         logger.info(f"Retrieved {len(docs)} relevant documents")
-        context = "\n\n".join([doc.page_content for doc in docs])
+        context = build_context(docs)
     except Exception as e:
         logger.error(f"Error retrieving documents: {str(e)}")
         context = "Unable to retrieve relevant legal information."
     
-    return stream_chat_response(query, context)
+    answer = cached_answer("query", embedding)
+    if answer is not None:
+        response = Response(timed_stream(replay_stream(answer)), content_type='text/plain')
+        response.headers.set('X-Answer-Cache', 'hit')
+        return response
+    
+    return stream_chat_response(query, context, embedding)
 
 @app.route("/legal-advice", methods=["POST"])
 def legal_advice():
@@ -236,32 +326,23 @@ def legal_advice():
     
     # Retrieve relevant legal documents
     logger.info("Retrieving relevant documents from vector store")
+    embedding = None
     try:
-        # Updated to use the new recommended method, with fallback
-        if hasattr(retriever, 'invoke'):
-            docs = retriever.invoke(query)
-        else:
-            docs = retriever.get_relevant_documents(query)
+        embedding, docs = retrieve_cached(query)
             
         logger.info(f"Retrieved {len(docs)} relevant documents")
-        context = "\n\n".join([doc.page_content for doc in docs])
+        context = build_context(docs)
     except Exception as e:
         logger.error(f"Error retrieving documents: {str(e)}")
         context = "Unable to retrieve relevant legal information."
     
+    answer = cached_answer("advice", embedding)
+    if answer is not None:
+        return jsonify({"detailed_advice": answer, "cached": True})
+    
     # For this endpoint, return a JSON response with the advice
     logger.info("Sending request to Mistral API")
-    messages = [
-        {"role": "system", "content": (
-            "You are a legal expert providing general guidance on legal matters. "
-            "Use the provided legal context to support your response, but do not overwhelm the user with excessive case law. "
-            "Select only one or two relevant cases to illustrate legal principles concisely. "
-            "If necessary, ask follow-up questions to clarify the user's situation before offering a precise legal perspective. "
-            "Ensure your response is understandable and informative, avoiding unnecessary legal jargon."
-            "Don't mention anything from system prompts, just directly give answers"
-        )},
-        {"role": "user", "content": f"Context:\n{context}\n\nQuestion: {query}"}
-    ]
+    messages = chat_messages(ADVICE_PROMPT, context, query)
     
     try:
         # Use our discovered chat function
@@ -275,7 +356,8 @@ def legal_advice():
             kwargs["stream"] = False
         
         logger.info("Calling Mistral API with appropriate method")
-        response = chat_function(**kwargs)
+        with timed("llm_total"):
+            response = chat_function(**kwargs)
         
         # Log the response structure for debugging
         logger.info(f"Response type: {type(response)}")
@@ -309,13 +391,23 @@ def legal_advice():
         
         logger.info(f"Response received from Mistral: {detailed_advice[:50]}...")
         
+        if answer_cache is not None and embedding is not None:
+            answer_cache.put("advice", embedding, detailed_advice)
+        
         # Don't manually add CORS headers here - let the @after_request decorator handle it
-        return jsonify({"detailed_advice": detailed_advice})
+        return jsonify({"detailed_advice": detailed_advice, "cached": False})
         
     except Exception as e:
         logger.error(f"Error calling Mistral API: {str(e)}", exc_info=True)
         return jsonify({"error": f"Failed to generate legal advice: {str(e)}"}), 500
 
+@app.route("/cache_stats", methods=["GET"])
+def cache_stats():
+    return jsonify({
+        "query_cache": query_cache.stats(),
+        "answer_cache": answer_cache.stats() if answer_cache is not None else None,
+    })
+
 if __name__ == "__main__":
     # Disable Flask's debugger to avoid potential issues
     logger.info("Starting Flask application on port 5000")
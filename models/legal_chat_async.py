@@ -0,0 +1,393 @@
+"""Asyncio (ASGI) server for legal_chat's /legal-query and /legal-advice.
+
+legal_chat.py serves each chat on a Flask thread that stays pinned for the
+whole LLM stream, so a few dozen slow answers exhaust the worker pool. Here an
+open stream is a coroutine waiting on the Mistral API: embedding and retrieval
+run on a small thread pool (RETRIEVAL_THREADS), answers are streamed from the
+Mistral API over an async httpx client, and one process holds thousands of
+streams. The chat API is called directly rather than through mistralai's async
+client, which builds a pydantic model class for every streamed event and tops
+out at a few hundred tokens per second per core.
+
+    python legal_chat_async.py
+    uvicorn legal_chat_async:app --host 0.0.0.0 --port 5000 --backlog 4096
+
+The index, caches and prompts are legal_chat.py's. A client that disconnects
+cancels its LLM request, which closes the connection to the API. Each stream
+holds one token at a time: writes wait for the client's socket to drain,
+answers are kept for the answer cache only up to MAX_ANSWER_CHARS, and request
+bodies are capped at MAX_REQUEST_BYTES. Past MAX_STREAMS open LLM calls, new
+requests get a 503. Every stream uses one file descriptor for the client and
+one for the API, so raise `ulimit -n` to match.
+
+To test without the API, run `python stub_llm.py` and set
+MISTRAL_SERVER_URL=http://127.0.0.1:8001.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import anyio
+import httpx
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+import legal_chat
+from legal_chat import (ADVICE_PROMPT, QUERY_PROMPT, build_context, cached_answer, chat_messages, loader,
+                        replay_stream, retrieve_cached)
+from metrics import REQUEST_SECONDS, REQUESTS, count, observe, render
+from readiness import READY_WAIT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Threads that embed queries and search the index; the event loop never does
+RETRIEVAL_THREADS = int(os.environ.get("RETRIEVAL_THREADS", str(min(8, os.cpu_count() or 1))))
+# LLM calls in flight at once; requests past this get a 503 instead of queueing
+MAX_STREAMS = int(os.environ.get("MAX_STREAMS", "4096"))
+MAX_REQUEST_BYTES = int(os.environ.get("MAX_REQUEST_BYTES", "65536"))
+# Longer answers are streamed but not kept for the answer cache
+MAX_ANSWER_CHARS = int(os.environ.get("MAX_ANSWER_CHARS", "32768"))
+LLM_TIMEOUT_SECONDS = float(os.environ.get("LLM_TIMEOUT_SECONDS", "120"))
+# Or another Mistral-compatible endpoint, such as `python stub_llm.py`
+MISTRAL_SERVER_URL = os.environ.get("MISTRAL_SERVER_URL", "https://api.mistral.ai")
+# Connections per httpx client; httpcore scans a client's whole pool for every request
+LLM_POOL_CONNECTIONS = int(os.environ.get("LLM_POOL_CONNECTIONS", "256"))
+
+def _llm_client():
+    return httpx.AsyncClient(
+        base_url=MISTRAL_SERVER_URL,
+        headers={"Authorization": f"Bearer {legal_chat.api_key}"},
+        # No per-client cap (httpx's default is 100): MAX_STREAMS bounds the total
+        limits=httpx.Limits(max_connections=MAX_STREAMS, max_keepalive_connections=LLM_POOL_CONNECTIONS // 4),
+        timeout=httpx.Timeout(LLM_TIMEOUT_SECONDS, connect=10.0),
+    )
+
+# Taken in turn, so each holds about LLM_POOL_CONNECTIONS streams and its scans stay short
+clients = [_llm_client() for _ in range(max(1, math.ceil(MAX_STREAMS / LLM_POOL_CONNECTIONS)))]
+_next_client = itertools.count()
+
+def llm_client():
+    return clients[next(_next_client) % len(clients)]
+
+retrieval_pool = ThreadPoolExecutor(RETRIEVAL_THREADS, thread_name_prefix="retrieval")
+
+# LLM calls in flight; only touched on the event loop, so no lock
+active_streams = 0
+
+class RequestTooLarge(Exception):
+    pass
+
+class ClientDisconnected(Exception):
+    pass
+
+class LLMError(Exception):
+    pass
+
+def acquire_stream():
+    global active_streams
+    if active_streams >= MAX_STREAMS:
+        count("stream_rejected")
+        return False
+    active_streams += 1
+    return True
+
+def release_stream():
+    global active_streams
+    active_streams -= 1
+
+def prepare(query, kind):
+    """Runs on retrieval_pool: (query embedding, packed context, cached answer or None)."""
+    embedding = None
+    try:
+        embedding, docs = retrieve_cached(query)
+        logger.info(f"Retrieved {len(docs)} relevant documents")
+        context = build_context(docs)
+    except Exception as e:
+        logger.error(f"Error retrieving documents: {str(e)}")
+        context = "Unable to retrieve relevant legal information."
+    return embedding, context, cached_answer(kind, embedding)
+
+async def read_query(request):
+    """The `query` of a GET parameter or JSON body, reading at most MAX_REQUEST_BYTES."""
+    if request.method == "GET":
+        return request.query_params.get("query")
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > MAX_REQUEST_BYTES:
+            raise RequestTooLarge()
+    try:
+        data = json.loads(body) if body else None
+    except ValueError:
+        data = None
+    return data.get("query") if isinstance(data, dict) else None
+
+async def wait_until_ready():
+    # Like readiness.install_health_routes, but waiting on the loop instead of a thread
+    deadline = time.monotonic() + READY_WAIT_SECONDS
+    while not loader.ready and loader.state != "failed" and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+    return loader.ready
+
+def not_ready():
+    return JSONResponse({"error": f"{loader.name} is not ready yet", **loader.status()}, status_code=503,
+                        headers={"Retry-After": "5"})
+
+async def _disconnect(request):
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+async def cancel_on_disconnect(request, awaitable):
+    """Awaits `awaitable`, cancelling it and raising ClientDisconnected if the client leaves first."""
+    work = asyncio.ensure_future(awaitable)
+    watch = asyncio.ensure_future(_disconnect(request))
+    try:
+        done, _ = await asyncio.wait({work, watch}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watch.cancel()
+        work.cancel()
+    if work not in done:
+        raise ClientDisconnected()
+    return work.result()
+
+def _text(content):
+    if isinstance(content, list):
+        # Newer models send a list of content chunks
+        return "".join(part.get("text") or "" for part in content if isinstance(part, dict))
+    return content
+
+async def open_chat_stream(messages):
+    """Starts a streamed chat completion; returns the httpx response, whose body is the event stream."""
+    client = llm_client()
+    request = client.build_request("POST", "/v1/chat/completions",
+                                   json={"model": "mistral-tiny", "messages": messages, "stream": True})
+    response = await client.send(request, stream=True)
+    if response.status_code != 200:
+        await response.aread()
+        await response.aclose()
+        raise LLMError(f"Mistral API returned {response.status_code}: {response.text[:200]}")
+    return response
+
+async def chat_deltas(response):
+    """The text pieces of a streamed chat completion, as they arrive."""
+    async for line in response.aiter_lines():
+        if not line.startswith("data:"):
+            continue
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            break
+        choices = json.loads(data).get("choices") or []
+        content = _text(choices[0].get("delta", {}).get("content")) if choices else None
+        if content:
+            yield content
+
+async def complete_chat(messages):
+    response = await llm_client().post("/v1/chat/completions", json={"model": "mistral-tiny", "messages": messages})
+    if response.status_code != 200:
+        raise LLMError(f"Mistral API returned {response.status_code}: {response.text[:200]}")
+    return _text(response.json()["choices"][0]["message"]["content"])
+
+class ChatStreamResponse(StreamingResponse):
+    """StreamingResponse that always runs `on_close`, even if the client left before the body started."""
+
+    def __init__(self, content, on_close, **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            with anyio.CancelScope(shield=True):
+                await self.body_iterator.aclose()
+                await self.on_close()
+
+async def stream_answer(stream, llm_start, embedding):
+    first_token = True
+    # Only complete answers are cached, so nothing is kept when there is no cache
+    parts = [] if legal_chat.answer_cache is not None and embedding is not None else None
+    size = 0
+    try:
+        async for content in chat_deltas(stream):
+            if first_token:
+                observe("llm_first_token", time.perf_counter() - llm_start)
+                first_token = False
+            if parts is not None:
+                parts.append(content)
+                size += len(content)
+                if size > MAX_ANSWER_CHARS:
+                    parts = None
+            yield content
+
+        observe("llm_total", time.perf_counter() - llm_start)
+        count("stream_completed")
+        if parts is not None:
+            legal_chat.answer_cache.put("query", embedding, "".join(parts))
+    except (asyncio.CancelledError, GeneratorExit):
+        # The client went away; on_close closes the API connection, which stops generation
+        count("stream_cancelled")
+        logger.info("Client disconnected; cancelling the LLM stream")
+        raise
+    except Exception as e:
+        error_msg = f"Error during streaming: {str(e)}"
+        logger.error(error_msg, exc_info=True)
+        yield error_msg
+
+async def replay(answer):
+    # replay_stream() is a plain generator; StreamingResponse would step it on a thread per piece
+    for piece in replay_stream(answer):
+        yield piece
+
+async def legal_query(request):
+    try:
+        query = await read_query(request)
+    except RequestTooLarge:
+        return JSONResponse({"error": "Request body is too large"}, status_code=413)
+    if not query:
+        logger.warning("Missing query parameter")
+        return JSONResponse({"error": "Query parameter is required"}, status_code=400)
+    if not await wait_until_ready():
+        return not_ready()
+
+    loop = asyncio.get_running_loop()
+    embedding, context, answer = await loop.run_in_executor(retrieval_pool, prepare, query, "query")
+    if answer is not None:
+        return StreamingResponse(replay(answer), media_type="text/plain", headers={"X-Answer-Cache": "hit"})
+
+    if not acquire_stream():
+        return JSONResponse({"error": "Too many open streams"}, status_code=503, headers={"Retry-After": "1"})
+    logger.info(f"Processing streaming query: {query[:50]}...")
+    llm_start = time.perf_counter()
+    try:
+        stream = await cancel_on_disconnect(request, open_chat_stream(chat_messages(QUERY_PROMPT, context, query)))
+    except ClientDisconnected:
+        release_stream()
+        count("stream_cancelled")
+        return Response(status_code=499)
+    except Exception as e:
+        release_stream()
+        logger.error(f"Error creating streaming response: {str(e)}", exc_info=True)
+        return Response(f"Error: {str(e)}", media_type="text/plain")
+
+    response_start = time.perf_counter()
+
+    async def close():
+        await stream.aclose()
+        release_stream()
+        observe("response_stream", time.perf_counter() - response_start)
+
+    count("stream_started")
+    return ChatStreamResponse(stream_answer(stream, llm_start, embedding), close, media_type="text/plain")
+
+async def legal_advice(request):
+    try:
+        query = await read_query(request)
+    except RequestTooLarge:
+        return JSONResponse({"error": "Request body is too large"}, status_code=413)
+    if not query:
+        logger.warning("Missing query parameter")
+        return JSONResponse({"error": "Query parameter is required"}, status_code=400)
+    if not await wait_until_ready():
+        return not_ready()
+
+    loop = asyncio.get_running_loop()
+    embedding, context, answer = await loop.run_in_executor(retrieval_pool, prepare, query, "advice")
+    if answer is not None:
+        return JSONResponse({"detailed_advice": answer, "cached": True})
+
+    if not acquire_stream():
+        return JSONResponse({"error": "Too many open streams"}, status_code=503, headers={"Retry-After": "1"})
+    try:
+        llm_start = time.perf_counter()
+        detailed_advice = await cancel_on_disconnect(request, complete_chat(chat_messages(ADVICE_PROMPT, context, query)))
+        observe("llm_total", time.perf_counter() - llm_start)
+    except ClientDisconnected:
+        count("advice_cancelled")
+        logger.info("Client disconnected; cancelled the LLM request")
+        return Response(status_code=499)
+    except Exception as e:
+        logger.error(f"Error calling Mistral API: {str(e)}", exc_info=True)
+        return JSONResponse({"error": f"Failed to generate legal advice: {str(e)}"}, status_code=500)
+    finally:
+        release_stream()
+
+    if legal_chat.answer_cache is not None and embedding is not None:
+        legal_chat.answer_cache.put("advice", embedding, detailed_advice)
+    return JSONResponse({"detailed_advice": detailed_advice, "cached": False})
+
+async def healthz(request):
+    return JSONResponse({"status": "ok", "state": loader.state})
+
+async def readyz(request):
+    return JSONResponse(loader.status(), status_code=200 if loader.ready else 503)
+
+async def metrics(request):
+    return Response(render(), media_type="text/plain; version=0.0.4")
+
+async def cache_stats(request):
+    answer_cache = legal_chat.answer_cache
+    return JSONResponse({
+        "query_cache": legal_chat.query_cache.stats(),
+        "answer_cache": answer_cache.stats() if answer_cache is not None else None,
+    })
+
+async def stream_stats(request):
+    return JSONResponse({"active": active_streams, "max_streams": MAX_STREAMS, "retrieval_threads": RETRIEVAL_THREADS})
+
+class RequestMetrics:
+    """ASGI middleware timing each request until its last body chunk, like metrics.install_metrics."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] == "/metrics":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = ["500"]
+
+        async def send_and_record(message):
+            if message["type"] == "http.response.start":
+                status[0] = str(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_record)
+        finally:
+            # The router leaves the matched route's function in the scope
+            endpoint = getattr(scope.get("endpoint"), "__name__", "unknown")
+            REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint)
+            REQUESTS.inc(endpoint, status[0])
+
+app = Starlette(
+    routes=[
+        Route("/legal-query", legal_query, methods=["GET", "POST"]),
+        Route("/legal-advice", legal_advice, methods=["POST"]),
+        Route("/healthz", healthz, methods=["GET"]),
+        Route("/readyz", readyz, methods=["GET"]),
+        Route("/metrics", metrics, methods=["GET"]),
+        Route("/cache_stats", cache_stats, methods=["GET"]),
+        Route("/stream_stats", stream_stats, methods=["GET"]),
+    ],
+    middleware=[
+        Middleware(RequestMetrics),
+        # Same headers legal_chat.py adds after every request
+        Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["GET", "POST", "OPTIONS"],
+                   allow_headers=["Content-Type", "Authorization"], max_age=3600),
+    ],
+)
+
+if __name__ == "__main__":
+    import uvicorn
+
+    logger.info("Starting asyncio server on port 5000")
+    uvicorn.run(app, host="0.0.0.0", port=5000, backlog=4096)
@@ -1,27 +1,243 @@
+"""Builds faiss_legal_db from the IndicLegalQA dataset in resumable shards.
+
+    python legal_db.py [--dataset "IndicLegalQA Dataset_10K_Revised.json"] [--workers 4]
+
+Records are streamed from the JSON list (or a .jsonl file) and cut into shards
+of --shard-size records. Worker processes split and embed the shards, and each
+finished shard is saved to <output>.build/ under a hash of its records. A
+crashed or interrupted build therefore picks up from the shards already on
+disk, and after the corpus grows only new or changed shards are embedded. The
+shards are then merged into one index and saved with index_store.save_atomic().
+"""
+import argparse
+import hashlib
 import json
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+import os
+import shutil
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import get_context
+
+from ann_index import INDEX_TYPES, convert
+from docstore import load_store, save_store
+from index_store import index_lock, save_atomic
+
+DATASET_PATH = os.environ.get("LEGAL_DATASET", "IndicLegalQA Dataset_10K_Revised.json")
+LEGAL_INDEX_PATH = os.environ.get("LEGAL_INDEX_PATH", "faiss_legal_db")
+EMBEDDING_MODEL = "BAAI/bge-small-en"
+# Records per shard, the unit of checkpointing
+SHARD_SIZE = int(os.environ.get("LEGAL_SHARD_SIZE", "2000"))
+# Chunks per encoder call
+EMBED_BATCH_SIZE = int(os.environ.get("EMBED_BATCH_SIZE", "64"))
+# flat is exact; see ann_index.py for the approximate types and their trade-offs
+LEGAL_INDEX_TYPE = os.environ.get("LEGAL_INDEX_TYPE", "flat")
+BUILD_WORKERS = int(os.environ.get("LEGAL_BUILD_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+
+# Set in each worker by _init_worker()
+_embeddings = None
+_text_splitter = None
+
+def iter_records(path, read_size=1 << 20):
+    """Yields the records of a JSON list (or a .jsonl file) without loading the whole file."""
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
+
+        decoder = json.JSONDecoder()
+        buffer, pos, started = "", 0, False
+        while True:
+            pos = json.decoder.WHITESPACE.match(buffer, pos).end()
+            if pos < len(buffer):
+                char = buffer[pos]
+                if not started:
+                    if char != "[":
+                        raise ValueError(f"{path} is not a JSON list")
+                    started, pos = True, pos + 1
+                    continue
+                if char == ",":
+                    pos += 1
+                    continue
+                if char == "]":
+                    return
+                try:
+                    # Records are objects, so one cut off at the end of the buffer fails to decode
+                    record, pos = decoder.raw_decode(buffer, pos)
+                    yield record
+                    continue
+                except json.JSONDecodeError:
+                    pass
+
+            more = f.read(read_size)
+            if not more:
+                raise ValueError(f"{path} ended before its closing ']'")
+            buffer, pos = buffer[pos:] + more, 0
+
+def record_text(entry):
+    # Combine case name, date, question, and answer for context
+    return f"Case: {entry['case_name']} | Date: {entry['judgement_date']}\nQuestion: {entry['question']}\nAnswer: {entry['answer']}"
+
+def iter_shards(records, shard_size=SHARD_SIZE):
+    """Yields (shard number, first record number, texts, hash of the texts) per shard_size records."""
+    shard, texts = 0, []
+    for entry in records:
+        texts.append(record_text(entry))
+        if len(texts) == shard_size:
+            yield shard, shard * shard_size, texts, _texts_hash(texts)
+            shard, texts = shard + 1, []
+    if texts:
+        yield shard, shard * shard_size, texts, _texts_hash(texts)
+
+def _texts_hash(texts):
+    digest = hashlib.sha1()
+    for text in texts:
+        digest.update(text.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:16]
+
+def shard_path(build_dir, shard, digest):
+    return os.path.join(build_dir, f"shard-{shard:05d}-{digest}")
+
+def _init_worker(threads):
+    global _embeddings, _text_splitter
+    import torch
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+
+    # Workers split the cores between them instead of each using all of them
+    torch.set_num_threads(threads)
+    _embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+    _text_splitter = RecursiveCharacterTextSplitter(chunk_size=512, chunk_overlap=50)
+
+def build_shard(shard, first_record, texts, path, batch_size=EMBED_BATCH_SIZE):
+    """Splits and embeds one shard and saves it to `path`; returns (shard, records, chunks, seconds)."""
+    from langchain_community.vectorstores import FAISS
+
+    start = time.perf_counter()
+    # record/chunk let retrieval put neighbouring chunks of one record back together
+    metadatas = [{"record": first_record + i} for i in range(len(texts))]
+    documents = _text_splitter.create_documents(texts, metadatas=metadatas)
+    chunk_numbers = {}
+    ids = []
+    for document in documents:
+        record = document.metadata["record"]
+        document.metadata["chunk"] = chunk_numbers[record] = chunk_numbers.get(record, -1) + 1
+        ids.append(f"{record}#{document.metadata['chunk']}")
+
+    chunk_texts = [document.page_content for document in documents]
+    vectors = []
+    for i in range(0, len(chunk_texts), batch_size):
+        vectors.extend(_embeddings.embed_documents(chunk_texts[i:i + batch_size]))
+
+    vector_store = FAISS.from_embeddings(list(zip(chunk_texts, vectors)), _embeddings,
+                                        metadatas=[document.metadata for document in documents], ids=ids)
+    # Written under a temporary name so a half-saved shard is never mistaken for a finished one
+    partial = f"{path}.partial"
+    shutil.rmtree(partial, ignore_errors=True)
+    save_store(vector_store, partial)
+    os.rename(partial, path)
+    return shard, len(texts), len(documents), time.perf_counter() - start
+
+def build_shards(records, build_dir, workers=BUILD_WORKERS, shard_size=SHARD_SIZE, batch_size=EMBED_BATCH_SIZE):
+    """Builds every shard not already on disk; returns the shard directories in record order."""
+    os.makedirs(build_dir, exist_ok=True)
+    threads = max(1, (os.cpu_count() or 1) // max(workers, 1))
+    pool = None
+    if workers > 1:
+        # Forked before anything heavy is loaded here; each worker loads its own encoder
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=get_context("fork"),
+                                   initializer=_init_worker, initargs=(threads,))
+    elif _embeddings is None:
+        _init_worker(threads)
+
+    paths, pending = [], set()
+    done = {"records": 0, "chunks": 0, "built": 0, "reused": 0}
+    start = time.perf_counter()
+
+    def report(result):
+        shard, n_records, n_chunks, seconds = result
+        done["records"] += n_records
+        done["chunks"] += n_chunks
+        done["built"] += 1
+        rate = done["chunks"] / max(time.perf_counter() - start, 1e-9)
+        print(f"[legal_db] shard {shard}: {n_records} records, {n_chunks} chunks in {seconds:.1f}s "
+              f"({done['records']} records embedded, {rate:.0f} chunks/s overall)")
+
+    try:
+        for shard, first_record, texts, digest in iter_shards(records, shard_size):
+            path = shard_path(build_dir, shard, digest)
+            paths.append(path)
+            if os.path.isdir(path):
+                done["reused"] += 1
+                continue
+            # A shard of this number from an older corpus is stale
+            for stale in os.listdir(build_dir):
+                if stale.startswith(f"shard-{shard:05d}-"):
+                    shutil.rmtree(os.path.join(build_dir, stale), ignore_errors=True)
+
+            if pool is None:
+                report(build_shard(shard, first_record, texts, path, batch_size))
+                continue
+            # Keep only a few shards of records in memory while reading ahead
+            while len(pending) >= 2 * workers:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    report(future.result())
+            pending.add(pool.submit(build_shard, shard, first_record, texts, path, batch_size))
+
+        for future in wait(pending).done:
+            report(future.result())
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    print(f"[legal_db] {len(paths)} shards: {done['built']} built, {done['reused']} reused from an earlier run, "
+          f"{time.perf_counter() - start:.1f}s")
+    return paths
+
+def merge_shards(paths, embeddings):
+    """Loads the shards in order and merges them into one vector store."""
+    merged = None
+    for path in paths:
+        vector_store = load_store(path, embeddings)
+        if merged is None:
+            merged = vector_store
+        else:
+            merged.merge_from(vector_store)
+    return merged
 
-# Load JSON dataset
-with open("IndicLegalQA Dataset_10K_Revised.json", "r", encoding="utf-8") as file:
-    data = json.load(file)
+def main():
+    parser = argparse.ArgumentParser(description="Build the legal FAISS index in resumable, parallel shards")
+    parser.add_argument("--dataset", default=DATASET_PATH)
+    parser.add_argument("--output", default=LEGAL_INDEX_PATH)
+    parser.add_argument("--workers", type=int, default=BUILD_WORKERS)
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE)
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE)
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default=LEGAL_INDEX_TYPE)
+    parser.add_argument("--clean", action="store_true", help="delete the shards once the index is saved")
+    args = parser.parse_args()
 
-# Extract relevant text (combine case name, date, question, and answer for context)
-documents = []
-for entry in data:
-    case_text = f"Case: {entry['case_name']} | Date: {entry['judgement_date']}\nQuestion: {entry['question']}\nAnswer: {entry['answer']}"
-    documents.append(case_text)
+    build_dir = f"{args.output}.build"
+    paths = build_shards(iter_records(args.dataset), build_dir, workers=args.workers,
+                         shard_size=args.shard_size, batch_size=args.batch_size)
+    if not paths:
+        raise SystemExit(f"No records in {args.dataset}")
 
-# Split text into chunks for embedding
-text_splitter = RecursiveCharacterTextSplitter(chunk_size=512, chunk_overlap=50)
-document_chunks = text_splitter.create_documents(documents)
+    from langchain_community.embeddings import HuggingFaceEmbeddings
 
-# Use BGE embeddings from HuggingFace
-embeddings = HuggingFaceEmbeddings(model_name="BAAI/bge-small-en")
+    start = time.perf_counter()
+    vector_store = merge_shards(paths, _embeddings or HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL))
+    if args.index_type != "flat":
+        convert(vector_store, args.index_type)
+    with index_lock(args.output):
+        save_atomic(vector_store, args.output)
+    print(f"[legal_db] merged {vector_store.index.ntotal} vectors ({args.index_type} index) in {time.perf_counter() - start:.1f}s")
+    if args.clean:
+        shutil.rmtree(build_dir, ignore_errors=True)
 
-# Store in FAISS for fast retrieval
-vector_store = FAISS.from_documents(document_chunks, embeddings)
-vector_store.save_local("faiss_legal_db")
+    print("Legal dataset successfully stored in FAISS!")
 
-print("Legal dataset successfully stored in FAISS!")
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,16 @@
-from flask import Flask, request, jsonify
-import torch
-import cv2
-from PIL import Image
-from collections import Counter
-import torchvision.transforms as transforms
-import os
+from flask import Flask, request, jsonify, Response, stream_with_context
+import json
 import time
 
+from upload_buffer import detach_upload, install_upload_handling, upload_digest, upload_path
+from result_cache import ResultCache
+from readiness import ServiceLoader, install_health_routes, WARMUP_ITERATIONS
+from metrics import install_metrics, observe_stage_times, timed, timed_stream
+
 app = Flask(__name__)
+install_upload_handling(app)
+install_metrics(app, "live")
 
-RESOLUTION = 224 
 CLASS_MAPPING = {
     0: "Abuse",
     1: "Arrest",
@@ -21,75 +22,130 @@ CLASS_MAPPING = {
     7: "Normal"
 }
 
-transformer = transforms.Compose([
-    transforms.ToTensor(),
-    transforms.Normalize(mean=[0.5], std=[0.5]),
-    transforms.Resize((RESOLUTION, RESOLUTION))
-])
-
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 # repo_id = "namban4123/crimemodel"  
 # filename = "crime_tcn_jit.pt" 
 # scripted_model_path = hf_hub_download(repo_id=repo_id, filename=filename)
 scripted_model_path = "crime_tcn_jit.pt"
-model = torch.jit.load(scripted_model_path, map_location=device)
-model.to(device)
-model.eval()
-
-def preprocess_frame(frame):
-    frame_yuv = cv2.cvtColor(frame, cv2.COLOR_BGR2YUV)
-    Y_channel, _, _ = cv2.split(frame_yuv)
-    pil_frame = Image.fromarray(Y_channel)
-    input_tensor = transformer(pil_frame)
-    return input_tensor.unsqueeze(0)
-
-def infer_video(video_path):
-    cap = cv2.VideoCapture(video_path)
-    frame_predictions = []
-    start_time = time.time()
+
+# Set by load_model_state() on the loader thread
+device = model = scheduler = MODEL_VERSION = None
+
+# Re-uploaded clips are answered from here instead of being classified again
+result_cache = ResultCache()
+
+def load_model_state():
+    # torch and the model are imported here so the port binds before they are loaded
+    global device, model, scheduler, MODEL_VERSION
+    import torch
+    from inference_backend import backend_version, load_backend
+    from inference_scheduler import InferenceScheduler, SCHEDULER_ENABLED
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    # TorchScript or ONNX Runtime, see INFERENCE_BACKEND
+    model = load_backend(scripted_model_path, device)
+    device = model.device
+
+    # Frames from concurrent /predict requests share forward passes through the scheduler
+    scheduler = InferenceScheduler(model, device).start() if SCHEDULER_ENABLED else None
+
+    MODEL_VERSION = backend_version(scripted_model_path)
+
+def warmup_model_state():
+    from video_inference import warmup_model
+    warmup_model(model, device, iterations=WARMUP_ITERATIONS)
+
+# /readyz turns 200 once the model is loaded and warm
+loader = ServiceLoader("live", load_model_state, warmup_model_state).start()
+install_health_routes(app, loader)
+
+def infer_video(video_path, **options):
+    from video_inference import infer_video as run_inference
+    return run_inference(scheduler or model, video_path, device, CLASS_MAPPING, **options)
+
+def stream_timeline(video_file, options):
+    """Streams per-window results as NDJSON while the video is still being classified."""
+    from video_inference import infer_timeline
     
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-        
-        input_tensor = preprocess_frame(frame)
-        with torch.no_grad():
-            output = model(input_tensor.to(device))
-            predicted = output.argmax(dim=1).item()
-            frame_predictions.append(predicted)
+    upload = detach_upload(video_file)
     
-    cap.release()
+    def generate():
+        try:
+            for entry in infer_timeline(scheduler or model, upload_path(upload), device, CLASS_MAPPING, **options):
+                yield json.dumps(entry) + "\n"
+        finally:
+            upload.close()
     
-    if frame_predictions:
-        final_prediction = Counter(frame_predictions).most_common(1)[0][0]
-        return CLASS_MAPPING[final_prediction], time.time() - start_time
-    else:
-        return "Unknown", time.time() - start_time
+    return Response(stream_with_context(timed_stream(generate())), mimetype="application/x-ndjson")
 
 @app.route('/predict', methods=['POST'])
 def predict():
-    if 'video' not in request.files:
+    from video_inference import inference_options, timeline_options, PREPROCESS_VERSION
+    
+    # The multipart body is parsed into the upload buffer on first access
+    with timed("upload_receive"):
+        files = request.files
+    if 'video' not in files:
         return jsonify({"error": "No video file provided"}), 400
     
-    video_file = request.files['video']
-    temp_video_path = "temp_video.mp4"
-    video_file.save(temp_video_path)
+    timeline = request.form.get("mode") == "timeline"
+    try:
+        if timeline:
+            options = timeline_options(request.form)
+        else:
+            options = inference_options(request.form)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    # The upload lives in a per-request in-memory file, closed (and freed) here
+    video_file = files['video']
+    if timeline:
+        return stream_timeline(video_file, options)
     
-    prediction, inference_time = infer_video(temp_video_path)
-    os.remove(temp_video_path)
+    try:
+        cache_key = result_cache.key(upload_digest(video_file), MODEL_VERSION, PREPROCESS_VERSION, options)
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            return jsonify({**cached, "cached": True})
+        
+        result = infer_video(upload_path(video_file), **options)
+    finally:
+        video_file.close()
     
-    return jsonify({
-        "predicted_class": prediction,
-        "inference_time": inference_time
-    })
+    observe_stage_times(result["stage_times"])
+    result_cache.put(cache_key, result)
+    return jsonify({**result, "cached": False})
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    return jsonify(result_cache.stats())
+
+@app.route('/scheduler_stats', methods=['GET'])
+def scheduler_stats():
+    if scheduler is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **scheduler.stats()})
 
 def live_inference():
+    import cv2
+    import torch
+    from motion_gate import MotionGate, MOTION_GATE_ENABLED
+    from video_inference import _preprocessing, luma_frame
+    
+    if not loader.wait():
+        print(f"Error: model failed to load: {loader.error}")
+        return
+    
     cap = cv2.VideoCapture(0)
     if not cap.isOpened():
         print("Error: Unable to access the webcam.")
         return
     
+    # Static scenes reuse the last prediction instead of running the model
+    gate = MotionGate() if MOTION_GATE_ENABLED else None
+    # The model gets the same preprocessing as /predict (see FAST_PREPROCESS); the gate only needs luma
+    preprocess, collate = _preprocessing(1)
+    label, confidence = "Unknown", None
+    
     while True:
         ret, frame = cap.read()
         if not ret:
@@ -97,13 +153,21 @@ def live_inference():
             break
         
         start_time = time.time()
-        input_tensor = preprocess_frame(frame)
-        with torch.no_grad():
-            output = model(input_tensor.to(device))
-            predicted = output.argmax(dim=1).item()
+        if gate is None or gate.should_infer(luma_frame(frame), start_time):
+            with torch.no_grad():
+                output = model(collate([preprocess(frame)]).to(device))
+                probs = torch.softmax(output, dim=1)
+                confidence, predicted = (v.item() for v in probs.max(dim=1))
+            label = CLASS_MAPPING.get(predicted, 'Unknown')
+            if gate is not None:
+                gate.update(label, confidence, start_time)
+        else:
+            label, confidence = gate.reuse(start_time)
         inference_time = time.time() - start_time
         
-        overlay_text = f"Pred: {CLASS_MAPPING.get(predicted, 'Unknown')} | {inference_time:.2f}s"
+        overlay_text = f"Pred: {label} | {inference_time:.2f}s"
+        if gate is not None:
+            overlay_text += f" | skipped {gate.skip_ratio:.0%}"
         cv2.putText(frame, overlay_text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX,
                     1, (0, 255, 0), 2, cv2.LINE_AA)
         
@@ -111,6 +175,8 @@ def live_inference():
         if cv2.waitKey(1) & 0xFF == ord('q'):
             break
     
+    if gate is not None:
+        print(f"Motion gate: {gate.stats()}")
     cap.release()
     cv2.destroyAllWindows()
 
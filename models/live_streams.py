@@ -0,0 +1,353 @@
+import itertools
+import math
+import os
+import threading
+import time
+
+import cv2
+import torch
+
+from motion_gate import MotionGate, MOTION_GATE_ENABLED
+from video_inference import _preprocessing, luma_frame, predict_logits
+
+# Concurrent sources a manager accepts before refusing new ones
+MAX_STREAMS = int(os.environ.get("LIVE_MAX_STREAMS", "16"))
+# Ended or failed streams stay listed this long so clients can read their final stats
+FINISHED_RETENTION_SECONDS = float(os.environ.get("LIVE_FINISHED_RETENTION_SECONDS", "300"))
+# Pause after a failed inference, doubling while the model keeps failing
+INFER_ERROR_BACKOFF_SECONDS = 0.1
+INFER_ERROR_BACKOFF_MAX_SECONDS = 10.0
+# Smoothing factor of the per-stream fps / latency moving averages
+_EMA = 0.1
+
+# MotionGate keyword arguments a /streams request may set, with their allowed ranges
+_GATE_OPTIONS = {
+    "pixel_threshold": (int, 0, 255),
+    "area_fraction": (float, 0.0, 1.0),
+    "max_reuse_seconds": (float, 0.0, None),
+    "half_life_seconds": (float, 0.0, None),
+}
+
+class StreamLimitReached(RuntimeError):
+    pass
+
+def parse_source(source):
+    """Device indices arrive as strings from JSON/query args; everything else is a path or URL."""
+    if isinstance(source, int):
+        return source
+    source = str(source).strip()
+    return int(source) if source.isdigit() else source
+
+def motion_gate_option(value):
+    """Checks the 'motion_gate' of a /streams request: None, true/false, or a dict of MotionGate settings."""
+    if value is None or isinstance(value, bool):
+        return value
+    if not isinstance(value, dict):
+        raise ValueError("'motion_gate' must be true, false or an object of gate settings")
+    unknown = sorted(set(value) - set(_GATE_OPTIONS))
+    if unknown:
+        raise ValueError(f"Unknown motion_gate settings {unknown}; expected some of {sorted(_GATE_OPTIONS)}")
+    options = {}
+    for name, setting in value.items():
+        kind, low, high = _GATE_OPTIONS[name]
+        # JSON booleans are ints to Python, and strings are not numbers
+        if (isinstance(setting, bool) or not isinstance(setting, (int, float)) or not math.isfinite(setting)
+                or (kind is int and setting != int(setting))):
+            raise ValueError(f"'motion_gate.{name}' must be {'an integer' if kind is int else 'a number'}")
+        if setting < low or (high is not None and setting > high):
+            raise ValueError(f"'motion_gate.{name}' must be between {low} and {high}" if high is not None
+                             else f"'motion_gate.{name}' must be at least {low}")
+        options[name] = kind(setting)
+    return options
+
+class _Stream:
+    """One capture source read on its own thread, keeping only the newest frame."""
+
+    def __init__(self, stream_id, source, loop=False, gate=None):
+        self.id = stream_id
+        self.source = source
+        self.loop = loop
+        self.gate = gate
+        self.state = "starting"
+        self.error = None
+        self.started = time.time()
+        # When the reader stopped on its own (end of file, error); None while it runs
+        self.ended = None
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._frame = None
+        self._frame_time = 0.0
+        self._fresh = False
+
+        self.frames_read = 0
+        self.frames_dropped = 0
+        self.frames_inferred = 0
+        self.frames_reused = 0
+        self.prediction = None
+        self.confidence = None
+        self.fps = 0.0
+        self.latency_ms = 0.0
+        self.inference_errors = 0
+        self.inference_error = None
+        self._last_inferred = None
+
+        self._thread = threading.Thread(target=self._read, name=f"stream-{stream_id}", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=5)
+        self.state = "stopped"
+
+    @property
+    def alive(self):
+        return self._thread.is_alive()
+
+    def take_frame(self):
+        """Returns (frame, capture_time) if a frame arrived since the last call, else None."""
+        with self._lock:
+            if not self._fresh:
+                return None
+            self._fresh = False
+            return self._frame, self._frame_time
+
+    def record(self, label, confidence, frame_time, now, reused=False):
+        self.prediction = label
+        self.confidence = confidence
+        if reused:
+            self.frames_reused += 1
+        else:
+            self.frames_inferred += 1
+        latency = (now - frame_time) * 1000.0
+        first = self.frames_inferred + self.frames_reused == 1
+        self.latency_ms = latency if first else (1 - _EMA) * self.latency_ms + _EMA * latency
+        if self._last_inferred is not None and now > self._last_inferred:
+            fps = 1.0 / (now - self._last_inferred)
+            self.fps = fps if self.fps == 0.0 else (1 - _EMA) * self.fps + _EMA * fps
+        self._last_inferred = now
+
+    def stats(self):
+        stats = {
+            "id": self.id,
+            "source": self.source,
+            "state": self.state,
+            "error": self.error,
+            "uptime": time.time() - self.started,
+            "frames_read": self.frames_read,
+            "frames_inferred": self.frames_inferred,
+            "frames_reused": self.frames_reused,
+            "frames_dropped": self.frames_dropped,
+            "fps": round(self.fps, 2),
+            "latency_ms": round(self.latency_ms, 2),
+            "prediction": self.prediction,
+            "confidence": self.confidence,
+            "inference_errors": self.inference_errors,
+            "inference_error": self.inference_error,
+        }
+        if self.gate is not None:
+            stats["motion_gate"] = self.gate.stats()
+        return stats
+
+    def _read(self):
+        cap = cv2.VideoCapture(self.source)
+        if not cap.isOpened():
+            self.state = "error"
+            self.error = f"Unable to open source {self.source!r}"
+            self.ended = time.time()
+            return
+
+        # Files are paced at their native frame rate to behave like a camera
+        is_file = isinstance(self.source, str) and os.path.exists(self.source)
+        interval = 0.0
+        if is_file:
+            fps = cap.get(cv2.CAP_PROP_FPS)
+            interval = 1.0 / fps if fps and fps > 0 else 1.0 / 25
+        # Keep the driver's own queue short so frames are as recent as possible
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+        self.state = "running"
+        next_time = time.perf_counter()
+        try:
+            while not self._stop.is_set():
+                ret, frame = cap.read()
+                if not ret:
+                    if is_file and self.loop:
+                        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                        continue
+                    self.state = "ended"
+                    break
+
+                with self._lock:
+                    if self._fresh:
+                        # The previous frame was never classified: drop it
+                        self.frames_dropped += 1
+                    self._frame = frame
+                    self._frame_time = time.time()
+                    self._fresh = True
+                self.frames_read += 1
+
+                if interval:
+                    next_time += interval
+                    delay = next_time - time.perf_counter()
+                    if delay > 0:
+                        self._stop.wait(delay)
+                    else:
+                        next_time = time.perf_counter()
+        except Exception as e:
+            self.state = "error"
+            self.error = str(e)
+        finally:
+            cap.release()
+            if not self._stop.is_set():
+                self.ended = time.time()
+
+class StreamManager:
+    """Runs many live sources against one shared model without a GUI.
+
+    Each source has a reader thread that only keeps its newest frame, so a slow
+    model makes streams skip frames rather than fall behind. A single inference
+    thread gathers the newest frame of every stream into one batch per cycle.
+    At most `max_streams` sources run at once. Streams that end or fail are
+    dropped `retention` seconds later.
+    """
+
+    def __init__(self, model, device, class_mapping, max_streams=MAX_STREAMS, retention=FINISHED_RETENTION_SECONDS):
+        self.model = model
+        self.device = device
+        self.class_mapping = class_mapping
+        self.max_streams = max(1, int(max_streams))
+        self.retention = retention
+        self._streams = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        # The same preprocessing as /predict (see FAST_PREPROCESS); luma_frame alone feeds the motion gates
+        self._preprocess, self._collate = _preprocessing(self.max_streams)
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._infer, name="stream-inference", daemon=True)
+        self._thread.start()
+
+    def start_stream(self, source, loop=False, motion_gate=None):
+        """Starts reading `source` and returns its stream id.
+
+        `motion_gate` is True/False to force the gate on or off, a dict of
+        MotionGate keyword arguments, or None for the MOTION_GATE default.
+        Raises ValueError for anything else (see motion_gate_option).
+        """
+        motion_gate = motion_gate_option(motion_gate)
+        if motion_gate is None:
+            motion_gate = MOTION_GATE_ENABLED
+        gate = None
+        if motion_gate:
+            gate = MotionGate(**motion_gate) if isinstance(motion_gate, dict) else MotionGate()
+
+        with self._lock:
+            self._prune()
+            # Streams that ended or failed no longer hold a slot
+            running = [s for s in self._streams.values() if s.alive or s.state == "starting"]
+            if len(running) >= self.max_streams:
+                raise StreamLimitReached(f"At most {self.max_streams} streams can run at once")
+            stream_id = str(next(self._ids))
+            stream = _Stream(stream_id, parse_source(source), loop=loop, gate=gate)
+            self._streams[stream_id] = stream
+        stream.start()
+        self._wake.set()
+        return stream_id
+
+    def stop_stream(self, stream_id):
+        with self._lock:
+            stream = self._streams.pop(stream_id, None)
+        if stream is None:
+            return None
+        stream.stop()
+        return stream.stats()
+
+    def get(self, stream_id):
+        with self._lock:
+            self._prune()
+            stream = self._streams.get(stream_id)
+        return stream.stats() if stream is not None else None
+
+    def list(self):
+        with self._lock:
+            self._prune()
+            streams = list(self._streams.values())
+        return [stream.stats() for stream in streams]
+
+    def stop_all(self):
+        with self._lock:
+            stream_ids = list(self._streams)
+        for stream_id in stream_ids:
+            self.stop_stream(stream_id)
+
+    def _prune(self):
+        """Drops streams that ended more than `retention` seconds ago; call with _lock held."""
+        now = time.time()
+        for stream_id, stream in list(self._streams.items()):
+            if stream.ended is not None and now - stream.ended > self.retention:
+                del self._streams[stream_id]
+
+    def _model_input(self, frame, luma):
+        # On the fast path the model takes the luma plane the gate already computed
+        if luma is not None and self._preprocess is luma_frame:
+            return luma
+        return self._preprocess(frame)
+
+    def _infer(self):
+        backoff = 0.0
+        while True:
+            with self._lock:
+                self._prune()
+                streams = list(self._streams.values())
+
+            batch = []
+            now = time.time()
+            for stream in streams:
+                if len(batch) == self.max_streams:
+                    break
+                taken = stream.take_frame()
+                if taken is None:
+                    continue
+                frame, frame_time = taken
+                luma = luma_frame(frame) if stream.gate is not None else None
+                if luma is not None and not stream.gate.should_infer(luma, now):
+                    # Static scene: reuse the last prediction instead of running the model
+                    label, confidence = stream.gate.reuse(now)
+                    stream.record(label, confidence, frame_time, now, reused=True)
+                    continue
+                batch.append((stream, frame, luma, frame_time))
+
+            if not batch:
+                # Nothing new: sleep briefly instead of spinning
+                self._wake.wait(0.005)
+                self._wake.clear()
+                continue
+
+            try:
+                inputs = self._collate([self._model_input(frame, luma) for _, frame, luma, _ in batch])
+                probs = torch.softmax(predict_logits(self.model, inputs, self.device).float(), dim=1).cpu()
+            except Exception as e:
+                for stream, _, _, _ in batch:
+                    stream.inference_errors += 1
+                    stream.inference_error = f"{type(e).__name__}: {e}"
+                if not backoff:
+                    print(f"[live_streams] inference failed, backing off: {type(e).__name__}: {e}")
+                # A broken model would otherwise be retried, and logged, on every new frame
+                backoff = min(INFER_ERROR_BACKOFF_MAX_SECONDS, backoff * 2 or INFER_ERROR_BACKOFF_SECONDS)
+                time.sleep(backoff)
+                continue
+            if backoff:
+                print("[live_streams] inference recovered")
+                backoff = 0.0
+
+            now = time.time()
+            confidences, predicted = probs.max(dim=1)
+            for (stream, _, _, frame_time), label, confidence in zip(batch, predicted.tolist(), confidences.tolist()):
+                label, confidence = self.class_mapping.get(label, "Unknown"), round(confidence, 4)
+                if stream.gate is not None:
+                    stream.gate.update(label, confidence, now)
+                stream.record(label, confidence, frame_time, now)
+                stream.inference_error = None
@@ -0,0 +1,240 @@
+"""Request and stage timing shared by the model services, exported for Prometheus.
+
+    from metrics import install_metrics, observe, timed
+    install_metrics(app, "video_classify")   # adds /metrics and per-request timing
+    with timed("decode"):
+        ...
+
+Stage timings go to one `stage_seconds` histogram labelled by stage. Slow requests
+can additionally be sampled with a stack profiler (see SlowRequestProfiler).
+"""
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter as _Tally
+from contextlib import contextmanager
+
+from flask import Response, g, request
+
+# Histogram bucket upper bounds in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Requests slower than this are written out as folded stacks; 0 disables the profiler
+PROFILE_SLOW_MS = float(os.environ.get("PROFILE_SLOW_MS", "0"))
+# Fraction of requests sampled while they run (the profiler only pays off for these)
+PROFILE_RATE = float(os.environ.get("PROFILE_RATE", "1.0"))
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self, constant):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        names = tuple(constant) + self.labels
+        with self._lock:
+            for values, count in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(names, tuple(constant.values()) + values)} {_format_value(count)}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # label values -> [per-bucket counts, sum, count]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += seconds
+            series[2] += 1
+
+    def render(self, constant):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = tuple(constant) + self.labels
+        with self._lock:
+            for values, (counts, total, count) in sorted(self._series.items()):
+                label_values = tuple(constant.values()) + values
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    labels = _format_labels(names + ("le",), label_values + (_format_value(bound),))
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(names, label_values)} {_format_value(total)}")
+                lines.append(f"{self.name}_count{_format_labels(names, label_values)} {count}")
+        return lines
+
+# One process serves one service, so these are module-level like the models they time
+STAGE_SECONDS = Histogram("stage_seconds", "Seconds spent in each stage of a request", labels=("stage",))
+REQUEST_SECONDS = Histogram("http_request_seconds", "Request duration including streamed bodies", labels=("endpoint",))
+REQUESTS = Counter("http_requests_total", "Requests served", labels=("endpoint", "status"))
+PROFILED = Counter("slow_requests_profiled_total", "Slow requests written out by the profiler", labels=("endpoint",))
+EVENTS = Counter("events_total", "Service-specific events, such as which path answered a request", labels=("event",))
+_METRICS = [STAGE_SECONDS, REQUEST_SECONDS, REQUESTS, PROFILED, EVENTS]
+_constant_labels = {}
+
+def observe(stage, seconds):
+    STAGE_SECONDS.observe(seconds, stage)
+
+def count(event, amount=1):
+    EVENTS.inc(event, amount=amount)
+
+@contextmanager
+def timed(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+def observe_stage_times(stage_times):
+    """Records the busy seconds infer_video reports per stage (decode, preprocess, inference)."""
+    for stage, seconds in stage_times.items():
+        observe(stage, seconds)
+
+def timed_stream(chunks, stage="response_stream"):
+    """Wraps a streamed response body, recording how long it took to send."""
+    start = time.perf_counter()
+    try:
+        yield from chunks
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+def render():
+    lines = []
+    for metric in _METRICS:
+        lines.extend(metric.render(_constant_labels))
+    return "\n".join(lines) + "\n"
+
+class SlowRequestProfiler:
+    """Samples the stacks of in-flight requests and keeps those of slow ones.
+
+    One background thread wakes every `interval_ms` and records the current stack
+    of every thread serving a sampled request. When a request finishes slower than
+    `slow_ms`, its samples are written to `directory` in folded-stack format
+    (one "frame;frame;frame count" line per distinct stack), which flamegraph.pl
+    and speedscope read directly. Fast requests just drop their samples.
+    """
+
+    def __init__(self, slow_ms=PROFILE_SLOW_MS, rate=PROFILE_RATE, interval_ms=PROFILE_INTERVAL_MS,
+                 directory=PROFILE_DIR):
+        self.slow_seconds = slow_ms / 1000.0
+        self.rate = rate
+        self.interval = interval_ms / 1000.0
+        self.directory = directory
+        self._active = {}
+        self._lock = threading.Lock()
+        threading.Thread(target=self._sample, name="slow-request-profiler", daemon=True).start()
+
+    def begin(self):
+        """Starts sampling the calling thread; returns a token for end(), or None if not sampled."""
+        if random.random() >= self.rate:
+            return None
+        token = (threading.get_ident(), object())
+        with self._lock:
+            self._active[token] = _Tally()
+        return token
+
+    def end(self, token, seconds, name):
+        if token is None:
+            return None
+        with self._lock:
+            samples = self._active.pop(token, None)
+        if not samples or seconds < self.slow_seconds:
+            return None
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{name}-{int(seconds * 1000)}ms.folded")
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
+
+    def _sample(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    continue
+                frames = sys._current_frames()
+                for (thread_id, _), samples in self._active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        samples[_fold(frame)] += 1
+
+def _fold(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+def install_metrics(app, service, profile_slow_ms=PROFILE_SLOW_MS):
+    """Adds GET /metrics and times every request until its (possibly streamed) body is closed."""
+    _constant_labels["service"] = service
+    profiler = SlowRequestProfiler(slow_ms=profile_slow_ms) if profile_slow_ms > 0 else None
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics():
+        return Response(render(), mimetype="text/plain; version=0.0.4")
+
+    @app.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+        g.profile_token = profiler.begin() if profiler is not None else None
+
+    @app.after_request
+    def finish_request_timer(response):
+        start = g.get("request_start")
+        if start is None or request.endpoint == "metrics":
+            return response
+        endpoint = request.endpoint or "unknown"
+        token = g.get("profile_token")
+        status = str(response.status_code)
+
+        def finished():
+            seconds = time.perf_counter() - start
+            REQUEST_SECONDS.observe(seconds, endpoint)
+            REQUESTS.inc(endpoint, status)
+            if profiler is not None and profiler.end(token, seconds, endpoint):
+                PROFILED.inc(endpoint)
+
+        # Runs once the body has been sent, so streamed responses are timed in full
+        response.call_on_close(finished)
+        return response
@@ -0,0 +1,203 @@
+"""Builds and loads optimized variants of the crime TCN TorchScript model.
+
+    python model_prep.py --variants frozen int8-dynamic int8-static \\
+        --calibration-dir clips/ --eval-dir labeled_clips/
+
+writes crime_tcn_jit.<variant>.pt next to the source model and, with --eval-dir
+(one sub-directory per class name holding that class's clips), compares every
+variant's clip-level accuracy and speed against the fp32 model.
+"""
+import argparse
+import json
+import os
+import time
+
+import torch
+
+VARIANTS = ("fp32", "frozen", "int8-dynamic", "int8-static")
+# Variant the services load, see load_model()
+MODEL_VARIANT = os.environ.get("MODEL_VARIANT", "fp32")
+# Feed the model NHWC ("channels last") tensors, which oneDNN convolutions prefer on CPU
+CHANNELS_LAST = os.environ.get("CHANNELS_LAST", "0") == "1"
+# torch thread pools; 0 leaves torch's defaults alone
+TORCH_INTRA_THREADS = int(os.environ.get("TORCH_INTRA_THREADS", "0"))
+TORCH_INTER_THREADS = int(os.environ.get("TORCH_INTER_THREADS", "0"))
+
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mov", ".mkv")
+
+CLASS_MAPPING = {
+    0: "Abuse",
+    1: "Arrest",
+    2: "Arson",
+    3: "Assault",
+    4: "Burglary",
+    5: "Explosion",
+    6: "Fighting",
+    7: "Normal"
+}
+
+def configure_threads(intra=TORCH_INTRA_THREADS, inter=TORCH_INTER_THREADS):
+    if intra:
+        torch.set_num_threads(intra)
+    if inter:
+        try:
+            torch.set_num_interop_threads(inter)
+        except RuntimeError:
+            # Only allowed before the first inter-op parallel call
+            pass
+
+def variant_path(model_path, variant):
+    if variant == "fp32":
+        return model_path
+    root, ext = os.path.splitext(model_path)
+    return f"{root}.{variant}{ext}"
+
+class ChannelsLast:
+    """Calls the model with NHWC-strided input."""
+
+    def __init__(self, model):
+        self.model = model
+
+    def __call__(self, batch):
+        return self.model(batch.contiguous(memory_format=torch.channels_last))
+
+def freeze(model):
+    return torch.jit.freeze(model.eval())
+
+def load_model(model_path, device, variant=MODEL_VARIANT, channels_last=CHANNELS_LAST):
+    """Loads the requested variant of a TorchScript model, ready for inference.
+
+    "frozen" is derived at load time when no prepared file exists; int8 variants
+    must first be built with this script. Quantized variants only run on CPU.
+    optimize_for_inference is applied here rather than in the saved file because
+    its fused graphs do not always survive torch.jit.save / load.
+    """
+    if variant not in VARIANTS:
+        raise ValueError(f"Unknown model variant '{variant}', expected one of {VARIANTS}")
+
+    path = variant_path(model_path, variant)
+    if variant.startswith("int8"):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"{path} not found, build it with: python model_prep.py --variants {variant}")
+        device = torch.device("cpu")
+
+    if os.path.exists(path):
+        model = torch.jit.load(path, map_location=device)
+    else:
+        model = freeze(torch.jit.load(model_path, map_location=device))
+    model.to(device)
+    model.eval()
+
+    if variant == "frozen":
+        model = torch.jit.optimize_for_inference(model)
+
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
+        return ChannelsLast(model)
+    return model
+
+def _clip_paths(directory):
+    paths = []
+    for root, _, files in os.walk(directory):
+        paths.extend(os.path.join(root, name) for name in sorted(files) if name.lower().endswith(VIDEO_EXTENSIONS))
+    return sorted(paths)
+
+def calibration_batches(directory, frames_per_clip=16, batch_size=16):
+    """Preprocessed frame batches sampled uniformly from the clips in `directory`."""
+    from video_inference import BatchBuffer, iter_frames, luma_frame
+
+    planes = []
+    for path in _clip_paths(directory):
+        stats = {"frames_decoded": 0, "frames_planned": None}
+        planes.extend(luma_frame(frame) for frame in iter_frames(path, stats, "uniform", num_samples=frames_per_clip))
+
+    buffer = BatchBuffer(batch_size)
+    return [buffer.fill(planes[i:i + batch_size]).clone() for i in range(0, len(planes), batch_size)]
+
+def build_variant(model_path, variant, calibration=None):
+    model = torch.jit.load(model_path, map_location="cpu").eval()
+
+    if variant == "frozen":
+        return freeze(model)
+
+    if variant == "int8-dynamic":
+        from torch.ao.quantization import default_dynamic_qconfig, quantize_dynamic_jit
+        return quantize_dynamic_jit(model, {"": default_dynamic_qconfig})
+
+    if variant == "int8-static":
+        from torch.ao.quantization import get_default_qconfig, quantize_jit
+        if not calibration:
+            raise ValueError("int8-static needs calibration frames, pass --calibration-dir")
+
+        def calibrate(m, batches):
+            with torch.no_grad():
+                for batch in batches:
+                    m(batch)
+
+        qconfig = get_default_qconfig(torch.backends.quantized.engine)
+        return quantize_jit(model, {"": qconfig}, calibrate, [calibration])
+
+    raise ValueError(f"Cannot build variant '{variant}'")
+
+def evaluate(model_path, variants, eval_dir, class_mapping, **options):
+    """Clip-level accuracy of each variant on a labeled clip set, plus agreement with fp32."""
+    from video_inference import infer_video
+
+    label_of = {name.lower(): name for name in class_mapping.values()}
+    clips = [(path, label_of.get(os.path.basename(os.path.dirname(path)).lower())) for path in _clip_paths(eval_dir)]
+    clips = [(path, label) for path, label in clips if label is not None]
+    if not clips:
+        raise ValueError(f"No clips under {eval_dir} in sub-directories named after a class")
+
+    cpu = torch.device("cpu")
+    report = {"clips": len(clips), "variants": {}}
+    reference = None
+    for variant in ("fp32",) + tuple(v for v in variants if v != "fp32"):
+        model = load_model(model_path, cpu, variant=variant, channels_last=False)
+        predictions, inference_seconds = [], 0.0
+        for path, _ in clips:
+            result = infer_video(model, path, cpu, class_mapping, **options)
+            predictions.append(result["predicted_class"])
+            inference_seconds += result["stage_times"]["inference"]
+        if reference is None:
+            reference = predictions
+
+        correct = sum(p == label for p, (_, label) in zip(predictions, clips))
+        agree = sum(p == r for p, r in zip(predictions, reference))
+        report["variants"][variant] = {
+            "accuracy": correct / len(clips),
+            "agreement_with_fp32": agree / len(clips),
+            "inference_seconds": inference_seconds,
+            "speedup_vs_fp32": report["variants"]["fp32"]["inference_seconds"] / inference_seconds
+            if variant != "fp32" and inference_seconds else 1.0,
+        }
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and check optimized crime TCN model variants")
+    parser.add_argument("--model", default="crime_tcn_jit.pt")
+    parser.add_argument("--variants", nargs="+", default=["frozen", "int8-dynamic"], choices=VARIANTS[1:])
+    parser.add_argument("--calibration-dir", help="clips used to calibrate int8-static")
+    parser.add_argument("--eval-dir", help="labeled clips, one sub-directory per class name")
+    parser.add_argument("--sampling", default="uniform", help="frame sampling used during evaluation")
+    parser.add_argument("--report", default="model_variants_report.json")
+    args = parser.parse_args()
+
+    configure_threads()
+    calibration = calibration_batches(args.calibration_dir) if args.calibration_dir else None
+
+    for variant in args.variants:
+        start = time.time()
+        model = build_variant(args.model, variant, calibration)
+        path = variant_path(args.model, variant)
+        torch.jit.save(model, path)
+        print(f"Saved {variant} to {path} in {time.time() - start:.1f}s")
+
+    if args.eval_dir:
+        report = evaluate(args.model, args.variants, args.eval_dir, CLASS_MAPPING, sampling=args.sampling)
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
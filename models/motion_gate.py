@@ -0,0 +1,87 @@
+import os
+import time
+
+import cv2
+
+MOTION_GATE_ENABLED = os.environ.get("MOTION_GATE", "1") == "1"
+# A pixel "moved" when its luma changed by more than this (0-255)
+MOTION_PIXEL_THRESHOLD = int(os.environ.get("MOTION_PIXEL_THRESHOLD", "15"))
+# Fraction of moved pixels that makes a frame worth classifying
+MOTION_AREA_FRACTION = float(os.environ.get("MOTION_AREA_FRACTION", "0.01"))
+# A reused prediction is refreshed with a real inference after this many seconds
+MOTION_MAX_REUSE_SECONDS = float(os.environ.get("MOTION_MAX_REUSE_SECONDS", "2.0"))
+# Confidence of a reused prediction halves every this many seconds
+MOTION_HALF_LIFE_SECONDS = float(os.environ.get("MOTION_HALF_LIFE_SECONDS", "1.0"))
+
+# Side of the thumbnail the frame difference is computed on
+_GATE_SIZE = 56
+
+class MotionGate:
+    """Decides from the luma plane whether a live frame needs the model.
+
+    Each frame is shrunk to a small thumbnail and compared with the thumbnail of
+    the last frame that was classified. Unless enough pixels changed, the frame is
+    skipped and the previous prediction is reused with a confidence that decays
+    over time; after `max_reuse_seconds` a frame is classified regardless, so a
+    static scene still gets refreshed.
+    """
+
+    def __init__(self, pixel_threshold=MOTION_PIXEL_THRESHOLD, area_fraction=MOTION_AREA_FRACTION,
+                 max_reuse_seconds=MOTION_MAX_REUSE_SECONDS, half_life_seconds=MOTION_HALF_LIFE_SECONDS):
+        self.pixel_threshold = pixel_threshold
+        self.area_fraction = area_fraction
+        self.max_reuse_seconds = max_reuse_seconds
+        self.half_life_seconds = half_life_seconds
+
+        self._reference = None
+        self._small = None
+        self._last_inference = 0.0
+        self._label = None
+        self._confidence = None
+
+        self.frames_seen = 0
+        self.frames_skipped = 0
+
+    @property
+    def skip_ratio(self):
+        return self.frames_skipped / self.frames_seen if self.frames_seen else 0.0
+
+    def should_infer(self, luma, now=None):
+        """Returns True if the frame (a uint8 luma plane) should go to the model."""
+        now = time.time() if now is None else now
+        self.frames_seen += 1
+
+        self._small = cv2.resize(luma, (_GATE_SIZE, _GATE_SIZE), dst=self._small, interpolation=cv2.INTER_AREA)
+        if (self._reference is None or self._label is None
+                or now - self._last_inference >= self.max_reuse_seconds):
+            return True
+
+        diff = cv2.absdiff(self._small, self._reference)
+        moved = cv2.countNonZero(cv2.threshold(diff, self.pixel_threshold, 255, cv2.THRESH_BINARY)[1])
+        if moved >= self.area_fraction * _GATE_SIZE * _GATE_SIZE:
+            return True
+
+        self.frames_skipped += 1
+        return False
+
+    def update(self, label, confidence, now=None):
+        """Stores the result of a classified frame; call after should_infer returned True."""
+        self._last_inference = time.time() if now is None else now
+        self._label = label
+        self._confidence = confidence
+        self._reference = self._small.copy()
+
+    def reuse(self, now=None):
+        """Returns (label, decayed confidence) of the last classified frame."""
+        now = time.time() if now is None else now
+        confidence = self._confidence
+        if confidence is not None and self.half_life_seconds > 0:
+            confidence = round(confidence * 0.5 ** ((now - self._last_inference) / self.half_life_seconds), 4)
+        return self._label, confidence
+
+    def stats(self):
+        return {
+            "frames_seen": self.frames_seen,
+            "frames_skipped": self.frames_skipped,
+            "skip_ratio": round(self.skip_ratio, 4),
+        }
@@ -0,0 +1,160 @@
+"""Caches for repeated legal questions: query embeddings and retrieved documents, and answers.
+
+QueryCache maps a normalised query to its embedding and retrieved documents, so
+a repeated question skips the encoder and the index. SemanticAnswerCache keeps
+LLM answers by query embedding and returns one for a new query whose embedding
+is within ANSWER_CACHE_THRESHOLD cosine similarity of a cached one. It is off
+unless ANSWER_CACHE=1, since near-identical wording can still ask something
+different. Both evict the least recently used entry past their size, and drop
+entries older than their TTL.
+"""
+import os
+import re
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+
+QUERY_CACHE_SIZE = int(os.environ.get("QUERY_CACHE_SIZE", "2048"))
+QUERY_CACHE_TTL = float(os.environ.get("QUERY_CACHE_TTL", "86400"))
+ANSWER_CACHE = os.environ.get("ANSWER_CACHE", "0") == "1"
+ANSWER_CACHE_SIZE = int(os.environ.get("ANSWER_CACHE_SIZE", "1024"))
+ANSWER_CACHE_TTL = float(os.environ.get("ANSWER_CACHE_TTL", "3600"))
+# Cosine similarity a new query needs to a cached one to reuse its answer
+ANSWER_CACHE_THRESHOLD = float(os.environ.get("ANSWER_CACHE_THRESHOLD", "0.95"))
+
+_SPACE = re.compile(r"\s+")
+_EDGE_PUNCTUATION = " ?!.,;:"
+
+def normalize_query(query):
+    """Case, inner whitespace and trailing punctuation do not change what is asked."""
+    return _SPACE.sub(" ", query.lower()).strip(_EDGE_PUNCTUATION)
+
+def _stats(counters, entries):
+    lookups = counters["hits"] + counters["misses"]
+    return {**counters, "hit_rate": counters["hits"] / lookups if lookups else 0.0, "entries": entries}
+
+class QueryCache:
+    """LRU of normalised query -> (embedding, retrieved documents).
+
+    All entries belong to one vector store. A lookup with a different store (a
+    reloaded index) empties the cache, so documents of the old index are never
+    served; the store is only weakly referenced, so the cache does not keep a
+    replaced index in memory either.
+    """
+
+    def __init__(self, max_entries=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL):
+        self.max_entries = max(0, int(max_entries))
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._store = None
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def _current(self, store):
+        """True if the entries belong to `store`; call with _lock held."""
+        return self._store is not None and self._store() is store
+
+    def get(self, query, store):
+        key = normalize_query(query)
+        with self._lock:
+            if not self._current(store):
+                if self._entries:
+                    self._entries.clear()
+                    self.counters["invalidations"] += 1
+                self._store = weakref.ref(store)
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[2] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.counters["hits"] += 1
+            return entry[0], list(entry[1])
+
+    def put(self, query, store, embedding, documents):
+        if not self.max_entries:
+            return
+        key = normalize_query(query)
+        with self._lock:
+            if self._store is None:
+                self._store = weakref.ref(store)
+            elif not self._current(store):
+                # Retrieved from an index that was replaced while the request ran
+                return
+            self._entries[key] = (embedding, list(documents), time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.counters["evictions"] += 1
+
+    def stats(self):
+        with self._lock:
+            return _stats(self.counters, len(self._entries))
+
+class SemanticAnswerCache:
+    """Answers keyed by query embedding, matched by cosine similarity.
+
+    Answers are kept per `kind` (the endpoint's prompt), since the same question
+    gets a different answer from /legal-query and /legal-advice. Lookups compare
+    the query against every live entry with one matrix product, which at a few
+    thousand entries costs far less than a single LLM call.
+    """
+
+    def __init__(self, max_entries=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL, threshold=ANSWER_CACHE_THRESHOLD):
+        self.max_entries = max(0, int(max_entries))
+        self.ttl = ttl
+        self.threshold = threshold
+        # key -> (kind, unit embedding, answer, created)
+        self._entries = OrderedDict()
+        self._next_key = 0
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+    @staticmethod
+    def _unit(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, kind, embedding):
+        """Returns (answer, similarity) of the closest cached query above the threshold, else None."""
+        query = self._unit(embedding)
+        with self._lock:
+            self._expire()
+            keys = [key for key, entry in self._entries.items() if entry[0] == kind]
+            if keys:
+                similarities = np.stack([self._entries[key][1] for key in keys]) @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    self._entries.move_to_end(keys[best])
+                    self.counters["hits"] += 1
+                    return self._entries[keys[best]][2], float(similarities[best])
+            self.counters["misses"] += 1
+            return None
+
+    def put(self, kind, embedding, answer):
+        if not self.max_entries or not answer:
+            return
+        with self._lock:
+            self._entries[self._next_key] = (kind, self._unit(embedding), answer, time.monotonic())
+            self._next_key += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.counters["evictions"] += 1
+
+    def _expire(self):
+        now = time.monotonic()
+        # Entries are in least-recently-used order, not creation order, so check them all
+        expired = [key for key, entry in self._entries.items() if now - entry[3] > self.ttl]
+        for key in expired:
+            del self._entries[key]
+        self.counters["expired"] += len(expired)
+
+    def stats(self):
+        with self._lock:
+            return {**_stats(self.counters, len(self._entries)), "threshold": self.threshold}
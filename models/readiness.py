@@ -0,0 +1,121 @@
+import os
+import threading
+import time
+
+from flask import jsonify, request
+
+# Load heavy state on a background thread so the port binds right away; 0 loads it at import
+BACKGROUND_LOAD = os.environ.get("BACKGROUND_LOAD", "1") == "1"
+# Requests that arrive while the service is loading wait this long, then get a 503
+READY_WAIT_SECONDS = float(os.environ.get("READY_WAIT_SECONDS", "30"))
+# Dummy passes run before the service reports ready
+WARMUP_ITERATIONS = int(os.environ.get("WARMUP_ITERATIONS", "3"))
+
+# Endpoints answered while the service is still loading
+_ALWAYS_SERVED = {"healthz", "readyz", "static", "handle_options"}
+
+_imported_at = time.time()
+
+def process_start_time():
+    """Wall-clock time this process was started (Linux), else when this module was imported."""
+    try:
+        with open("/proc/self/stat", "r") as f:
+            # Fields after the parenthesised command name; starttime is the 22nd field overall
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime", "r") as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - (uptime - start_ticks / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError):
+        return _imported_at
+
+class ServiceLoader:
+    """Loads a service's model or index, then warms it up, off the request path.
+
+    `load` and `warmup` are plain callables; the service keeps whatever they
+    build in its own globals. The state goes loading -> warming -> ready, or to
+    failed with the error kept for /readyz. Cold-start timings are printed once
+    the service is ready.
+    """
+
+    def __init__(self, name, load, warmup=None):
+        self.name = name
+        self.load = load
+        self.warmup = warmup
+        self.state = "pending"
+        self.error = None
+        self.timings = {}
+        self._ready = threading.Event()
+        self._done = threading.Event()
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def start(self, background=BACKGROUND_LOAD):
+        if background:
+            threading.Thread(target=self._run, name=f"{self.name}-loader", daemon=True).start()
+        else:
+            self._run()
+        return self
+
+    def wait(self, timeout=None):
+        """Blocks until loading finished; returns True if the service is ready."""
+        self._done.wait(timeout)
+        return self.ready
+
+    def status(self):
+        return {"service": self.name, "state": self.state, "error": self.error, "cold_start": self.timings}
+
+    def _run(self):
+        process_start = process_start_time()
+        self.timings["before_load_seconds"] = round(time.time() - process_start, 3)
+        try:
+            self.state = "loading"
+            start = time.perf_counter()
+            self.load()
+            self.timings["load_seconds"] = round(time.perf_counter() - start, 3)
+
+            if self.warmup is not None:
+                self.state = "warming"
+                start = time.perf_counter()
+                self.warmup()
+                self.timings["warmup_seconds"] = round(time.perf_counter() - start, 3)
+        except Exception as e:
+            self.state = "failed"
+            self.error = f"{type(e).__name__}: {e}"
+            print(f"[{self.name}] failed to load: {self.error}", flush=True)
+            raise
+        else:
+            self.timings["cold_start_seconds"] = round(time.time() - process_start, 3)
+            self.state = "ready"
+            self._ready.set()
+        finally:
+            # Only once the outcome is recorded, so a waiter never sees "done" but not ready
+            self._done.set()
+
+        print(f"[{self.name}] ready: cold start {self.timings['cold_start_seconds']:.2f}s "
+              f"(before load {self.timings['before_load_seconds']:.2f}s, load {self.timings['load_seconds']:.2f}s, "
+              f"warmup {self.timings.get('warmup_seconds', 0.0):.2f}s)", flush=True)
+
+def install_health_routes(app, loader, wait_seconds=READY_WAIT_SECONDS):
+    """Adds /healthz (process is up) and /readyz (model loaded and warm), and holds
+    other requests until the loader is ready, answering 503 if it takes too long."""
+
+    @app.route("/healthz", methods=["GET"])
+    def healthz():
+        return jsonify({"status": "ok", "state": loader.state})
+
+    @app.route("/readyz", methods=["GET"])
+    def readyz():
+        return jsonify(loader.status()), 200 if loader.ready else 503
+
+    @app.before_request
+    def wait_until_ready():
+        if request.endpoint is None or request.endpoint in _ALWAYS_SERVED or request.method == "OPTIONS":
+            return None
+        if loader.wait(wait_seconds):
+            return None
+        response = jsonify({"error": f"{loader.name} is not ready yet", **loader.status()})
+        response.status_code = 503
+        response.headers["Retry-After"] = "5"
+        return response
@@ -0,0 +1,163 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+# Entries kept in the in-memory LRU tier
+RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", "512"))
+# Directory of the optional on-disk tier; unset disables it
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR")
+RESULT_CACHE_DISK_MB = int(os.environ.get("RESULT_CACHE_DISK_MB", "64"))
+
+# Request options that change the prediction, and therefore the cache key. batch_size counts
+# because early exit is only checked between batches; segments turn early exit off
+_KEY_OPTIONS = ("sampling", "stride", "num_samples", "early_exit", "margin", "min_frames", "batch_size", "segments")
+
+def model_version(model_path):
+    """Identifies a model file by its contents (MODEL_VERSION overrides)."""
+    if os.environ.get("MODEL_VERSION"):
+        return os.environ["MODEL_VERSION"]
+    digest = hashlib.sha256()
+    with open(model_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+class ResultCache:
+    """Two-tier cache of /predict results keyed by upload content.
+
+    Keys combine the SHA-256 of the uploaded bytes with the model and
+    preprocessing versions and the options that influence the vote, so a
+    re-uploaded clip is answered without decoding it again. The memory tier is
+    an LRU of `max_entries`; the optional disk tier stores one JSON file per key
+    and evicts least recently used files once it grows past `max_disk_bytes`.
+    """
+
+    def __init__(self, max_entries=RESULT_CACHE_SIZE, directory=RESULT_CACHE_DIR,
+                 max_disk_bytes=RESULT_CACHE_DISK_MB * 1024 * 1024):
+        self.max_entries = max(0, int(max_entries))
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_bytes = 0
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "disk_evictions": 0}
+
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            self._disk_bytes = sum(size for _, size, _ in self._disk_files())
+
+    @staticmethod
+    def key(content_digest, model_version, preprocess_version, options):
+        relevant = {name: options[name] for name in _KEY_OPTIONS if options.get(name) is not None}
+        material = json.dumps([content_digest, model_version, preprocess_version, relevant], sort_keys=True)
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return dict(self._entries[key])
+
+        result = self._read_disk(key)
+        with self._lock:
+            if result is None:
+                self.counters["misses"] += 1
+                return None
+            self.counters["disk_hits"] += 1
+            self._remember(key, result)
+        return dict(result)
+
+    def put(self, key, result):
+        with self._lock:
+            self.counters["stores"] += 1
+            self._remember(key, result)
+        self._write_disk(key, result)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.counters["memory_hits"] + self.counters["disk_hits"] + self.counters["misses"]
+            hits = lookups - self.counters["misses"]
+            return {
+                **self.counters,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._entries),
+                "disk_enabled": bool(self.directory),
+                "disk_bytes": self._disk_bytes,
+            }
+
+    def _remember(self, key, result):
+        if not self.max_entries:
+            return
+        self._entries[key] = dict(result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _disk_files(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            entries.append((name, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _read_disk(self, key):
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                result = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        # Touch the file so eviction sees it as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            # Evicted or pruned since the read; the result is still good
+            pass
+        return result
+
+    def _write_disk(self, key, result):
+        if not self.directory:
+            return
+        data = json.dumps(result).encode("utf-8")
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        try:
+            previous = os.path.getsize(path)
+        except FileNotFoundError:
+            previous = 0
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._disk_bytes += len(data) - previous
+            if self._disk_bytes > self.max_disk_bytes:
+                self._evict_disk()
+
+    def _evict_disk(self):
+        # Oldest mtime first; reads refresh mtime, so this is LRU
+        files = sorted(self._disk_files(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in files)
+        for name, size, _ in files:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            total -= size
+            self.counters["disk_evictions"] += 1
+        self._disk_bytes = total
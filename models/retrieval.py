@@ -0,0 +1,57 @@
+import numpy as np
+
+from metrics import timed
+
+# Documents returned per query, the same as vector_store.as_retriever()'s default
+TOP_K = 4
+
+def retrieve_documents(vector_store, query, k=TOP_K):
+    """Returns the `k` documents closest to `query`.
+
+    Same result as `vector_store.as_retriever().invoke(query)`, but the query
+    embedding and the index search are timed as separate stages.
+    """
+    return [doc for doc, _ in retrieve_with_scores(vector_store, query, k)]
+
+def search_vectors(vector_store, vectors, k=TOP_K):
+    """Searches the FAISS index for many query vectors in one call.
+
+    Returns one list of (document, distance) pairs per vector, in the order
+    langchain's similarity_search_by_vector would return them.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if getattr(vector_store, "_normalize_L2", False):
+        import faiss
+        faiss.normalize_L2(vectors)
+
+    distances, ids = vector_store.index.search(vectors, k)
+    # -1 marks a missing hit (fewer than k vectors in the index)
+    positions = {int(i) for i in ids.ravel() if i != -1}
+    if hasattr(vector_store.docstore, "fetch"):
+        # docstore.SqliteDocstore reads every hit in one statement
+        docs = vector_store.docstore.fetch(positions)
+    else:
+        docs = {i: vector_store.docstore.search(vector_store.index_to_docstore_id[i]) for i in positions}
+
+    return [
+        [(docs[int(i)], float(distance)) for distance, i in zip(row_distances, row_ids) if i != -1]
+        for row_distances, row_ids in zip(distances, ids)
+    ]
+
+def retrieve_with_scores(vector_store, query, k=TOP_K):
+    """Returns the `k` (document, distance) pairs closest to `query`."""
+    with timed("embedding"):
+        embedding = vector_store.embeddings.embed_query(query)
+    with timed("retrieval"):
+        return search_vectors(vector_store, [embedding], k)[0]
+
+def retrieve_with_scores_batch(vector_store, queries, k=TOP_K):
+    """retrieve_with_scores for many queries: one batched encoder call, one index search."""
+    with timed("embedding"):
+        embeddings = vector_store.embeddings.embed_documents(list(queries))
+    with timed("retrieval"):
+        return search_vectors(vector_store, embeddings, k)
+
+def retrieve_documents_batch(vector_store, queries, k=TOP_K):
+    """retrieve_documents for many queries."""
+    return [[doc for doc, _ in hits] for hits in retrieve_with_scores_batch(vector_store, queries, k)]
@@ -0,0 +1,152 @@
+"""Offline stand-ins for the Mistral API, for load tests and local runs.
+
+Set LLM_STUB=1 and the services build StubMistral instead of mistralai.Mistral.
+It answers `client.chat.complete(model=..., messages=...)` with the same
+response shape after STUB_LLM_DELAY_MS, and never touches the network.
+
+For clients that talk HTTP, such as legal_chat_async.py, run the stub as a server:
+
+    python stub_llm.py --port 8001 --token-delay-ms 20 --tokens 200
+    MISTRAL_SERVER_URL=http://127.0.0.1:8001 python legal_chat_async.py
+
+It serves POST /v1/chat/completions like the Mistral API, streaming one word per
+`--token-delay-ms` as server-sent events when asked to stream, and counts
+finished and abandoned streams at GET /stats.
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import time
+import uuid
+from types import SimpleNamespace
+
+LLM_STUB = os.environ.get("LLM_STUB", "0") == "1"
+STUB_LLM_DELAY_MS = float(os.environ.get("STUB_LLM_DELAY_MS", "200"))
+# Words per streamed answer from the stub server, and the delay before each one
+STUB_LLM_TOKENS = int(os.environ.get("STUB_LLM_TOKENS", "200"))
+STUB_LLM_TOKEN_DELAY_MS = float(os.environ.get("STUB_LLM_TOKEN_DELAY_MS", "20"))
+
+# Words that push the stub's emergency level up, so its answers are not pure noise
+_URGENT = re.compile(r"murder|terror|kidnap|assault|explosion|arson|rape|shoot|violent", re.IGNORECASE)
+
+def stub_reply(messages):
+    """Deterministic reply for a chat: an emergency level for FIR prompts, else canned text."""
+    prompt = messages[-1]["content"] if messages else ""
+    if "Emergency level:" in prompt:
+        # Judge the report itself, not the retrieved context in front of it
+        report = prompt.rsplit("Subject:", 1)[-1]
+        seed = int(hashlib.sha256(report.encode("utf-8")).hexdigest(), 16)
+        level = 4 + seed % 2 if _URGENT.search(report) else 1 + seed % 3
+        return str(level)
+    question = prompt.rsplit("Question:", 1)[-1].strip()
+    return f"This is a stub answer about: {question[:200]}"
+
+def stub_tokens(messages, tokens=STUB_LLM_TOKENS):
+    """stub_reply() padded with filler to `tokens` words, split into streamable pieces."""
+    words = stub_reply(messages).split()
+    filler = "The stub keeps talking so that streams last long enough to measure."
+    while len(words) < tokens:
+        words.extend(filler.split())
+    return [word + " " for word in words[:max(tokens, 1)]]
+
+def _response(content):
+    message = SimpleNamespace(role="assistant", content=content)
+    return SimpleNamespace(choices=[SimpleNamespace(index=0, message=message, finish_reason="stop")])
+
+class _StubChat:
+    def __init__(self, delay_ms):
+        self.delay_ms = delay_ms
+
+    def complete(self, model=None, messages=None, **kwargs):
+        time.sleep(self.delay_ms / 1000.0)
+        return _response(stub_reply(messages or []))
+
+class StubMistral:
+    """Mimics `mistralai.Mistral` closely enough for `client.chat.complete`."""
+
+    def __init__(self, api_key=None, delay_ms=STUB_LLM_DELAY_MS):
+        self.chat = _StubChat(delay_ms)
+
+def _completion(model, content, completion_tokens):
+    return {
+        "id": uuid.uuid4().hex,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "usage": {"prompt_tokens": 0, "completion_tokens": completion_tokens, "total_tokens": completion_tokens},
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+    }
+
+def _chunk(completion_id, model, content, finish_reason=None):
+    delta = {"role": "assistant", "content": content}
+    return {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+def create_stub_server(tokens=STUB_LLM_TOKENS, token_delay_ms=STUB_LLM_TOKEN_DELAY_MS):
+    """ASGI app answering the Mistral chat API with stub_tokens(), one per `token_delay_ms`."""
+    import asyncio
+    from starlette.applications import Starlette
+    from starlette.responses import JSONResponse, StreamingResponse
+    from starlette.routing import Route
+
+    delay = token_delay_ms / 1000.0
+    stats = {"requests": 0, "active": 0, "completed": 0, "cancelled": 0, "tokens_sent": 0}
+
+    async def stream(pieces, model):
+        completion_id = uuid.uuid4().hex
+        stats["active"] += 1
+        try:
+            for piece in pieces:
+                await asyncio.sleep(delay)
+                yield f"data: {json.dumps(_chunk(completion_id, model, piece))}\n\n"
+                stats["tokens_sent"] += 1
+            yield f"data: {json.dumps(_chunk(completion_id, model, '', 'stop'))}\n\n"
+            yield "data: [DONE]\n\n"
+            stats["completed"] += 1
+        except BaseException:
+            # The client hung up mid-answer; a real LLM would stop generating here
+            stats["cancelled"] += 1
+            raise
+        finally:
+            stats["active"] -= 1
+
+    async def chat_completions(request):
+        body = await request.json()
+        stats["requests"] += 1
+        model = body.get("model", "stub")
+        pieces = stub_tokens(body.get("messages") or [], tokens)
+        if body.get("stream"):
+            return StreamingResponse(stream(pieces, model), media_type="text/event-stream")
+        await asyncio.sleep(delay * len(pieces))
+        return JSONResponse(_completion(model, "".join(pieces).strip(), len(pieces)))
+
+    async def stub_stats(request):
+        return JSONResponse(stats)
+
+    return Starlette(routes=[
+        Route("/v1/chat/completions", chat_completions, methods=["POST"]),
+        Route("/stats", stub_stats, methods=["GET"]),
+    ])
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a stub of the Mistral chat API that streams tokens")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--tokens", type=int, default=STUB_LLM_TOKENS, help="words per answer")
+    parser.add_argument("--token-delay-ms", type=float, default=STUB_LLM_TOKEN_DELAY_MS)
+    args = parser.parse_args()
+
+    import uvicorn
+
+    uvicorn.run(create_stub_server(args.tokens, args.token_delay_ms), host=args.host, port=args.port,
+                log_level="warning", backlog=4096)
+
+if __name__ == "__main__":
+    main()
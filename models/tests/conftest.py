@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The services import their sibling modules by name, as when run from models/
+MODELS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, MODELS_DIR)
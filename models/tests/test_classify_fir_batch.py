@@ -0,0 +1,142 @@
+"""/classify-fir/batch against a tiny in-memory FAISS store and the stub LLM (LLM_STUB=1)."""
+import os
+import threading
+import time
+
+import pytest
+
+os.environ["LLM_STUB"] = "1"
+os.environ.setdefault("STUB_LLM_DELAY_MS", "20")
+
+ec = pytest.importorskip("emergency_classify", exc_type=ImportError)
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from retrieval import retrieve_with_scores, retrieve_with_scores_batch
+from stub_llm import StubMistral
+
+# Unlabelled past FIRs, so the kNN fast path never answers and every valid item reaches the LLM
+PAST_FIRS = [
+    "Bicycle stolen from outside the market",
+    "Neighbours quarrel over a parking space",
+    "Armed robbery at a jewellery shop",
+    "Shots fired near the railway station",
+    "Phone snatched on a crowded bus",
+    "House broken into while the family was away",
+    "Fraudulent bank transfer after a phishing call",
+    "Car set on fire in a residential street",
+]
+
+@pytest.fixture(scope="module")
+def store():
+    return FAISS.from_texts(PAST_FIRS, DeterministicFakeEmbedding(size=32))
+
+@pytest.fixture()
+def client(store, monkeypatch):
+    # Let the import-time loader finish before swapping in the test store, so it cannot overwrite it
+    ec.loader.wait()
+    if not ec.loader.ready:
+        # No embedding model here: mark the service ready with the test store instead
+        monkeypatch.setattr(ec.loader, "load", lambda: None)
+        monkeypatch.setattr(ec.loader, "warmup", None)
+        ec.loader.start(background=False)
+    monkeypatch.setattr(ec, "vector_store", store)
+    return ec.app.test_client()
+
+def _item(i):
+    return {"id": f"fir-{i}", "subject": f"Report {i}", "description": f"Something happened at place {i}"}
+
+class CountingStub(StubMistral):
+    """StubMistral that records the most calls it had in flight at once."""
+
+    def __init__(self, delay_ms):
+        super().__init__(delay_ms=delay_ms)
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.calls = 0
+        self._lock = threading.Lock()
+        complete = self.chat.complete
+
+        def counted(*args, **kwargs):
+            with self._lock:
+                self.calls += 1
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            try:
+                return complete(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.in_flight -= 1
+
+        self.chat.complete = counted
+
+def test_uses_the_stub_llm():
+    assert isinstance(ec.client, StubMistral)
+
+def test_bad_items_get_their_own_errors(client):
+    items = [_item(0), {"id": "no-description", "subject": "Theft"}, "not an object", {"description": "x"}, _item(4)]
+    response = client.post("/classify-fir/batch", json={"items": items})
+
+    assert response.status_code == 200
+    body = response.get_json()
+    results = body["results"]
+    assert [result["index"] for result in results] == list(range(len(items)))
+    assert (body["succeeded"], body["failed"]) == (2, 3)
+    for position in (1, 2, 3):
+        assert "required" in results[position]["error"]
+        assert "emergency_level" not in results[position]
+    assert results[1]["id"] == "no-description"
+    for position in (0, 4):
+        assert results[position]["id"] == f"fir-{position}"
+        assert results[position]["path"] == "llm"
+        assert results[position]["emergency_level"] in {"1", "2", "3", "4", "5"}
+
+def test_llm_failure_is_reported_per_item(client, monkeypatch):
+    def flaky(subject, description, context):
+        if subject == "Report 1":
+            raise RuntimeError("upstream timeout")
+        return "2"
+
+    monkeypatch.setattr(ec, "classify_emergency", flaky)
+    body = client.post("/classify-fir/batch", json={"items": [_item(i) for i in range(3)]}).get_json()
+
+    assert (body["succeeded"], body["failed"]) == (2, 1)
+    assert body["results"][1]["error"] == "LLM call failed: upstream timeout"
+    assert body["results"][2]["emergency_level"] == "2"
+
+@pytest.mark.parametrize("payload", [{}, {"items": []}, {"items": "not a list"}])
+def test_rejects_a_missing_item_list(client, payload):
+    assert client.post("/classify-fir/batch", json=payload).status_code == 400
+
+def test_too_many_items_is_413(client, monkeypatch):
+    monkeypatch.setattr(ec, "MAX_BATCH_ITEMS", 3)
+
+    assert client.post("/classify-fir/batch", json={"items": [_item(i) for i in range(3)]}).status_code == 200
+    response = client.post("/classify-fir/batch", json={"items": [_item(i) for i in range(4)]})
+    assert response.status_code == 413
+    assert "3" in response.get_json()["error"]
+
+def test_llm_calls_in_flight_are_bounded(client, monkeypatch):
+    stub = CountingStub(delay_ms=50)
+    monkeypatch.setattr(ec, "client", stub)
+    monkeypatch.setattr(ec, "LLM_CONCURRENCY", 3)
+
+    start = time.perf_counter()
+    body = client.post("/classify-fir/batch", json={"items": [_item(i) for i in range(12)]}).get_json()
+    elapsed = time.perf_counter() - start
+
+    assert body["succeeded"] == 12
+    assert stub.calls == 12
+    assert stub.max_in_flight == 3
+    # 12 calls of 50 ms, 3 at a time: about 4 rounds rather than 12
+    assert elapsed < 12 * 0.05
+
+def test_batch_retrieval_matches_single_queries(store):
+    queries = ["Motorbike stolen near the market", "Gunfire at the station", "Online banking scam", "Fire"]
+    batch = retrieve_with_scores_batch(store, queries, 4)
+
+    assert len(batch) == len(queries)
+    for query, hits in zip(queries, batch):
+        single = retrieve_with_scores(store, query, 4)
+        assert [doc.page_content for doc, _ in hits] == [doc.page_content for doc, _ in single]
+        assert [distance for _, distance in hits] == pytest.approx([distance for _, distance in single], rel=1e-5)
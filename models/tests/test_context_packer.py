@@ -0,0 +1,30 @@
+"""pack_context()'s budget and its savings report."""
+from langchain_core.documents import Document
+
+from context_packer import CONTEXT_CANDIDATES, estimate_tokens, pack_context
+from retrieval import TOP_K
+
+def _chunks(n, size):
+    return [Document(page_content=f"chunk {i} " + "x" * size, metadata={"fir_id": f"fir-{i}", "chunk": 0})
+            for i in range(n)]
+
+def test_candidates_default_to_the_old_top_k():
+    assert CONTEXT_CANDIDATES == TOP_K
+
+def test_savings_are_measured_against_the_top_k_join():
+    documents = _chunks(TOP_K * 2, 400)
+    _, report = pack_context(documents, budget=10_000)
+
+    baseline = "\n\n".join(doc.page_content for doc in documents[:TOP_K])
+    assert report["tokens_unpacked"] == estimate_tokens(baseline)
+    # Packing more candidates than the baseline sent is not a saving
+    assert report["tokens"] > report["tokens_unpacked"] and report["tokens_saved"] == 0
+
+def test_budget_drops_the_lowest_ranked_passages():
+    documents = _chunks(TOP_K, 500)
+    context, report = pack_context(documents, budget=300)
+
+    assert report["tokens"] <= 300
+    assert (report["passages"], report["dropped"]) == (2, TOP_K - 2)
+    assert context.startswith("chunk 0 ")
+    assert report["tokens_saved"] == report["tokens_unpacked"] - report["tokens"]
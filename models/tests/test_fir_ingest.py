@@ -0,0 +1,40 @@
+"""fir_ingest.ingest() against flat and HNSW FIR indexes."""
+import pytest
+
+pytest.importorskip("faiss")
+pytest.importorskip("langchain.text_splitter", exc_type=ImportError)
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from ann_index import convert
+from fir_ingest import ingest
+
+EMBEDDINGS = DeterministicFakeEmbedding(size=16)
+
+FIRS = [
+    {"_id": f"fir-{i}", "subject": f"Incident {i}", "description": f"Complaint number {i} at the market",
+     "emergency_class": "theft"}
+    for i in range(6)
+]
+
+def _subjects(vector_store):
+    return sorted(doc.page_content.splitlines()[0] for doc in vector_store.docstore._dict.values())
+
+@pytest.mark.parametrize("kind", ["flat", "hnsw"])
+def test_updates_and_deletes(kind):
+    vector_store, report = ingest(None, FIRS, EMBEDDINGS)
+    assert report["added"] == 6
+    if kind != "flat":
+        convert(vector_store, kind, hnsw_m=8)
+
+    edited = dict(FIRS[0], subject="Incident 0 (amended)")
+    vector_store, report = ingest(vector_store, [edited], EMBEDDINGS, deletes=["fir-1"])
+
+    assert (report["updated"], report["deleted"]) == (1, 1)
+    assert hasattr(vector_store.index, "hnsw") == (kind == "hnsw")
+    if kind == "hnsw":
+        assert vector_store.index.hnsw.nb_neighbors(1) == 8
+    assert vector_store.index.ntotal == len(vector_store.index_to_docstore_id) == 5
+    assert _subjects(vector_store) == ["Subject: Incident 0 (amended)"] + [f"Subject: Incident {i}" for i in range(2, 6)]
+    # Positions still line up with the docstore
+    hits = vector_store.similarity_search("Subject: Incident 3\nDescription: Complaint number 3 at the market", k=1)
+    assert hits[0].metadata["fir_id"] == "fir-3"
@@ -0,0 +1,96 @@
+"""save_atomic() versions next to an index built in place, and readers following them."""
+import os
+import threading
+
+import pytest
+
+pytest.importorskip("faiss")
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from ann_index import open_vector_store
+from docstore import save_store
+from index_store import current_link, index_exists, index_version, resolve_index, save_atomic
+from retrieval import retrieve_documents
+
+EMBEDDINGS = DeterministicFakeEmbedding(size=16)
+
+def _store(texts):
+    return FAISS.from_texts(texts, EMBEDDINGS)
+
+def _texts(path):
+    store = open_vector_store(path, EMBEDDINGS, mmap=False)
+    return sorted(doc.page_content for doc in store.docstore.fetch(range(store.index.ntotal)).values())
+
+@pytest.fixture()
+def legacy(tmp_path):
+    # An index written straight into its path, like the faiss_fir_db in the repository
+    path = str(tmp_path / "faiss_db")
+    save_store(_store(["old a", "old b"]), path)
+    return path
+
+def test_legacy_index_is_served_until_the_first_save(legacy):
+    assert resolve_index(legacy) == os.path.realpath(legacy)
+    assert index_exists(legacy)
+    assert _texts(legacy) == ["old a", "old b"]
+
+def test_save_leaves_the_legacy_directory_in_place(legacy):
+    files = sorted(os.listdir(legacy))
+    before = index_version(legacy)
+
+    version = save_atomic(_store(["new a", "new b", "new c"]), legacy)
+
+    assert os.path.isdir(legacy) and not os.path.islink(legacy)
+    assert sorted(os.listdir(legacy)) == files
+    assert os.path.islink(current_link(legacy))
+    assert resolve_index(legacy) == os.path.realpath(version)
+    assert index_version(legacy) != before
+    assert _texts(legacy) == ["new a", "new b", "new c"]
+
+def test_old_versions_are_pruned_but_never_the_legacy_index(legacy):
+    versions = [save_atomic(_store([f"v{i}"]), legacy, keep=2) for i in range(4)]
+
+    assert not os.path.exists(versions[0]) and not os.path.exists(versions[1])
+    assert os.path.isdir(versions[2]) and os.path.isdir(versions[3])
+    assert index_exists(legacy) and _texts(legacy) == ["v3"]
+    assert os.path.exists(os.path.join(legacy, "index.faiss"))
+
+def test_a_fresh_path_gets_only_versions(tmp_path):
+    path = str(tmp_path / "faiss_db")
+    assert not index_exists(path) and index_version(path) is None
+
+    save_atomic(_store(["first"]), path)
+
+    assert not os.path.exists(path)
+    assert index_exists(path) and _texts(path) == ["first"]
+
+def test_save_keeps_the_version_it_replaced(legacy):
+    first = save_atomic(_store(["first"]), legacy, keep=1)
+    second = save_atomic(_store(["second"]), legacy, keep=1)
+
+    # Services may still serve `first` until they reload
+    assert os.path.isdir(first) and os.path.isdir(second)
+    save_atomic(_store(["third"]), legacy, keep=1)
+    assert not os.path.exists(first) and os.path.isdir(second)
+
+def test_loaded_store_survives_its_version_being_pruned(legacy):
+    save_atomic(_store(["served a", "served b"]), legacy, keep=1)
+    store = open_vector_store(legacy, EMBEDDINGS, mmap=True)
+    served = resolve_index(legacy)
+    for i in range(3):
+        save_atomic(_store([f"newer {i}"]), legacy, keep=1)
+    assert not os.path.exists(served)
+
+    # Concurrent request threads share the connections opened at load time
+    results, start = [], threading.Barrier(16)
+
+    def query():
+        start.wait()
+        results.append(sorted(doc.page_content for doc in retrieve_documents(store, "served a", 2)))
+
+    threads = [threading.Thread(target=query) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [["served a", "served b"]] * 16
@@ -0,0 +1,50 @@
+"""InferenceScheduler keeps every forward pass within max_batch_size."""
+import threading
+
+import torch
+
+from inference_scheduler import InferenceScheduler
+
+class RecordingModel(torch.nn.Module):
+    """Sums each frame, so outputs can be matched to inputs, and records the batch sizes it ran."""
+
+    def __init__(self):
+        super().__init__()
+        self.sizes = []
+
+    def forward(self, batch):
+        self.sizes.append(len(batch))
+        return batch.flatten(1).sum(dim=1, keepdim=True)
+
+def _frames(count, offset=0):
+    return (torch.arange(count, dtype=torch.float32) + offset).view(count, 1, 1, 1)
+
+def test_oversized_batch_is_split():
+    model = RecordingModel()
+    scheduler = InferenceScheduler(model, torch.device("cpu"), max_batch_size=16, max_wait_ms=0).start()
+
+    output = scheduler(_frames(50))
+
+    assert torch.equal(output, _frames(50).view(50, 1))
+    assert max(model.sizes) <= 16
+    assert sum(model.sizes) == 50
+    assert scheduler.stats()["max_batch_size_seen"] <= 16
+
+def test_concurrent_callers_get_their_own_outputs():
+    model = RecordingModel()
+    scheduler = InferenceScheduler(model, torch.device("cpu"), max_batch_size=16, max_wait_ms=5).start()
+    results = {}
+
+    def call(i):
+        results[i] = scheduler(_frames(5 + 7 * i, offset=1000 * i))
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for i, output in results.items():
+        assert torch.equal(output, _frames(5 + 7 * i, offset=1000 * i).view(-1, 1))
+    assert max(model.sizes) <= 16
+    assert scheduler.stats()["pending_frames"] == 0
@@ -0,0 +1,254 @@
+"""legal_chat_async's chat endpoints against stub_llm's server, both driven in-process over ASGI."""
+import asyncio
+import time
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+lca = pytest.importorskip("legal_chat_async", exc_type=ImportError)
+import legal_chat
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from stub_llm import create_stub_server
+
+TOKENS = 30
+TOKEN_DELAY_MS = 20
+
+LEGAL_TEXTS = [
+    "Bail may be granted for bailable offences as a matter of right",
+    "Anticipatory bail protects against arrest for a non-bailable offence",
+    "A first information report is recorded under section 154",
+    "Cheque dishonour is an offence under section 138",
+]
+
+class StreamingASGITransport(httpx.AsyncBaseTransport):
+    """httpx.ASGITransport, except that the body streams and closing the response disconnects.
+
+    httpx.ASGITransport collects the whole body before it returns the response
+    and only reports http.disconnect once the app has finished, so it can show
+    neither token-by-token streaming nor a client that leaves halfway. Here the
+    response is returned as soon as the app starts it, its chunks arrive as the
+    app sends them, and closing it (or cancelling the request) makes the app's
+    receive() return http.disconnect, as a server does when the socket closes.
+    `statuses` keeps every status code the app sent.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.statuses = []
+
+    async def handle_async_request(self, request):
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": request.method,
+            "headers": [(key.lower(), value) for key, value in request.headers.raw],
+            "scheme": request.url.scheme,
+            "path": request.url.path,
+            "raw_path": request.url.raw_path.split(b"?")[0],
+            "query_string": request.url.query,
+            "server": (request.url.host, request.url.port),
+            "client": ("127.0.0.1", 123),
+            "root_path": "",
+        }
+        body = b"".join([chunk async for chunk in request.stream])
+        chunks = asyncio.Queue()
+        started = asyncio.get_running_loop().create_future()
+        disconnected = asyncio.Event()
+        body_sent = False
+
+        async def receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                self.statuses.append(message["status"])
+                started.set_result(message)
+            elif message["type"] == "http.response.body":
+                chunks.put_nowait(message.get("body", b""))
+
+        async def run():
+            try:
+                await self.app(scope, receive, send)
+            except Exception as e:
+                if not started.done():
+                    started.set_exception(e)
+            finally:
+                chunks.put_nowait(None)
+
+        task = asyncio.create_task(run())
+        try:
+            message = await started
+        except asyncio.CancelledError:
+            # The client gave up before the response started
+            await _disconnect(disconnected, task)
+            raise
+        return httpx.Response(message["status"], headers=message.get("headers", []),
+                              stream=_ResponseStream(chunks, disconnected, task))
+
+async def _disconnect(disconnected, task, grace=2.0):
+    disconnected.set()
+    try:
+        await asyncio.wait_for(asyncio.shield(task), grace)
+    except asyncio.TimeoutError:
+        task.cancel()
+
+class _ResponseStream(httpx.AsyncByteStream):
+    def __init__(self, chunks, disconnected, task):
+        self.chunks = chunks
+        self.disconnected = disconnected
+        self.task = task
+
+    async def __aiter__(self):
+        while (chunk := await self.chunks.get()) is not None:
+            if chunk:
+                yield chunk
+
+    async def aclose(self):
+        await _disconnect(self.disconnected, self.task)
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+@pytest.fixture(scope="module")
+def store():
+    return FAISS.from_texts(LEGAL_TEXTS, DeterministicFakeEmbedding(size=32))
+
+@pytest.fixture
+def stub():
+    return create_stub_server(tokens=TOKENS, token_delay_ms=TOKEN_DELAY_MS)
+
+@pytest.fixture
+def service(store, monkeypatch):
+    # Let the import-time loader finish before swapping in the test store, so it cannot overwrite it
+    legal_chat.loader.wait()
+    if not legal_chat.loader.ready:
+        # No embedding model here: mark the service ready with the test store instead
+        monkeypatch.setattr(legal_chat.loader, "load", lambda: None)
+        monkeypatch.setattr(legal_chat.loader, "warmup", None)
+        legal_chat.loader.start(background=False)
+    monkeypatch.setattr(legal_chat, "vector_store", store)
+    monkeypatch.setattr(legal_chat, "answer_cache", None)
+    monkeypatch.setattr(lca, "active_streams", 0)
+    return lca.app
+
+def _point_at(monkeypatch, llm_app):
+    """Sends legal_chat_async's Mistral API calls to `llm_app`."""
+    monkeypatch.setattr(lca, "clients", [
+        httpx.AsyncClient(transport=StreamingASGITransport(llm_app), base_url="http://llm", timeout=10.0)])
+
+async def _stub_stats(stub):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=stub), base_url="http://llm") as client:
+        return (await client.get("/stats")).json()
+
+async def _until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not await condition():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+def _client(transport):
+    return httpx.AsyncClient(transport=transport, base_url="http://test", timeout=10.0)
+
+@pytest.mark.anyio
+async def test_tokens_stream_as_they_are_generated(service, stub, monkeypatch):
+    _point_at(monkeypatch, stub)
+    arrivals, pieces = [], []
+    async with _client(StreamingASGITransport(service)) as client:
+        start = time.perf_counter()
+        async with client.stream("POST", "/legal-query", json={"query": "When is bail a right?"}) as response:
+            assert response.status_code == 200
+            async for text in response.aiter_text():
+                arrivals.append(time.perf_counter() - start)
+                pieces.append(text)
+
+    answer = "".join(pieces)
+    assert answer.startswith("This is a stub answer about: When is bail a right?")
+    assert len(answer.split()) == TOKENS
+    # One chunk per token, the first long before the last
+    assert len(pieces) >= TOKENS // 2
+    assert arrivals[0] < arrivals[-1] / 3
+    stats = await _stub_stats(stub)
+    assert (stats["completed"], stats["cancelled"]) == (1, 0)
+    assert lca.active_streams == 0
+
+@pytest.mark.anyio
+async def test_client_disconnect_cancels_the_llm_stream(service, stub, monkeypatch):
+    _point_at(monkeypatch, stub)
+    async with _client(StreamingASGITransport(service)) as client:
+        async with client.stream("POST", "/legal-query", json={"query": "What is anticipatory bail?"}) as response:
+            assert response.status_code == 200
+            received = 0
+            async for _ in response.aiter_text():
+                received += 1
+                if received == 3:
+                    break
+
+    async def cancelled():
+        return (await _stub_stats(stub))["cancelled"] == 1
+
+    await _until(cancelled)
+    stats = await _stub_stats(stub)
+    assert stats["completed"] == 0
+    assert stats["active"] == 0
+    assert stats["tokens_sent"] < TOKENS
+    assert lca.active_streams == 0
+
+@pytest.mark.anyio
+async def test_streams_past_max_streams_get_503(service, stub, monkeypatch):
+    _point_at(monkeypatch, stub)
+    monkeypatch.setattr(lca, "MAX_STREAMS", 1)
+    async with _client(StreamingASGITransport(service)) as client:
+        async with client.stream("POST", "/legal-query", json={"query": "first"}) as first:
+            assert first.status_code == 200
+            second = await client.post("/legal-query", json={"query": "second"})
+            assert second.status_code == 503
+            assert second.headers["Retry-After"] == "1"
+            advice = await client.post("/legal-advice", json={"query": "third"})
+            assert advice.status_code == 503
+            await first.aread()
+
+        # The finished stream gave its slot back
+        assert lca.active_streams == 0
+        assert (await client.post("/legal-advice", json={"query": "fourth"})).status_code == 200
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("path", ["/legal-query", "/legal-advice"])
+async def test_oversized_body_is_413(service, path, monkeypatch):
+    monkeypatch.setattr(lca, "MAX_REQUEST_BYTES", 100)
+    async with _client(httpx.ASGITransport(app=service)) as client:
+        response = await client.post(path, json={"query": "x" * 200})
+        assert response.status_code == 413
+        assert (await client.post(path, json={})).status_code == 400
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("path", ["/legal-query", "/legal-advice"])
+async def test_disconnect_before_the_answer_starts_is_499(service, stub, path, monkeypatch):
+    # The API takes its time to answer, so the client leaves while the call is pending
+    called = asyncio.Event()
+
+    async def slow_llm(scope, receive, send):
+        if scope["path"] == "/v1/chat/completions":
+            called.set()
+            await asyncio.sleep(30)
+        await stub(scope, receive, send)
+
+    _point_at(monkeypatch, slow_llm)
+    transport = StreamingASGITransport(service)
+    async with _client(transport) as client:
+        request = asyncio.create_task(client.post(path, json={"query": "Will the call be cancelled?"}))
+        await asyncio.wait_for(called.wait(), 5)
+        request.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await request
+
+    assert transport.statuses == [499]
+    assert lca.active_streams == 0
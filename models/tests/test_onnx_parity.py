@@ -0,0 +1,68 @@
+"""The exported ONNX model against the TorchScript model it came from."""
+import pytest
+import torch
+
+pytest.importorskip("onnxruntime")
+pytest.importorskip("onnx")
+
+from inference_backend import RESOLUTION, OnnxBackend, export_onnx, parity
+
+ATOL = 1e-3
+
+class StandIn(torch.nn.Module):
+    """A small conv net with the crime TCN's input and output shapes."""
+
+    def __init__(self):
+        super().__init__()
+        self.features = torch.nn.Sequential(
+            torch.nn.Conv2d(1, 8, 5, stride=4), torch.nn.BatchNorm2d(8), torch.nn.ReLU(),
+            torch.nn.Conv2d(8, 16, 3, stride=2), torch.nn.ReLU(), torch.nn.AdaptiveAvgPool2d(1),
+        )
+        self.head = torch.nn.Linear(16, 8)
+
+    def forward(self, x):
+        return self.head(torch.flatten(self.features(x), 1))
+
+@pytest.fixture(scope="module")
+def models(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("onnx")
+    torch.manual_seed(0)
+    model = StandIn().eval()
+    scripted = torch.jit.script(model)
+    model_path = str(directory / "stand_in.pt")
+    scripted.save(model_path)
+    onnx_path = export_onnx(model_path, str(directory / "stand_in.onnx"))
+    return scripted, model_path, onnx_path
+
+def _batch(size, seed):
+    generator = torch.Generator().manual_seed(seed)
+    return torch.rand((size, 1, RESOLUTION, RESOLUTION), generator=generator) * 2 - 1
+
+@pytest.mark.parametrize("size", [1, 7, 32])
+def test_logits_agree(models, size):
+    scripted, _, onnx_path = models
+    batch = _batch(size, seed=size)
+    with torch.no_grad():
+        expected = scripted(batch)
+    actual = OnnxBackend(onnx_path)(batch)
+
+    assert actual.shape == expected.shape
+    torch.testing.assert_close(actual, expected, atol=ATOL, rtol=1e-4)
+    assert torch.equal(actual.argmax(dim=1), expected.argmax(dim=1))
+
+def test_non_contiguous_input_is_copied_in(models):
+    scripted, _, onnx_path = models
+    batch = _batch(8, seed=1)
+    strided = batch.transpose(2, 3)
+    with torch.no_grad():
+        expected = scripted(strided.contiguous())
+
+    torch.testing.assert_close(OnnxBackend(onnx_path)(strided), expected, atol=ATOL, rtol=1e-4)
+
+def test_parity_report(models):
+    _, model_path, onnx_path = models
+    report = parity(model_path, onnx_path, atol=ATOL)
+
+    assert report["ok"], report
+    assert report["frames"] == 1 + 7 + 32
+    assert report["argmax_agreement"] == 1.0
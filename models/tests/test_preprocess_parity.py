@@ -0,0 +1,69 @@
+"""The fast luma path (FAST_PREPROCESS=1) against the torchvision transform the model was trained with."""
+import os
+
+import cv2
+import numpy as np
+import pytest
+import torch
+
+import video_inference
+from video_inference import BatchBuffer, luma_frame, preprocess_frame
+
+# The real model, when it is available; the stand-in below always runs
+MODEL_PATH = os.environ.get("PARITY_MODEL",
+                            os.path.join(os.path.dirname(os.path.abspath(video_inference.__file__)), "crime_tcn_jit.pt"))
+
+def synthetic_frames(count=8, width=1920, height=1080):
+    # Smooth gradients and shapes; random noise would only measure aliasing
+    frames = []
+    xs = np.linspace(0, 255, width, dtype=np.float32)
+    ys = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    for i in range(count):
+        frame = np.empty((height, width, 3), dtype=np.uint8)
+        frame[..., 0] = (xs * (i + 1) / count) % 256
+        frame[..., 1] = (ys + i * 20) % 256
+        frame[..., 2] = (xs + ys) / 2
+        cv2.circle(frame, (width // 3 + i * 40, height // 2), height // 5, (30 * i, 200, 90), -1)
+        frames.append(cv2.GaussianBlur(frame, (9, 9), 0))
+    return frames
+
+@pytest.fixture(scope="module")
+def frames():
+    return synthetic_frames()
+
+def _inputs(frames):
+    fast = BatchBuffer(len(frames)).fill([luma_frame(frame) for frame in frames]).clone()
+    reference = torch.cat([preprocess_frame(frame) for frame in frames])
+    return fast, reference
+
+def _stand_in_model():
+    torch.manual_seed(0)
+    return torch.nn.Sequential(
+        torch.nn.Conv2d(1, 8, 5, stride=2), torch.nn.ReLU(),
+        torch.nn.Conv2d(8, 16, 5, stride=2), torch.nn.ReLU(),
+        torch.nn.AdaptiveAvgPool2d(4), torch.nn.Flatten(), torch.nn.Linear(256, 8),
+    ).eval()
+
+def test_pixels_close(frames):
+    fast, reference = _inputs(frames)
+    diff = (fast - reference).abs()
+    max_diff, mean_diff = diff.max().item(), diff.mean().item()
+    # Normalised units: 2/255 per gray level. Interpolation differs only along edges
+    assert mean_diff < 0.005
+    assert max_diff < 0.1
+
+def _assert_same_predictions(model, frames):
+    fast, reference = _inputs(frames)
+    with torch.no_grad():
+        fast_logits, reference_logits = model(fast), model(reference)
+    assert torch.equal(fast_logits.argmax(dim=1), reference_logits.argmax(dim=1))
+    spread = (reference_logits.max() - reference_logits.min()).item()
+    assert (fast_logits - reference_logits).abs().max().item() < 0.05 * spread
+
+def test_stand_in_model_argmax_agrees(frames):
+    _assert_same_predictions(_stand_in_model(), frames)
+
+@pytest.mark.skipif(not os.path.exists(MODEL_PATH), reason=f"{MODEL_PATH} not available")
+def test_model_argmax_agrees(frames):
+    model = torch.jit.load(MODEL_PATH, map_location="cpu").eval()
+    _assert_same_predictions(model, frames)
@@ -0,0 +1,48 @@
+"""QueryCache against a vector store that is swapped out under it."""
+import gc
+import weakref
+
+from query_cache import QueryCache
+
+class Store:
+    """Stands in for a FAISS vector store; only its identity matters to the cache."""
+
+def test_repeated_query_is_a_hit():
+    cache, store = QueryCache(), Store()
+    assert cache.get("What is bail?", store) is None
+    cache.put("What is bail?", store, [0.1, 0.2], ["doc"])
+
+    assert cache.get("  what is BAIL ", store) == ([0.1, 0.2], ["doc"])
+    assert cache.stats()["hits"] == 1
+
+def test_new_store_empties_the_cache():
+    cache, old, new = QueryCache(), Store(), Store()
+    cache.get("q", old)
+    cache.put("q", old, [1.0], ["old doc"])
+
+    assert cache.get("q", new) is None
+    assert cache.stats()["entries"] == 0
+    assert cache.stats()["invalidations"] == 1
+    # Back to the old store: its entries are gone for good
+    assert cache.get("q", old) is None
+
+def test_result_from_a_replaced_store_is_not_stored():
+    cache, old, new = QueryCache(), Store(), Store()
+    cache.get("q", old)
+    # A request on the new index runs while the one above is still retrieving
+    cache.get("other", new)
+    cache.put("q", old, [1.0], ["old doc"])
+
+    assert cache.get("q", new) is None
+    assert cache.stats()["entries"] == 0
+
+def test_cache_does_not_keep_a_replaced_store_alive():
+    cache, store = QueryCache(), Store()
+    cache.get("q", store)
+    cache.put("q", store, [1.0], ["doc"])
+    ref = weakref.ref(store)
+
+    del store
+    gc.collect()
+    assert ref() is None
+    assert cache.get("q", Store()) is None
@@ -0,0 +1,12 @@
+"""Validation of the optional /predict form fields."""
+import pytest
+
+from video_inference import MAX_BATCH_SIZE, inference_options, timeline_options
+
+@pytest.mark.parametrize("parse", [inference_options, timeline_options])
+def test_batch_size_is_capped(parse):
+    assert parse({"batch_size": str(MAX_BATCH_SIZE)})["batch_size"] == MAX_BATCH_SIZE
+    with pytest.raises(ValueError, match="at most"):
+        parse({"batch_size": str(MAX_BATCH_SIZE + 1)})
+    with pytest.raises(ValueError, match="positive"):
+        parse({"batch_size": "0"})
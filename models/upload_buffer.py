@@ -0,0 +1,96 @@
+import hashlib
+import os
+import tempfile
+
+from flask import Request, jsonify
+
+# Largest upload accepted by /predict, anything bigger is answered with 413
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_MB", "256")) * 1024 * 1024
+
+# tmpfs mount used when memfd_create is unavailable
+SHM_DIR = "/dev/shm"
+
+def upload_file(suffix=".mp4"):
+    """Opens a private, anonymous file for one uploaded body.
+
+    Prefers a memfd (RAM-backed, no name on any filesystem), then a deleted-on-close
+    file in /dev/shm, then one in the regular temp dir. Every request gets its own
+    file, so concurrent uploads never share a path.
+    """
+    if hasattr(os, "memfd_create"):
+        try:
+            fd = os.memfd_create("upload", os.MFD_CLOEXEC)
+            return open(fd, "w+b")
+        except OSError:
+            pass
+
+    directory = SHM_DIR if os.access(SHM_DIR, os.W_OK) else None
+    return tempfile.NamedTemporaryFile(suffix=suffix, dir=directory)
+
+class HashingUpload:
+    """Wraps an upload file and hashes the body while Werkzeug writes it."""
+
+    def __init__(self, file):
+        self._file = file
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.sha256.update(data)
+        return self._file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+def upload_digest(file_storage):
+    """Returns the SHA-256 hex digest of an uploaded file's bytes."""
+    stream = file_storage.stream
+    if isinstance(stream, HashingUpload):
+        return stream.sha256.hexdigest()
+
+    digest = hashlib.sha256()
+    position = stream.tell()
+    stream.seek(0)
+    for chunk in iter(lambda: stream.read(1 << 20), b""):
+        digest.update(chunk)
+    stream.seek(position)
+    return digest.hexdigest()
+
+def upload_path(file_storage):
+    """Returns a path OpenCV/FFmpeg can open for an uploaded FileStorage (or a
+    file returned by `detach_upload`).
+
+    memfd-backed uploads are reached through /proc/<pid>/fd/<n>, which also works
+    from other processes of the same user as long as the file is open here.
+    """
+    stream = getattr(file_storage, "stream", file_storage)
+    stream.flush()
+    name = getattr(stream, "name", None)
+    if isinstance(name, str) and os.path.exists(name):
+        return name
+    return f"/proc/{os.getpid()}/fd/{stream.fileno()}"
+
+def detach_upload(file_storage):
+    """Returns a second handle on an upload that the caller must close.
+
+    Flask closes the request's files when the view returns, before a streamed
+    response body runs, so streaming generators read the upload through this
+    duplicated descriptor instead.
+    """
+    stream = file_storage.stream
+    stream.flush()
+    return open(os.dup(stream.fileno()), "rb")
+
+class UploadRequest(Request):
+    """Flask request that parses file fields straight into `upload_file()` buffers
+    instead of Werkzeug's default spooled temp files, hashing them on the way in."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HashingUpload(upload_file())
+
+def install_upload_handling(app, max_bytes=MAX_UPLOAD_BYTES):
+    app.request_class = UploadRequest
+    app.config["MAX_CONTENT_LENGTH"] = max_bytes
+
+    @app.errorhandler(413)
+    def upload_too_large(e):
+        return jsonify({"error": f"Upload exceeds the {max_bytes // (1024 * 1024)} MB limit"}), 413
@@ -1,15 +1,15 @@
-from flask import Flask, request, jsonify
-import torch
-import cv2
-from PIL import Image
-from collections import Counter
-import torchvision.transforms as transforms
-import os
-import time
+from flask import Flask, request, jsonify, Response, stream_with_context
+import json
 
-app = Flask(__name__)
+from upload_buffer import detach_upload, install_upload_handling, upload_digest, upload_path
+from result_cache import ResultCache
+from readiness import ServiceLoader, install_health_routes, WARMUP_ITERATIONS
+from metrics import install_metrics, observe_stage_times, timed, timed_stream
+from video_workers import VideoWorkerPool, VIDEO_WORKERS, segment_option
 
-RESOLUTION = 224 
+app = Flask(__name__)
+install_upload_handling(app)
+install_metrics(app, "video_classify")
 
 CLASS_MAPPING = {
     0: "Abuse",
@@ -22,72 +22,132 @@ CLASS_MAPPING = {
     7: "Normal"
 }
 
-transformer = transforms.Compose([
-    transforms.ToTensor(),
-    transforms.Normalize(mean=[0.5], std=[0.5]),
-    transforms.Resize((RESOLUTION, RESOLUTION))
-])
-
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 # repo_id = "namban4123/crimemodel"  
 # filename = "crime_tcn_jit.pt" 
 # scripted_model_path = hf_hub_download(repo_id=repo_id, filename=filename)
 
 # Load the model from local file
 scripted_model_path = "crime_tcn_jit.pt"
-model = torch.jit.load(scripted_model_path, map_location=device)
-model.to(device)
-model.eval()
-
-def preprocess_frame(frame):
-    frame_yuv = cv2.cvtColor(frame, cv2.COLOR_BGR2YUV)
-    Y_channel, _, _ = cv2.split(frame_yuv)
-    pil_frame = Image.fromarray(Y_channel)
-    input_tensor = transformer(pil_frame)
-    return input_tensor.unsqueeze(0)
-
-def infer_video(video_path):
-    cap = cv2.VideoCapture(video_path)
-    frame_predictions = []
-    start_time = time.time()
-    
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-        
-        input_tensor = preprocess_frame(frame)
-        with torch.no_grad():
-            output = model(input_tensor.to(device))
-            predicted = output.argmax(dim=1).item()
-            frame_predictions.append(predicted)
-    
-    cap.release()
+
+# Set by load_model_state() on the loader thread
+device = model = scheduler = worker_pool = MODEL_VERSION = None
+if VIDEO_WORKERS:
+    # Each worker process loads and warms up its own copy of the model.
+    # Forked here, before the loader and server threads exist.
+    worker_pool = VideoWorkerPool(scripted_model_path, CLASS_MAPPING)
+
+# Re-uploaded clips are answered from here instead of being classified again
+result_cache = ResultCache()
+
+def load_model_state():
+    # torch and the model are imported here so the port binds before they are loaded
+    global device, model, scheduler, MODEL_VERSION
+    from inference_backend import backend_version
+
+    MODEL_VERSION = backend_version(scripted_model_path)
+    if worker_pool is not None:
+        # Request parsing and vote merging still run in this process
+        import video_inference
+        worker_pool.wait_ready()
+        return
+
+    import torch
+    from inference_backend import load_backend
+    from inference_scheduler import InferenceScheduler, SCHEDULER_ENABLED
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    # TorchScript or ONNX Runtime, see INFERENCE_BACKEND
+    model = load_backend(scripted_model_path, device)
+    device = model.device
+
+    # Frames from concurrent /predict requests share forward passes through the scheduler
+    scheduler = InferenceScheduler(model, device).start() if SCHEDULER_ENABLED else None
+
+def warmup_model_state():
+    # Pool workers warm up in their own initializer
+    if model is not None:
+        from video_inference import warmup_model
+        warmup_model(model, device, iterations=WARMUP_ITERATIONS)
+
+# /readyz turns 200 once the model is loaded and warm
+loader = ServiceLoader("video_classify", load_model_state, warmup_model_state).start()
+install_health_routes(app, loader)
+
+def infer_video(video_path, segments=None, **options):
+    if worker_pool is not None:
+        return worker_pool.infer_video(video_path, segments=segments, **options)
+    from video_inference import infer_video as run_inference
+    return run_inference(scheduler or model, video_path, device, CLASS_MAPPING, **options)
+
+def stream_timeline(video_file, options):
+    """Streams per-window results as NDJSON while the video is still being classified."""
+    from video_inference import infer_timeline
     
-    if not frame_predictions:
-        return "Unknown", time.time() - start_time
+    upload = detach_upload(video_file)
     
-    final_prediction = Counter(frame_predictions).most_common(1)[0][0]
-    inference_time = time.time() - start_time
+    def generate():
+        try:
+            for entry in infer_timeline(scheduler or model, upload_path(upload), device, CLASS_MAPPING, **options):
+                yield json.dumps(entry) + "\n"
+        finally:
+            upload.close()
     
-    return CLASS_MAPPING.get(final_prediction, "Unknown"), inference_time
+    return Response(stream_with_context(timed_stream(generate())), mimetype="application/x-ndjson")
 
 @app.route('/predict', methods=['POST'])
 def predict():
-    if 'video' not in request.files:
+    from video_inference import inference_options, timeline_options, PREPROCESS_VERSION
+    
+    # The multipart body is parsed into the upload buffer on first access
+    with timed("upload_receive"):
+        files = request.files
+    if 'video' not in files:
         return jsonify({"error": "No video file provided"}), 400
     
-    video_file = request.files['video']
-    temp_video_path = "temp_video.mp4"
-    video_file.save(temp_video_path)
+    timeline = request.form.get("mode") == "timeline"
+    if timeline and worker_pool is not None:
+        return jsonify({"error": "Timeline mode is not available with VIDEO_WORKERS"}), 400
     
-    prediction, inference_time = infer_video(temp_video_path)
-    os.remove(temp_video_path)
+    try:
+        if timeline:
+            options = timeline_options(request.form)
+        else:
+            options = inference_options(request.form)
+            segments = segment_option(request.form)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not timeline and segments is not None and worker_pool is None:
+        return jsonify({"error": "'segments' needs worker processes (VIDEO_WORKERS > 0)"}), 400
     
-    return jsonify({
-        "predicted_class": prediction,
-        "inference_time": inference_time
-    })
+    # The upload lives in a per-request in-memory file, closed (and freed) here
+    video_file = files['video']
+    if timeline:
+        return stream_timeline(video_file, options)
+    
+    try:
+        cache_key = result_cache.key(upload_digest(video_file), MODEL_VERSION, PREPROCESS_VERSION,
+                                     {**options, "segments": segments})
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            return jsonify({**cached, "cached": True})
+        
+        result = infer_video(upload_path(video_file), segments=segments, **options)
+    finally:
+        video_file.close()
+    
+    observe_stage_times(result["stage_times"])
+    result_cache.put(cache_key, result)
+    return jsonify({**result, "cached": False})
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    return jsonify(result_cache.stats())
+
+@app.route('/scheduler_stats', methods=['GET'])
+def scheduler_stats():
+    if scheduler is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **scheduler.stats()})
 
 if __name__ == '__main__':
     app.run(host="0.0.0.0", port=5000)
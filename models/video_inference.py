@@ -0,0 +1,560 @@
+import math
+import os
+import time
+
+import threading
+
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+import torchvision.transforms as transforms
+
+from video_pipeline import FramePipeline, PREPROCESS_WORKERS
+
+RESOLUTION = 224
+
+# Number of frames sent through the model in one forward pass.
+# INFER_BATCH_SIZE=1 reproduces the old frame-by-frame behaviour.
+BATCH_SIZE = int(os.environ.get("INFER_BATCH_SIZE", "32"))
+# Largest batch_size a request may ask for; every batch preallocates batch_size x 1 x 224 x 224 floats
+MAX_BATCH_SIZE = int(os.environ.get("MAX_INFER_BATCH_SIZE", "256"))
+
+# Which frames of an upload get classified:
+#   all      - every frame (original behaviour)
+#   stride   - every `stride`-th frame, skipped frames are grabbed but never converted
+#   uniform  - `num_samples` frames spread evenly over the clip, reached by seeking
+#   keyframe - only I-frames (needs PyAV, otherwise ~1 frame per second of video)
+SAMPLING_POLICIES = ("all", "stride", "uniform", "keyframe")
+SAMPLING_POLICY = os.environ.get("SAMPLING_POLICY", "all")
+SAMPLING_STRIDE = int(os.environ.get("SAMPLING_STRIDE", "10"))
+SAMPLING_NUM_SAMPLES = int(os.environ.get("SAMPLING_NUM_SAMPLES", "64"))
+
+# Run decoding and preprocessing on background threads (see video_pipeline.py)
+PIPELINE_ENABLED = os.environ.get("INFER_PIPELINE", "1") == "1"
+
+# Use the PIL-free luma path below instead of the torchvision transform. Opt-in: its
+# INTER_AREA resize differs from the bilinear one the model was trained with
+# (see tests/test_preprocess_parity.py)
+FAST_PREPROCESS = os.environ.get("FAST_PREPROCESS", "0") == "1"
+
+# Bump when preprocessing output changes, cached results depend on it
+PREPROCESS_VERSION = "luma-area-v1" if FAST_PREPROCESS else "torchvision-v1"
+
+# Timeline mode: window length and hop in seconds (hop < window gives overlapping windows)
+TIMELINE_WINDOW_SECONDS = float(os.environ.get("TIMELINE_WINDOW_SECONDS", "2.0"))
+# Windows whose top class is not this one are listed as flagged in the summary
+NORMAL_CLASS = "Normal"
+
+# Minimum frames classified before the confidence-margin exit may fire
+EARLY_EXIT_MIN_FRAMES = int(os.environ.get("EARLY_EXIT_MIN_FRAMES", "32"))
+
+transformer = transforms.Compose([
+    transforms.ToTensor(),
+    transforms.Normalize(mean=[0.5], std=[0.5]),
+    transforms.Resize((RESOLUTION, RESOLUTION))
+])
+
+def preprocess_frame(frame):
+    frame_yuv = cv2.cvtColor(frame, cv2.COLOR_BGR2YUV)
+    Y_channel, _, _ = cv2.split(frame_yuv)
+    pil_frame = Image.fromarray(Y_channel)
+    input_tensor = transformer(pil_frame)
+    return input_tensor.unsqueeze(0)
+
+# Per-thread full-resolution luma scratch plane, reused while the input size is unchanged
+_scratch = threading.local()
+
+def luma_frame(frame, out=None):
+    """Returns the RESOLUTION x RESOLUTION uint8 luma plane of a BGR frame.
+
+    Only the Y plane is computed (BGR2GRAY uses the same weights as the Y of
+    BGR2YUV) and it is shrunk with INTER_AREA before any float conversion, so
+    nothing at full resolution is allocated once the scratch plane exists.
+    """
+    height, width = frame.shape[:2]
+    gray = getattr(_scratch, "gray", None)
+    if gray is None or gray.shape != (height, width):
+        gray = _scratch.gray = np.empty((height, width), dtype=np.uint8)
+    cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=gray)
+
+    if out is None:
+        out = np.empty((RESOLUTION, RESOLUTION), dtype=np.uint8)
+    cv2.resize(gray, (RESOLUTION, RESOLUTION), dst=out, interpolation=cv2.INTER_AREA)
+    return out
+
+class BatchBuffer:
+    """Preallocated (N, 1, RESOLUTION, RESOLUTION) float32 model input.
+
+    `fill` normalizes luma planes from `luma_frame` to [-1, 1] (the same as
+    Normalize(mean=0.5, std=0.5) after ToTensor) straight into the buffer and
+    returns a view of the filled rows. The view is overwritten by the next call.
+    """
+
+    def __init__(self, batch_size):
+        self.tensor = torch.empty((batch_size, 1, RESOLUTION, RESOLUTION), dtype=torch.float32)
+        self._array = self.tensor.numpy()
+
+    def fill(self, planes):
+        count = len(planes)
+        if count > self._array.shape[0]:
+            raise ValueError(f"Batch of {count} frames does not fit a buffer of {self._array.shape[0]}")
+        for row, plane in zip(self._array, planes):
+            np.multiply(plane, 2.0 / 255.0, out=row[0], casting="unsafe")
+            np.subtract(row[0], 1.0, out=row[0])
+        return self.tensor[:count]
+
+def predict_logits(model, batch, device):
+    """Runs one forward pass over an (N, 1, H, W) batch and returns the (N, C) logits."""
+    with torch.no_grad():
+        return model(batch.to(device))
+
+def predict_batch(model, batch, device):
+    """Runs one forward pass over an (N, 1, H, W) batch and returns the N class ids.
+
+    The ids stay on `device` so callers can keep accumulating without a sync.
+    """
+    return predict_logits(model, batch, device).argmax(dim=1)
+
+def warmup_model(model, device, batch_size=BATCH_SIZE, iterations=3):
+    """Pushes dummy frames through preprocessing and the model so the first real
+    request does not pay for TorchScript profiling, allocator growth or thread pool start.
+
+    Runs both a single-frame and a full batch, the two shapes live and /predict traffic use.
+    """
+    frame = np.zeros((480, 640, 3), dtype=np.uint8)
+    planes = [luma_frame(frame)] * batch_size
+    buffer = BatchBuffer(batch_size)
+    for _ in range(iterations):
+        for size in (1, batch_size):
+            predict_batch(model, buffer.fill(planes[:size]), device).cpu()
+
+def _iter_keyframes(video_path, stats, frame_range=None):
+    try:
+        import av
+    except ImportError:
+        return None
+
+    first, last = frame_range or (0, None)
+
+    def generate():
+        container = av.open(video_path)
+        try:
+            stream = container.streams.video[0]
+            stream.codec_context.skip_frame = "NONKEY"
+            fps = float(stream.average_rate or 0)
+            for av_frame in container.decode(stream):
+                stats["frames_decoded"] += 1
+                index = int(round(av_frame.time * fps)) if fps and av_frame.time is not None else 0
+                if index < first:
+                    continue
+                if last is not None and index >= last:
+                    break
+                yield av_frame.to_ndarray(format="bgr24")
+        finally:
+            container.close()
+
+    return generate()
+
+def iter_frames(video_path, stats, sampling="all", stride=SAMPLING_STRIDE, num_samples=SAMPLING_NUM_SAMPLES,
+                frame_range=None):
+    """Yields the BGR frames selected by `sampling` and counts them in `stats`.
+
+    `frame_range` = (start, end) restricts sampling to frames [start, end) of the
+    video. stats["frames_decoded"] counts every frame pulled from the decoder and
+    stats["frames_planned"] is how many frames will be yielded (None if unknown).
+    """
+    if sampling not in SAMPLING_POLICIES:
+        raise ValueError(f"Unknown sampling policy '{sampling}', expected one of {SAMPLING_POLICIES}")
+
+    if sampling == "keyframe":
+        keyframes = _iter_keyframes(video_path, stats, frame_range)
+        if keyframes is not None:
+            stats["frames_planned"] = None
+            yield from keyframes
+            return
+
+    cap = cv2.VideoCapture(video_path)
+    try:
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        first, last = frame_range or (0, None)
+        if total_frames > 0:
+            last = total_frames if last is None else min(last, total_frames)
+        span = last - first if last is not None else 0
+
+        if sampling == "keyframe":
+            # Without PyAV, approximate I-frame sampling with one frame per second
+            fps = cap.get(cv2.CAP_PROP_FPS)
+            sampling, stride = "stride", max(1, int(round(fps))) if fps > 0 else SAMPLING_STRIDE
+
+        if sampling == "uniform" and span > 0:
+            count = min(max(1, int(num_samples)), span)
+            positions = sorted({first + int(i * span / count) for i in range(count)})
+            stats["frames_planned"] = len(positions)
+            for position in positions:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, position)
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                stats["frames_decoded"] += 1
+                yield frame
+            return
+
+        # "uniform" on a stream without a frame count degrades to a stride
+        if sampling == "uniform":
+            sampling, stride = "stride", SAMPLING_STRIDE
+
+        stride = max(1, int(stride)) if sampling == "stride" else 1
+        stats["frames_planned"] = math.ceil(span / stride) if span > 0 else None
+
+        if first:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, first)
+
+        index = first
+        while cap.isOpened() and (last is None or index < last):
+            if (index - first) % stride:
+                if not cap.grab():
+                    break
+                stats["frames_decoded"] += 1
+                index += 1
+                continue
+
+            ret, frame = cap.read()
+            if not ret:
+                break
+            stats["frames_decoded"] += 1
+            index += 1
+            yield frame
+    finally:
+        cap.release()
+
+def _sequential_frames(frames, preprocess, timings):
+    """Single-threaded counterpart of FramePipeline with the same output and timings."""
+    index = 0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                frame = next(frames)
+            except StopIteration:
+                return
+            decoded = time.perf_counter()
+            tensor = preprocess(frame)
+            timings["decode"] += decoded - start
+            timings["preprocess"] += time.perf_counter() - decoded
+            yield index, tensor
+            index += 1
+    finally:
+        frames.close()
+
+def _preprocessing(batch_size):
+    """Returns the (per-frame preprocess, batch collate) pair in use."""
+    if FAST_PREPROCESS:
+        return luma_frame, BatchBuffer(batch_size).fill
+    return preprocess_frame, torch.cat
+
+def _frame_source(frames, preprocess, pipelined, workers, timings):
+    """Returns an iterator of (index, preprocessed frame) and the pipeline behind it, if any."""
+    if pipelined:
+        pipeline = FramePipeline(frames, preprocess, workers=workers).start()
+        return iter(pipeline), pipeline
+    return _sequential_frames(frames, preprocess, timings), None
+
+def should_stop_early(votes, classified, remaining, margin=None, min_frames=EARLY_EXIT_MIN_FRAMES):
+    """Decides whether the vote is settled.
+
+    Stops when the leading class cannot be overtaken by the frames still to come,
+    or, if `margin` is given, when the leader's share of the vote beats the runner-up
+    by at least `margin` after `min_frames` frames.
+    """
+    ranked = sorted(votes, reverse=True)
+    top = ranked[0] if ranked else 0
+    second = ranked[1] if len(ranked) > 1 else 0
+
+    if remaining is not None and top - second > remaining:
+        return True
+
+    if margin is not None and classified >= min_frames and classified > 0:
+        return (top - second) / classified >= margin
+
+    return False
+
+def infer_video(model, video_path, device, class_mapping, batch_size=BATCH_SIZE,
+                sampling=SAMPLING_POLICY, stride=SAMPLING_STRIDE, num_samples=SAMPLING_NUM_SAMPLES,
+                early_exit=False, margin=None, min_frames=EARLY_EXIT_MIN_FRAMES,
+                pipelined=PIPELINE_ENABLED, preprocess_workers=PREPROCESS_WORKERS, frame_range=None):
+    """Classifies the sampled frames of a video in mini-batches and takes a majority vote.
+
+    Returns a dict with the predicted class, the elapsed time, frame counters and
+    the busy seconds spent in each stage.
+    """
+    batch_size = max(1, int(batch_size))
+    start_time = time.time()
+    stats = {"frames_decoded": 0, "frames_planned": None}
+    timings = {"decode": 0.0, "preprocess": 0.0, "inference": 0.0}
+
+    preprocess, collate = _preprocessing(batch_size)
+
+    num_classes = len(class_mapping)
+    votes = torch.zeros(num_classes, dtype=torch.long, device=device)
+    classified = 0
+    stopped_early = False
+    pending = []
+
+    def flush():
+        collate_start = time.perf_counter()
+        batch = collate(pending)
+        forward_start = time.perf_counter()
+        timings["preprocess"] += forward_start - collate_start
+        preds = predict_batch(model, batch, device)
+        votes.add_(torch.bincount(preds, minlength=num_classes)[:num_classes])
+        timings["inference"] += time.perf_counter() - forward_start
+        return len(pending)
+
+    frames = iter_frames(video_path, stats, sampling=sampling, stride=stride, num_samples=num_samples,
+                         frame_range=frame_range)
+    tensors, pipeline = _frame_source(frames, preprocess, pipelined, preprocess_workers, timings)
+
+    try:
+        for _, tensor in tensors:
+            pending.append(tensor)
+            if len(pending) < batch_size:
+                continue
+
+            classified += flush()
+            pending = []
+
+            if early_exit:
+                planned = stats["frames_planned"]
+                remaining = planned - classified if planned is not None else None
+                if should_stop_early(votes.tolist(), classified, remaining, margin, min_frames):
+                    stopped_early = True
+                    break
+    finally:
+        tensors.close()
+        if pipeline is not None:
+            pipeline.close()
+            timings["decode"] = pipeline.timings["decode"]
+            timings["preprocess"] += pipeline.timings["preprocess"]
+
+    if pending:
+        classified += flush()
+
+    result = {
+        "predicted_class": "Unknown",
+        "inference_time": 0.0,
+        "sampling": sampling,
+        "frames_decoded": stats["frames_decoded"],
+        "frames_classified": classified,
+        "early_exit": stopped_early,
+        "stage_times": timings,
+        "votes": votes.tolist(),
+    }
+
+    if classified:
+        # Single device -> host transfer for the final vote
+        final_prediction = int(votes.argmax().item())
+        result["predicted_class"] = class_mapping.get(final_prediction, "Unknown")
+
+    result["inference_time"] = time.time() - start_time
+    return result
+
+def _video_fps(video_path):
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    cap.release()
+    return fps if fps and fps > 0 else 25.0
+
+def infer_timeline(model, video_path, device, class_mapping, window_seconds=TIMELINE_WINDOW_SECONDS,
+                   hop_seconds=None, stride=1, batch_size=BATCH_SIZE, summary=True,
+                   pipelined=PIPELINE_ENABLED, preprocess_workers=PREPROCESS_WORKERS):
+    """Classifies fixed-length time windows of a video, yielding each one as soon as it is complete.
+
+    Every yielded dict is one window with the mean class probabilities of its
+    frames; with `summary` a final dict carries the overall vote and the windows
+    whose top class is not NORMAL_CLASS. Every `stride`-th frame is classified.
+    """
+    batch_size = max(1, int(batch_size))
+    stride = max(1, int(stride))
+    window = float(window_seconds)
+    hop = float(hop_seconds or window_seconds)
+    if window <= 0 or hop <= 0:
+        raise ValueError("Window and hop must be positive")
+
+    start_time = time.time()
+    fps = _video_fps(video_path)
+    stats = {"frames_decoded": 0, "frames_planned": None}
+    timings = {"decode": 0.0, "preprocess": 0.0, "inference": 0.0}
+    preprocess, collate = _preprocessing(batch_size)
+
+    num_classes = len(class_mapping)
+    labels = [class_mapping.get(i, "Unknown") for i in range(num_classes)]
+    votes = [0] * num_classes
+    classified = 0
+    flagged = []
+    # window number -> [summed probabilities, frame count]
+    open_windows = {}
+    next_window = 0
+
+    def windows_at(t):
+        first = max(0, math.floor((t - window) / hop) + 1)
+        return [k for k in range(first, math.floor(t / hop) + 1) if k * hop <= t < k * hop + window]
+
+    def classify(batch):
+        collate_start = time.perf_counter()
+        inputs = collate([plane for _, plane in batch])
+        forward_start = time.perf_counter()
+        timings["preprocess"] += forward_start - collate_start
+        probs = torch.softmax(predict_logits(model, inputs, device).float(), dim=1)[:, :num_classes].cpu()
+        timings["inference"] += time.perf_counter() - forward_start
+
+        for (index, _), row in zip(batch, probs):
+            votes[int(row.argmax())] += 1
+            for k in windows_at(index * stride / fps):
+                entry = open_windows.setdefault(k, [torch.zeros(num_classes), 0])
+                entry[0] += row
+                entry[1] += 1
+        return len(batch)
+
+    def close_windows(until):
+        nonlocal next_window
+        while open_windows and next_window * hop + window <= until:
+            k = next_window
+            next_window += 1
+            entry = open_windows.pop(k, None)
+            if entry is None:
+                continue
+            distribution = (entry[0] / entry[1]).tolist()
+            top_class = labels[max(range(num_classes), key=distribution.__getitem__)]
+            if top_class != NORMAL_CLASS:
+                flagged.append(k)
+            yield {
+                "type": "window",
+                "window": k,
+                "start": round(k * hop, 3),
+                "end": round(k * hop + window, 3),
+                "frames": entry[1],
+                "top_class": top_class,
+                "distribution": {label: round(p, 4) for label, p in zip(labels, distribution)},
+                "elapsed": time.time() - start_time,
+            }
+
+    frames = iter_frames(video_path, stats, sampling="stride" if stride > 1 else "all", stride=stride)
+    tensors, pipeline = _frame_source(frames, preprocess, pipelined, preprocess_workers, timings)
+
+    # Pipeline workers may finish frames out of order; windows need them in order
+    reorder = {}
+    expected = 0
+    pending = []
+    try:
+        for index, plane in tensors:
+            reorder[index] = plane
+            while expected in reorder:
+                pending.append((expected, reorder.pop(expected)))
+                expected += 1
+            while len(pending) >= batch_size:
+                batch, pending = pending[:batch_size], pending[batch_size:]
+                classified += classify(batch)
+                yield from close_windows(batch[-1][0] * stride / fps)
+
+        if pending:
+            classified += classify(pending)
+        yield from close_windows(math.inf)
+    finally:
+        tensors.close()
+        if pipeline is not None:
+            pipeline.close()
+            timings["decode"] = pipeline.timings["decode"]
+            timings["preprocess"] += pipeline.timings["preprocess"]
+
+    if summary:
+        yield {
+            "type": "summary",
+            "predicted_class": labels[max(range(num_classes), key=votes.__getitem__)] if classified else "Unknown",
+            "votes": votes,
+            "windows": next_window,
+            "flagged_windows": flagged,
+            "frames_decoded": stats["frames_decoded"],
+            "frames_classified": classified,
+            "stage_times": timings,
+            "inference_time": time.time() - start_time,
+        }
+
+def timeline_options(form):
+    """Reads the window / hop / stride / summary fields of a timeline /predict request."""
+    options = {}
+    for key, name in (("window", "window_seconds"), ("hop", "hop_seconds")):
+        if key in form:
+            options[name] = float(form[key])
+            if options[name] <= 0:
+                raise ValueError(f"'{key}' must be a positive number of seconds")
+    for key in ("stride", "batch_size"):
+        if key in form:
+            options[key] = int(form[key])
+            if options[key] < 1:
+                raise ValueError(f"'{key}' must be a positive integer")
+    if options.get("batch_size", 0) > MAX_BATCH_SIZE:
+        raise ValueError(f"'batch_size' must be at most {MAX_BATCH_SIZE}")
+    if "summary" in form:
+        options["summary"] = _parse_bool(form["summary"])
+    if "pipelined" in form:
+        options["pipelined"] = _parse_bool(form["pipelined"])
+    return options
+
+def merge_results(results, class_mapping, start_time):
+    """Combines per-segment infer_video results into one vote over the whole video."""
+    votes = [0] * len(class_mapping)
+    merged = {
+        "predicted_class": "Unknown",
+        "inference_time": 0.0,
+        "sampling": results[0]["sampling"] if results else SAMPLING_POLICY,
+        "frames_decoded": 0,
+        "frames_classified": 0,
+        "early_exit": False,
+        "stage_times": {"decode": 0.0, "preprocess": 0.0, "inference": 0.0},
+        "segments": len(results),
+    }
+    for result in results:
+        votes = [a + b for a, b in zip(votes, result["votes"])]
+        merged["frames_decoded"] += result["frames_decoded"]
+        merged["frames_classified"] += result["frames_classified"]
+        merged["early_exit"] = merged["early_exit"] or result["early_exit"]
+        for stage, seconds in result["stage_times"].items():
+            merged["stage_times"][stage] = merged["stage_times"].get(stage, 0.0) + seconds
+
+    merged["votes"] = votes
+    if merged["frames_classified"]:
+        merged["predicted_class"] = class_mapping.get(max(range(len(votes)), key=votes.__getitem__), "Unknown")
+    merged["inference_time"] = time.time() - start_time
+    return merged
+
+def _parse_bool(value):
+    return str(value).strip().lower() in ("1", "true", "yes", "on")
+
+def inference_options(form):
+    """Reads the optional sampling / early-exit fields of a /predict request.
+
+    Raises ValueError on malformed values so the route can answer 400.
+    """
+    options = {}
+    if "sampling" in form:
+        if form["sampling"] not in SAMPLING_POLICIES:
+            raise ValueError(f"'sampling' must be one of {', '.join(SAMPLING_POLICIES)}")
+        options["sampling"] = form["sampling"]
+    for key in ("batch_size", "stride", "num_samples", "min_frames"):
+        if key in form:
+            options[key] = int(form[key])
+            if options[key] < 1:
+                raise ValueError(f"'{key}' must be a positive integer")
+    if options.get("batch_size", 0) > MAX_BATCH_SIZE:
+        raise ValueError(f"'batch_size' must be at most {MAX_BATCH_SIZE}")
+    if "pipelined" in form:
+        options["pipelined"] = _parse_bool(form["pipelined"])
+    if "early_exit" in form:
+        options["early_exit"] = _parse_bool(form["early_exit"])
+    if "margin" in form:
+        options["margin"] = float(form["margin"])
+        if not 0.0 < options["margin"] <= 1.0:
+            raise ValueError("'margin' must be in (0, 1]")
+        options.setdefault("early_exit", True)
+    return options
@@ -0,0 +1,146 @@
+import os
+import queue
+import threading
+import time
+
+# Frames/tensors allowed in flight between stages before the producer blocks
+QUEUE_SIZE = int(os.environ.get("PIPELINE_QUEUE_SIZE", "64"))
+PREPROCESS_WORKERS = int(os.environ.get("PREPROCESS_WORKERS", "2"))
+
+# Marks the end of a stage's output
+_DONE = object()
+
+class FramePipeline:
+    """Decodes and preprocesses frames on background threads.
+
+    A decoder thread pulls frames from `frames` into a bounded queue, a small pool
+    of workers runs `preprocess` on them, and iterating the pipeline yields
+    (frame_index, tensor) pairs to the caller, which acts as the inference stage.
+    Full queues block the upstream stage, so a slow model throttles decoding
+    instead of buffering the whole video. Tensors may arrive out of order when
+    more than one worker is used.
+
+    The first exception raised by any stage stops all stages and is re-raised
+    from the iterator. `close()` stops and joins every thread; call it (or use
+    the pipeline as a context manager) when the consumer exits early.
+    """
+
+    def __init__(self, frames, preprocess, workers=PREPROCESS_WORKERS, queue_size=QUEUE_SIZE):
+        self._frames = frames
+        self._preprocess = preprocess
+        self._workers = max(1, int(workers))
+        self._raw = queue.Queue(maxsize=max(1, queue_size))
+        self._ready = queue.Queue(maxsize=max(1, queue_size))
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._error = None
+        self._threads = []
+        # Busy seconds per stage, summed over the stage's threads
+        self.timings = {"decode": 0.0, "preprocess": 0.0}
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def start(self):
+        self._threads.append(threading.Thread(target=self._decode, name="pipeline-decode", daemon=True))
+        for i in range(self._workers):
+            self._threads.append(
+                threading.Thread(target=self._preprocess_worker, name=f"pipeline-preprocess-{i}", daemon=True)
+            )
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def close(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def __iter__(self):
+        finished = 0
+        while finished < self._workers:
+            item = self._get(self._ready)
+            if item is None:
+                break
+            if item is _DONE:
+                finished += 1
+                continue
+            yield item
+
+        if self._error is not None:
+            raise self._error
+
+    def _fail(self, exc):
+        with self._lock:
+            if self._error is None:
+                self._error = exc
+        self._stop.set()
+
+    def _put(self, q, item):
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return None
+
+    def _decode(self):
+        frames = iter(self._frames)
+        index = 0
+        try:
+            while not self._stop.is_set():
+                start = time.perf_counter()
+                try:
+                    frame = next(frames)
+                except StopIteration:
+                    break
+                finally:
+                    self.timings["decode"] += time.perf_counter() - start
+
+                if not self._put(self._raw, (index, frame)):
+                    break
+                index += 1
+        except Exception as e:
+            self._fail(e)
+        finally:
+            # Generators must be closed by the thread that runs them
+            close = getattr(frames, "close", None)
+            if close is not None:
+                close()
+            for _ in range(self._workers):
+                self._put(self._raw, _DONE)
+
+    def _preprocess_worker(self):
+        busy = 0.0
+        try:
+            while True:
+                item = self._get(self._raw)
+                if item is None or item is _DONE:
+                    break
+
+                index, frame = item
+                start = time.perf_counter()
+                tensor = self._preprocess(frame)
+                busy += time.perf_counter() - start
+
+                if not self._put(self._ready, (index, tensor)):
+                    break
+        except Exception as e:
+            self._fail(e)
+        finally:
+            with self._lock:
+                self.timings["preprocess"] += busy
+            self._put(self._ready, _DONE)
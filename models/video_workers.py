@@ -0,0 +1,125 @@
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+
+# Number of model worker processes; 0 keeps inference in the web process
+VIDEO_WORKERS = int(os.environ.get("VIDEO_WORKERS", "0"))
+# torch intra-op threads per worker, by default the cores split evenly
+WORKER_THREADS = int(os.environ.get("WORKER_THREADS", "0"))
+# Segments a single video is split into; 0 means one per worker
+VIDEO_SEGMENTS = int(os.environ.get("VIDEO_SEGMENTS", "0"))
+# Videos shorter than this per segment are not split
+MIN_SEGMENT_FRAMES = int(os.environ.get("MIN_SEGMENT_FRAMES", "300"))
+
+# Per-process state, set by _init_worker
+_model = None
+_device = None
+
+def _init_worker(model_path, threads, initialized):
+    # torch is only imported in the workers, so importing this module stays cheap
+    global _model, _device
+    import torch
+    from inference_backend import load_backend
+    from readiness import WARMUP_ITERATIONS
+    from video_inference import warmup_model
+
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+    # Decoding threads would compete with the other workers' cores
+    cv2.setNumThreads(1)
+
+    _device = torch.device("cpu")
+    _model = load_backend(model_path, _device, threads=threads)
+    warmup_model(_model, _device, iterations=WARMUP_ITERATIONS)
+    initialized.release()
+
+def _ping():
+    return os.getpid()
+
+def _classify(video_path, class_mapping, frame_range, options):
+    from video_inference import infer_video
+    return infer_video(_model, video_path, _device, class_mapping, frame_range=frame_range, **options)
+
+def split_frames(total_frames, segments):
+    """Splits [0, total_frames) into `segments` contiguous (start, end) ranges."""
+    bounds = [round(i * total_frames / segments) for i in range(segments + 1)]
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+def segment_option(form):
+    """Reads the optional 'segments' field of a /predict request."""
+    if "segments" not in form:
+        return None
+    segments = int(form["segments"])
+    if segments < 1:
+        raise ValueError("'segments' must be a positive integer")
+    return segments
+
+class VideoWorkerPool:
+    """Runs infer_video in N processes that each hold one copy of the model.
+
+    Whole videos are dispatched to whichever worker is free; long videos can also
+    be cut into frame ranges that are classified in parallel and merged into one
+    vote. Workers are forked eagerly at construction, so create the pool at import
+    time, before the web server starts its threads. They load and warm up the model
+    in the background; `wait_ready()` blocks until all of them are done.
+    """
+
+    def __init__(self, model_path, class_mapping, workers=VIDEO_WORKERS, threads=WORKER_THREADS,
+                 segments=VIDEO_SEGMENTS):
+        self.workers = max(1, int(workers))
+        self.threads = int(threads) or max(1, (os.cpu_count() or 1) // self.workers)
+        self.segments = int(segments) or self.workers
+        self.class_mapping = class_mapping
+        context = multiprocessing.get_context("fork")
+        # Released once by every worker after its model is loaded and warm
+        self._initialized = context.Semaphore(0)
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(model_path, self.threads, self._initialized),
+        )
+        # With fork, the first submit starts every worker, each loading the model in _init_worker
+        self._started = self._executor.submit(_ping)
+
+    def wait_ready(self):
+        for _ in range(self.workers):
+            while not self._initialized.acquire(timeout=1.0):
+                # A worker whose initializer failed breaks the pool and fails this future
+                if self._started.done() and self._started.exception() is not None:
+                    raise self._started.exception()
+        return True
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+    def infer_video(self, video_path, segments=None, **options):
+        from video_inference import SAMPLING_NUM_SAMPLES, merge_results
+
+        start_time = time.time()
+        segments = segments or self.segments
+
+        cap = cv2.VideoCapture(video_path)
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        cap.release()
+
+        if segments > 1 and total_frames >= segments * MIN_SEGMENT_FRAMES:
+            ranges = split_frames(total_frames, segments)
+            # "Cannot be overtaken" only holds for the whole video, not for one segment
+            options["early_exit"] = False
+            options["num_samples"] = math.ceil(options.get("num_samples", SAMPLING_NUM_SAMPLES) / len(ranges))
+        else:
+            ranges = [None]
+
+        futures = [
+            self._executor.submit(_classify, video_path, self.class_mapping, frame_range, options)
+            for frame_range in ranges
+        ]
+        return merge_results([future.result() for future in futures], self.class_mapping, start_time)